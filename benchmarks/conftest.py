@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Configure shared fixtures for the deity benchmarks."""
+
+import random
+import string
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+
+from deity import encode_all
+from deity.database import close_connection
+from deity.database import create_connection
+from deity.utils import create_df_sql
+from tests.conftest import identifier
+from tests.conftest import random_diagnosis
+
+
+pytest.importorskip("pytest_benchmark")
+
+
+def synthetic_filename(ext: str = "svs") -> str:
+    """Random filename with an identifier, like the test fixtures."""
+    return (
+        f"{identifier()}_part-{random.choice(string.ascii_uppercase)}_"
+        f"{random_diagnosis().replace(' ', '-')}_"
+        f"{random.randint(0, 40):02d}x_{random.randint(0, 999):03d}.{ext}"
+    )
+
+
+def make_tree(root: Path, num_files: int, depth: int, fanout: int = 3) -> List[str]:
+    """Create empty files spread over a directory tree of the given depth."""
+    dirs = [root]
+    for _level in range(depth):
+        dirs = [elem.joinpath(f"d{idx}") for elem in dirs for idx in range(fanout)]
+        dirs = random.sample(dirs, min(len(dirs), 50))
+
+    file_list = []
+    for idx in range(num_files):
+        filepath = dirs[idx % len(dirs)].joinpath(synthetic_filename())
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.touch()
+        file_list.append(filepath.as_posix())
+    return file_list
+
+
+@pytest.fixture()
+def runner() -> CliRunner:
+    """Fixture for invoking command-line interfaces."""
+    return CliRunner()
+
+
+@pytest.fixture(scope="session")
+def filenames() -> List[str]:
+    """10,000 synthetic filenames."""
+    random.seed(0)
+    np.random.seed(0)
+    return [synthetic_filename() for _ in range(10_000)]
+
+
+@pytest.fixture(scope="session")
+def deep_tree(tmp_path_factory) -> Path:
+    """Directory tree eight levels deep with 5,000 files."""
+    root = tmp_path_factory.mktemp("tree")
+    make_tree(root, num_files=5_000, depth=8)
+    return root
+
+
+@pytest.fixture(scope="session")
+def df_sql(filenames) -> pd.DataFrame:
+    """Encoded filenames ready for the database."""
+    _df_file_rename, df_sql = create_df_sql(encode_all(filenames), "specimens")
+    return df_sql
+
+
+@pytest.fixture(scope="session")
+def decode_db(tmp_path_factory) -> Path:
+    """Database and encoded files for 100,000 rows."""
+    root = tmp_path_factory.mktemp("decode")
+    data_dir = root.joinpath("data")
+    file_list = make_tree(data_dir, num_files=100_000, depth=2)
+    _df_file_rename, df_sql = create_df_sql(encode_all(file_list), "specimens")
+    for old_filepath, filepath in zip(df_sql["old_filepath"], df_sql["filepath"]):
+        Path(old_filepath).rename(filepath)
+
+    database_file = root.joinpath("deity.db")
+    conn = create_connection(database_file)
+    df_sql.to_sql("specimens", conn, index_label="id")
+    close_connection(conn)
+    return database_file
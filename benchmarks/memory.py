@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""Peak memory of deity entry points on synthetic inputs of increasing size.
+
+Each case is measured in a fresh interpreter, twice per size: once for the growth of
+peak RSS (``resource.getrusage``), and once under ``tracemalloc`` for the peak of
+traced allocations, since tracing inflates RSS. Memory per file is the slope
+between the smallest and largest size, so fixed costs such as imports cancel out.
+The heap freed by loading the inputs is returned to the system first where the C
+library allows it (glibc), as runs reusing it would otherwise show no growth. Cases
+that still reuse memory held by Python are only measured under ``tracemalloc``::
+
+    python -m benchmarks.memory run --save
+    python -m benchmarks.memory run --compare-fail 20
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Tuple
+
+import click
+import numpy as np
+import pandas as pd
+import yaml
+
+from benchmarks.conftest import make_tree
+from benchmarks.conftest import synthetic_filename
+from deity import create_contact_sheet
+from deity import encode_all
+from deity.__main__ import cli as deity_cli
+from deity.database import close_connection
+from deity.database import create_connection
+from deity.decode import decode_all
+from deity.utils import create_df_sql
+
+
+METRICS = ["rss", "traced"]
+
+
+class Case(NamedTuple):
+    """Inputs written by ``prepare``, loaded unmeasured by ``load``, then ``run``."""
+
+    sizes: Tuple[int, ...]
+    prepare: Callable[[Path, int], None]
+    load: Callable[[Path], tuple]
+    run: Callable[..., object]
+    metrics: Tuple[str, ...] = tuple(METRICS)
+
+
+def prepare_filenames(workdir: Path, size: int) -> None:
+    paths = [f"/data/{synthetic_filename()}" for _ in range(size)]
+    workdir.joinpath("files.txt").write_text("\n".join(paths))
+
+
+def load_filenames(workdir: Path) -> tuple:
+    return (workdir.joinpath("files.txt").read_text().splitlines(),)
+
+
+def prepare_encoded(workdir: Path, size: int) -> None:
+    prepare_filenames(workdir, size)
+    encode_all(*load_filenames(workdir)).to_pickle(workdir.joinpath("encoded.pkl"))
+
+
+def load_encoded(workdir: Path) -> tuple:
+    return pd.read_pickle(workdir.joinpath("encoded.pkl")), "specimens"
+
+
+def prepare_database(workdir: Path, size: int) -> None:
+    file_list = make_tree(workdir.joinpath("data"), num_files=size, depth=2)
+    _df_file_rename, df_sql = create_df_sql(encode_all(file_list), "specimens")
+    for old_filepath, filepath in zip(df_sql["old_filepath"], df_sql["filepath"]):
+        Path(old_filepath).rename(filepath)
+
+    conn = create_connection(workdir.joinpath("deity.db"))
+    df_sql.to_sql("specimens", conn, index_label="id")
+    close_connection(conn)
+
+
+def load_database(workdir: Path) -> tuple:
+    return workdir.joinpath("deity.db"), "specimens", None, True
+
+
+def prepare_labels(workdir: Path, size: int) -> None:
+    conf_dir = Path(create_contact_sheet.__file__).parent.joinpath("conf")
+    config = yaml.safe_load(conf_dir.joinpath("contact_sheet.yaml").read_text())
+    config["font"] = "default"
+    workdir.joinpath("contact_sheet.yaml").write_text(yaml.safe_dump(config))
+    pd.DataFrame(
+        {
+            "filename": [synthetic_filename() for _ in range(size)],
+            "accession": "",
+            "part": "A",
+            "stain": "HE",
+            "abbrev": "Hippocampus",
+        }
+    ).to_csv(workdir.joinpath("labels.csv"), index=False)
+
+
+def load_labels(workdir: Path) -> tuple:
+    args = [
+        str(workdir.joinpath("labels.csv")),
+        "--config",
+        str(workdir.joinpath("contact_sheet.yaml")),
+        "--dry-run",
+        "--log-mode",
+        "plain",
+    ]
+    return (args,)
+
+
+def run_contact_sheet(args: List[str]) -> None:
+    create_contact_sheet.main.main(args, standalone_mode=False)
+
+
+def prepare_tree(workdir: Path, size: int) -> None:
+    make_tree(workdir.joinpath("data"), num_files=size, depth=2)
+
+
+def load_export(workdir: Path) -> tuple:
+    # each run exports into an empty directory
+    output_dir = workdir.joinpath("output")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    output_dir.mkdir()
+    # the log file is written to the working directory
+    os.chdir(workdir)
+    args = [
+        str(workdir.joinpath("data")),
+        "--export-mode",
+        "copy",
+        "--output-dir",
+        str(output_dir),
+        "--database-file",
+        str(output_dir.joinpath("deity.db")),
+        "--chunk-size",
+        "1000",
+        "--log-mode",
+        "plain",
+    ]
+    return (args,)
+
+
+def run_cli(args: List[str]) -> None:
+    deity_cli.main(args, standalone_mode=False)
+
+
+CASES: Dict[str, Case] = {
+    "encode_all": Case((2_000, 8_000), prepare_filenames, load_filenames, encode_all),
+    # RSS does not grow, since both reuse the memory freed by loading their inputs
+    "create_df_sql": Case(
+        (10_000, 40_000), prepare_encoded, load_encoded, create_df_sql, ("traced",)
+    ),
+    "decode_all": Case(
+        (2_000, 8_000), prepare_database, load_database, decode_all, ("traced",)
+    ),
+    # encode, insert and export through the command line, in chunks of 1000 files
+    "cli_export": Case((2_000, 8_000), prepare_tree, load_export, run_cli),
+    # one sheet holds 154 labels
+    "create_contact_sheet": Case(
+        (38, 154), prepare_labels, load_labels, run_contact_sheet
+    ),
+}
+
+
+def max_rss() -> int:
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def trim_heap() -> None:
+    """Return free heap memory to the system, if the C library supports it (glibc)."""
+    try:
+        ctypes.CDLL(ctypes.util.find_library("c")).malloc_trim(0)
+    except (AttributeError, OSError):
+        pass
+
+
+def reset_max_rss() -> None:
+    """Reset the peak RSS to the current RSS, if the kernel supports it (Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def measure_case(name: str, workdir: Path, metric: str) -> int:
+    """Run a case once in this process and return the bytes used by metric."""
+    case = CASES[name]
+    args = case.load(workdir)
+    gc.collect()
+    if metric == "traced":
+        tracemalloc.start()
+        case.run(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    # otherwise the peak of importing and loading would hide smaller runs
+    trim_heap()
+    reset_max_rss()
+    before = max_rss()
+    case.run(*args)
+    return max_rss() - before
+
+
+def measure_subprocess(name: str, workdir: Path, metric: str) -> int:
+    """Run a case in a new interpreter, so peak RSS starts from a clean slate."""
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-m", "benchmarks.memory", "measure", name, str(workdir)]
+        + ["--metric", metric],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return int(result.stdout.strip().splitlines()[-1])
+
+
+def run_case(name: str, tmp_dir: Path) -> dict:
+    """Measure a case at each of its sizes.
+
+    :return: The sizes, the bytes of each metric of the case per size and the bytes
+        per file.
+    """
+    case = CASES[name]
+    result: dict = {"sizes": list(case.sizes)}
+    for size in case.sizes:
+        random.seed(size)
+        np.random.seed(size)
+        workdir = tmp_dir.joinpath(f"{name}-{size}")
+        workdir.mkdir()
+        case.prepare(workdir, size)
+        for metric in case.metrics:
+            used = measure_subprocess(name, workdir, metric)
+            result.setdefault(metric, []).append(used)
+
+    num_files = case.sizes[-1] - case.sizes[0]
+    for metric in case.metrics:
+        used = result[metric]
+        result[f"{metric}_per_file"] = round((used[-1] - used[0]) / num_files, 1)
+    return result
+
+
+def find_regressions(
+    results: dict, baseline: dict, threshold: float, min_bytes: float
+) -> List[str]:
+    """Describe each per-file metric exceeding the baseline by more than threshold.
+
+    :param threshold: Allowed increase in percent.
+    :param min_bytes: Increases per file smaller than this are noise.
+    """
+    regressions = []
+    for name, result in results.items():
+        for metric in (f"{elem}_per_file" for elem in METRICS):
+            old = baseline.get(name, {}).get(metric)
+            new = result.get(metric)
+            if old is None or new is None or new - old < min_bytes:
+                continue
+            if new > old * (1 + threshold / 100):
+                regressions.append(f"{name} {metric}: {old:.0f} -> {new:.0f} bytes")
+    return regressions
+
+
+def report(results: dict) -> None:
+    """Print peak RSS growth and traced allocations per size and per file.
+
+    Metrics a case is not measured by are shown as "-".
+    """
+    click.echo(f"{'case':<22}{'size':>8}{'rss MiB':>10}{'traced MiB':>12}")
+    for name, result in results.items():
+        for idx, size in enumerate(result["sizes"]):
+            rss, traced = (
+                f"{result[metric][idx] / 2**20:.1f}" if metric in result else "-"
+                for metric in METRICS
+            )
+            click.echo(f"{name:<22}{size:>8}{rss:>10}{traced:>12}")
+        rss, traced = (
+            f"{result[f'{metric}_per_file']:.0f}B" if metric in result else "-"
+            for metric in METRICS
+        )
+        click.echo(f"{name:<22}{'per file':>8}{rss:>10}{traced:>12}")
+
+
+@click.group()
+def cli() -> None:
+    """Memory benchmarks of deity."""
+
+
+@cli.command("measure")
+@click.argument("name", type=click.Choice(list(CASES)))
+@click.argument("workdir", type=click.Path(exists=True, path_type=Path))
+@click.option("--metric", default="rss", type=click.Choice(METRICS))
+def measure(name: str, workdir: Path, metric: str) -> None:
+    """Print the bytes used by one run of case NAME on the inputs in WORKDIR."""
+    click.echo(measure_case(name, workdir, metric))
+
+
+@cli.command("run")
+@click.option(
+    "--case", "names", multiple=True, type=click.Choice(list(CASES)), help="Case"
+)
+@click.option(
+    "--storage",
+    default=".benchmarks/memory.json",
+    type=click.Path(path_type=Path),
+    help="Results of the last saved run",
+)
+@click.option("--save", is_flag=True, help="Save the results if there's no regression")
+@click.option(
+    "--compare-fail",
+    default=None,
+    type=click.FloatRange(min=0),
+    help="Fail if memory per file grew by more than this percentage",
+)
+@click.option(
+    "--min-bytes",
+    default=64.0,
+    type=click.FloatRange(min=0),
+    help="Ignore increases smaller than this many bytes per file",
+)
+def run(
+    names: Tuple[str, ...],
+    storage: Path,
+    save: bool = False,
+    compare_fail: float = None,
+    min_bytes: float = 64.0,
+) -> None:
+    """Measure the cases and compare the memory per file with the saved run."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = {name: run_case(name, Path(tmp_dir)) for name in names or CASES}
+    report(results)
+
+    if compare_fail is not None and storage.exists():
+        baseline = json.loads(storage.read_text())
+        regressions = find_regressions(results, baseline, compare_fail, min_bytes)
+        if regressions:
+            raise click.ClickException(
+                "Memory per file regressed:\n" + "\n".join(regressions)
+            )
+
+    if save:
+        storage.parent.mkdir(parents=True, exist_ok=True)
+        baseline = json.loads(storage.read_text()) if storage.exists() else {}
+        storage.write_text(json.dumps({**baseline, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    cli()
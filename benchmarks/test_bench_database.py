@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Benchmarks for the mapping database and decoding."""
+
+import random
+
+from deity.database import close_connection
+from deity.database import create_connection
+from deity.database import create_update_sql
+from deity.decode import decode_all
+
+
+def test_insert(benchmark, df_sql, tmp_path) -> None:
+    """Insert 10,000 rows into a new database."""
+    benchmark.group = "database"
+    output_file = tmp_path.joinpath("deity.db")
+
+    def setup():
+        output_file.unlink(missing_ok=True)
+        conn = create_connection(output_file)
+        return (df_sql, "specimens", conn, output_file), {}
+
+    benchmark.pedantic(create_update_sql, setup=setup, rounds=5)
+
+
+def test_lookup(benchmark, df_sql) -> None:
+    """Look up 1,000 identifiers by short hash."""
+    benchmark.group = "database"
+    conn = create_connection(":memory:")
+    df_sql.to_sql("specimens", conn, index_label="id")
+    short_hashes = random.sample(list(df_sql["accession_short_hash"]), 1_000)
+    query = "SELECT accession FROM specimens WHERE accession_short_hash = ?"
+
+    def lookup():
+        return [conn.execute(query, (elem,)).fetchone() for elem in short_hashes]
+
+    results = benchmark(lookup)
+    assert all(results)
+    close_connection(conn)
+
+
+def test_decode_all(benchmark, decode_db) -> None:
+    """Plan the decoding of 100,000 files (dry run)."""
+    benchmark.group = "decode"
+    benchmark.pedantic(
+        decode_all,
+        args=(decode_db, "specimens"),
+        kwargs={"dry_run": True},
+        rounds=3,
+    )
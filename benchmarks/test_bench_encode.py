@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Benchmarks for encoding filenames and walking directories."""
+
+from deity import encode
+from deity import encode_all
+from deity import encode_batch
+from deity import encode_single
+from deity.utils import get_file_list
+
+
+def test_encode(benchmark) -> None:
+    """Hash a single identifier."""
+    benchmark.group = "encode"
+    benchmark(encode, "SHA-00-54321")
+
+
+def test_encode_single(benchmark, filenames) -> None:
+    """Encode a single filename."""
+    benchmark.group = "encode"
+    benchmark(encode_single, filenames[0])
+
+
+def test_encode_all(benchmark, filenames) -> None:
+    """Encode 10,000 filenames one at a time."""
+    benchmark.group = "encode-10k"
+    df = benchmark.pedantic(encode_all, args=(filenames,), rounds=3)
+    assert len(df) == len(filenames)
+
+
+def test_encode_batch(benchmark, filenames) -> None:
+    """Encode 10,000 filenames column-wise."""
+    benchmark.group = "encode-10k"
+    df = benchmark.pedantic(encode_batch, args=(filenames,), rounds=3)
+    assert len(df) == len(filenames)
+
+
+def test_get_file_list(benchmark, deep_tree) -> None:
+    """Glob 5,000 files in a tree eight levels deep."""
+    benchmark.group = "walk"
+    file_list = benchmark(get_file_list, deep_tree, "svs,jpg")
+    assert len(file_list) == 5_000
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Benchmarks for QR code rendering and contact sheets."""
+
+from pathlib import Path
+
+import pandas as pd
+import yaml
+
+from benchmarks.conftest import synthetic_filename
+from deity import create_contact_sheet
+from deity.barcodes.create_qr import convert_qr_to_pil
+from deity.barcodes.create_qr import create_qr_single
+
+
+def render_qr(text: str):
+    """Create a QR code and convert it to a PIL image."""
+    qr_code = create_qr_single(text, encode=True, error="L")
+    return convert_qr_to_pil(qr_code, border=0, scale=3)
+
+
+def test_render_qr(benchmark, filenames) -> None:
+    """Render a single QR code."""
+    benchmark.group = "render"
+    img = benchmark(render_qr, filenames[0])
+    assert img.mode == "RGB"
+
+
+def test_contact_sheet(benchmark, runner, tmp_path) -> None:
+    """Generate a full sheet of 154 labels (dry run)."""
+    benchmark.group = "render"
+    conf_dir = Path(create_contact_sheet.__file__).parent.joinpath("conf")
+    config = yaml.safe_load(conf_dir.joinpath("contact_sheet.yaml").read_text())
+    config["font"] = "default"
+    config_file = tmp_path.joinpath("contact_sheet.yaml")
+    config_file.write_text(yaml.safe_dump(config))
+
+    input_file = tmp_path.joinpath("labels.csv")
+    pd.DataFrame(
+        {
+            "filename": [synthetic_filename() for _ in range(154)],
+            "accession": "",
+            "part": "A",
+            "stain": "HE",
+            "abbrev": "Hippocampus",
+        }
+    ).to_csv(input_file, index=False)
+
+    args = [str(input_file), "--config", str(config_file), "--dry-run"]
+    result = benchmark.pedantic(
+        runner.invoke, args=(create_contact_sheet.main, args), rounds=3
+    )
+    assert result.exit_code == 0, result.exception
@@ -150,7 +150,7 @@ def safety(session: Session) -> None:
 def mypy(session: Session) -> None:
     """Type-check using mypy."""
     args = session.posargs or ["src", "tests", "docs/conf.py"]
-    session.install(".")
+    session.install(".[dataframes]")
     session.install("mypy", "pytest")
     session.run("mypy", *args)
     if not session.posargs:
@@ -160,7 +160,7 @@ def mypy(session: Session) -> None:
 @session(python=python_versions)
 def tests(session: Session) -> None:
     """Run the test suite."""
-    session.install(".")
+    session.install(".[dataframes]")
     session.install("coverage[toml]", "pytest", "pygments")
     try:
         session.run("coverage", "run", "--parallel", "-m", "pytest", *session.posargs)
@@ -182,10 +182,61 @@ def coverage(session: Session) -> None:
     session.run("coverage", *args)
 
 
+def on_main(session: Session) -> bool:
+    """Whether the checkout is on the main branch."""
+    branch = session.run(
+        "git", "rev-parse", "--abbrev-ref", "HEAD", external=True, silent=True
+    )
+    return bool(branch) and branch.strip() == "main"
+
+
+@session(python=python_versions[0])
+def benchmarks(session: Session) -> None:
+    """Run the benchmark suite and compare with the baseline of the main branch.
+
+    Only passing runs on main replace the baseline, so slowdowns below the threshold
+    on other branches cannot add up in it.
+    """
+    storage = Path(".benchmarks")
+    baseline = storage.joinpath("baseline.json")
+    latest = storage.joinpath("latest.json")
+    storage.mkdir(exist_ok=True)
+    save = False
+    args = list(session.posargs)
+    if not args:
+        save = on_main(session)
+        if baseline.exists():
+            args = [f"--benchmark-compare={baseline}", "--benchmark-compare-fail=mean:20%"]
+        else:
+            session.warn(f"No baseline in {baseline}, run the session on main to save one")
+        if save:
+            args += ["--benchmark-autosave", f"--benchmark-json={latest}"]
+    session.install(".[dataframes]")
+    session.install("pytest", "pytest-benchmark", "pygments")
+    session.run("pytest", "benchmarks", f"--benchmark-storage={storage}", *args)
+    if save:
+        os.replace(latest, baseline)
+
+
+@session(python=python_versions[0])
+def memory(session: Session) -> None:
+    """Measure memory per file and compare with the saved run of the main branch.
+
+    Only runs on main are saved, so increases below the threshold on other branches
+    cannot add up in the baseline.
+    """
+    args = session.posargs or ["--compare-fail=20"]
+    if not session.posargs and on_main(session):
+        args.append("--save")
+    session.install(".[dataframes]")
+    session.install("pytest", "pytest-benchmark")
+    session.run("python", "-m", "benchmarks.memory", "run", *args)
+
+
 @session(python=python_versions[0])
 def typeguard(session: Session) -> None:
     """Runtime type checking using Typeguard."""
-    session.install(".")
+    session.install(".[dataframes]")
     session.install("pytest", "typeguard", "pygments")
     session.run("pytest", f"--typeguard-packages={package}", *session.posargs)
 
@@ -200,7 +251,7 @@ def xdoctest(session: Session) -> None:
         if "FORCE_COLOR" in os.environ:
             args.append("--colored=1")
 
-    session.install(".")
+    session.install(".[dataframes]")
     session.install("xdoctest[colors]")
     session.run("python", "-m", "xdoctest", *args)
 
@@ -212,7 +263,7 @@ def docs_build(session: Session) -> None:
     if not session.posargs and "FORCE_COLOR" in os.environ:
         args.insert(0, "--color")
 
-    session.install(".")
+    session.install(".[dataframes]")
     session.install("sphinx", "sphinx-click", "furo", "myst-parser")
 
     build_dir = Path("docs", "_build")
@@ -226,7 +277,7 @@ def docs_build(session: Session) -> None:
 def docs(session: Session) -> None:
     """Build and serve the documentation with live reloading on file changes."""
     args = session.posargs or ["--open-browser", "docs", "docs/_build"]
-    session.install(".")
+    session.install(".[dataframes]")
     session.install("sphinx", "sphinx-autobuild", "sphinx-click", "furo", "myst-parser")
 
     build_dir = Path("docs", "_build")
@@ -1,27 +1,20 @@
 """DeITy: De Identification Toolkit."""
+
 from importlib import metadata
 
 from loguru import logger
-from rich.console import Console
-from rich.logging import RichHandler
 
 from deity.encode import encode
 from deity.encode import encode_all
+from deity.encode import encode_batch
+from deity.encode import encode_series
 from deity.encode import encode_single
+from deity.log import configure_logging
+from deity.session import Deidentifier
 
 
 __version__ = metadata.version(__package__)
 
-logger.configure(
-    handlers=[
-        {
-            "sink": RichHandler(
-                markup=True,
-                level="INFO",
-                console=Console(width=120, color_system="auto"),
-            ),
-            "format": "[blue]{function}[/blue]: {message}",
-        }
-    ]
-)
+logger.remove()
+configure_logging()
 del metadata  # optional, avoids polluting the results of dir(__package__)
@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 """__main__.py in src/deity."""
+
+import importlib.util
+import os
 from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Iterator
 from typing import Optional
+from typing import Tuple
 
 import click
 from dotenv import find_dotenv
@@ -10,14 +16,472 @@ from loguru import logger
 
 from deity import __version__
 from deity import database
+from deity import profiling
+from deity import progress
+from deity import scheduler
+from deity.core import encode_paths
+from deity.core import encode_to_database
+from deity.core import sql_columns
+from deity.database.merge import CONFLICT_MODES
 from deity.decode import decode_all
-from deity.encode import encode_all
+from deity.dedup import DEDUP_MODES
+from deity.dedup import drop_duplicates
+from deity.dedup import fingerprint_files
+from deity.dedup import link_duplicates
+from deity.dedup import split_duplicates
+from deity.export import EXPORT_MODES
+from deity.export import export_checksums
+from deity.export import export_files
+from deity.log import MODES
+from deity.log import configure_logging
+from deity.log import shutdown_logging
+from deity.ontology.matcher import RegionMatcher
+from deity.utils import SHARD_KEYS
 from deity.utils import create_df_sql
 from deity.utils import get_file_list
-from deity.utils import rename_files
+from deity.utils import rename_pairs
+from deity.utils import select_shard
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from deity.records import EncodedRecords
+
+
+def setup_logging(log_mode: str = "rich", log_to_file: bool = True) -> None:
+    """Configure logging until the current command exits."""
+    log_file = None
+    if log_to_file:
+        project_dir = Path(__file__).resolve().parents[2]
+        log_file = project_dir.joinpath("logs", f"{Path(__file__).stem}.log")
+    configure_logging(log_mode, log_file=log_file, max_repeats=3)
+    click.get_current_context().call_on_close(shutdown_logging)
+
+
+def setup_reporting(
+    profile: Optional[Path] = None,
+    progress_file: Optional[Path] = None,
+    progress_format: str = "jsonl",
+    progress_interval: float = 5.0,
+) -> None:
+    """Enable profiling and progress events until the current command exits."""
+    ctx = click.get_current_context()
+    if profile is not None:
+        profiler = profiling.start_profile()
+        ctx.call_on_close(lambda: profiling.stop_profile(profiler, profile))
+
+    if progress_file is not None:
+        progress.configure(
+            progress_file, fmt=progress_format, interval=progress_interval
+        )
+        ctx.call_on_close(progress.disable)
+
+
+def setup_io(
+    workers: int = 8,
+    io_ops: Optional[float] = None,
+    io_mbps: Optional[float] = None,
+) -> None:
+    """Limit file operations until the current command exits."""
+    scheduler.configure(max_workers=workers, ops_per_s=io_ops, mb_per_s=io_mbps)
+    click.get_current_context().call_on_close(scheduler.disable)
+
+
+class DefaultGroup(click.Group):
+    """Group that runs ``default_command`` when the first argument is not a command.
+
+    This keeps ``deity INPUT_DIR [OPTIONS]`` working next to the subcommands.
+    """
+
+    def __init__(self, *args, default_command: str = "encode", **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx: click.Context, args: list) -> list:
+        reserved = (*ctx.help_option_names, "--version")
+        if args and args[0] not in self.commands and args[0] not in reserved:
+            args = [self.default_command, *args]
+        return super().parse_args(ctx, args)
+
+
+def parse_shard(
+    ctx: click.Context, param: click.Parameter, value: Optional[str]
+) -> Optional[Tuple[int, int]]:
+    """Parse a K/N shard option into (K, N)."""
+    if value is None:
+        return None
+    try:
+        index, num_shards = (int(elem) for elem in value.split("/"))
+    except ValueError:
+        raise click.BadParameter("Expected K/N, e.g. 0/4") from None
+    if not 0 <= index < num_shards:
+        raise click.BadParameter(f"Shard index must be in [0, {num_shards})")
+    return index, num_shards
+
+
+def check_options(
+    export_mode: str = "rename",
+    output_dir: Optional[Path] = None,
+    dedup: Optional[str] = None,
+    pipeline: bool = False,
+    decode: bool = False,
+    shard: Optional[Tuple[int, int]] = None,
+    plan_file: Optional[Path] = None,
+    shard_by: str = "dir",
+) -> None:
+    """Raise a usage error for options that cannot be combined."""
+    if export_mode != "rename" and output_dir is None:
+        raise click.UsageError("--export-mode requires --output-dir")
+    # skipped duplicates would keep their identifiers in place
+    if dedup and export_mode == "rename":
+        raise click.UsageError(f"--dedup {dedup} requires --export-mode")
+    if shard and shard_by == "path" and output_dir is None:
+        raise click.UsageError("--shard-by path requires --output-dir")
+    # apply renames the planned files, it doesn't copy or link them
+    if plan_file is not None and (export_mode != "rename" or dedup):
+        raise click.UsageError(
+            "--plan cannot be combined with --export-mode or --dedup"
+        )
+    if pipeline and (decode or export_mode != "rename" or dedup or shard or plan_file):
+        raise click.UsageError(
+            "--pipeline cannot be combined with --decode, --export-mode, --dedup, "
+            "--shard or --plan"
+        )
+
+
+def require_pandas(**options: object) -> None:
+    """Raise a usage error if options that build DataFrames are used without pandas.
+
+    :param options: Whether each option, by name, is used.
+    """
+    used = [name for name, value in options.items() if value]
+    if used and importlib.util.find_spec("pandas") is None:
+        raise click.UsageError(
+            f"{', '.join(used)} requires pandas, installed with "
+            "pip install deity[dataframes]"
+        )
+
+
+def load_region_matcher(ontology: Optional[Path] = None) -> Optional[RegionMatcher]:
+    """Build a region matcher from an ontology file, if given."""
+    if ontology is None:
+        return None
+
+    from deity.ontology.snapshot import load_ontology
+
+    return RegionMatcher.from_dataframe(load_ontology(ontology))
+
+
+def encode_in_place(
+    file_list: list,
+    table_name: str,
+    database_file: Path,
+    pattern: Optional[str] = None,
+    output_dir: Optional[Path] = None,
+    ontology: Optional[Path] = None,
+    chunk_size: int = 10_000,
+    dry_run: bool = False,
+) -> None:
+    """Encode files into a new database, then rename them, without pandas."""
+    rows = encode_paths(
+        file_list,
+        pattern=pattern,
+        output_dir=output_dir,
+        region_matcher=load_region_matcher(ontology),
+    )
+    # the database is only written if it doesn't exist
+    if dry_run or database_file.exists():
+        with profiling.timer("encode"):
+            if not any(row[0] is not None for row in rows):
+                logger.error("No files were encoded")
+                raise ValueError("No files were encoded")
+        return
+
+    logger.info(f"Creating {database_file}")
+    columns = sql_columns(table_name, regions=ontology is not None)
+    with profiling.timer("encode"):
+        renames = encode_to_database(
+            rows, table_name, database_file, columns, chunk_size
+        )
+    with profiling.timer("rename"):
+        rename_pairs(renames, total=len(renames))
+
+
+def encode_files(
+    file_list: list,
+    input_dir: Path,
+    pattern: Optional[str] = None,
+    output_dir: Optional[Path] = None,
+    ontology: Optional[Path] = None,
+    export_mode: str = "rename",
+) -> "EncodedRecords":
+    """Encode files into compact records, mirrored under output_dir when exporting."""
+    from deity.records import encode_records
+
+    region_matcher = load_region_matcher(ontology)
+    with profiling.timer("encode"):
+        records = encode_records(
+            file_list,
+            pattern=pattern,
+            output_dir=output_dir,
+            region_matcher=region_matcher,
+        )
+    if export_mode != "rename":
+        records = records.mirror(input_dir, output_dir)
+
+    if not records.matched.any():
+        logger.error("No files were encoded")
+        raise ValueError("No files were encoded")
+
+    return records
+
+
+def iter_encoded(
+    records: "EncodedRecords", table_name: str, chunk_size: int = 10_000
+) -> Iterator[Tuple["pd.DataFrame", "pd.DataFrame"]]:
+    """Yield the ``create_df_sql`` output of chunk_size records at a time."""
+    for start in range(0, len(records), chunk_size):
+        with profiling.timer("dataframe"):
+            df = records.to_dataframe(start, start + chunk_size)
+            chunk = create_df_sql(df, table_name)
+        yield chunk
+
+
+class ChunkExporter:
+    """Export chunks of renames in order with ``export_encoded``.
+
+    The first copies of duplicates are kept, with their content hash, so duplicates
+    in later chunks are linked to them.
+    """
+
+    def __init__(
+        self,
+        export_mode: str,
+        workers: int = 8,
+        fingerprints: Optional["pd.DataFrame"] = None,
+    ) -> None:
+        self.export_mode = export_mode
+        self.workers = workers
+        self.fingerprints = fingerprints
+        self.first_copies = (
+            set(fingerprints["duplicate_of"].dropna())
+            if fingerprints is not None
+            else set()
+        )
+        self.sources: Optional["pd.DataFrame"] = None
+
+    def __call__(self, df_file_rename: "pd.DataFrame") -> Optional["pd.Series"]:
+        """Export a chunk, returning its content hashes for checksum exports."""
+        import pandas as pd
+
+        checksums = export_encoded(
+            df_file_rename,
+            self.export_mode,
+            self.workers,
+            self.fingerprints,
+            self.sources,
+        )
+        if self.first_copies:
+            is_first = [
+                os.path.abspath(elem) in self.first_copies
+                for elem in df_file_rename["old_filepath"]
+            ]
+            sources = df_file_rename.loc[is_first, ["old_filepath", "new_filepath"]]
+            if checksums is not None:
+                sources["content_md5"] = checksums[is_first]
+            self.sources = pd.concat([self.sources, sources])
+        return checksums
+
+
+def save_encoded(
+    records: "EncodedRecords",
+    table_name: str,
+    database_file: Path,
+    export_mode: str = "auto",
+    workers: int = 8,
+    fingerprints: Optional["pd.DataFrame"] = None,
+    chunk_size: int = 10_000,
+) -> None:
+    """Insert the rows into a new database, then export the files.
+
+    Records are converted to DataFrames chunk_size at a time. Checksum exports copy
+    the files of each chunk first, so the content hashes can be stored in the
+    content_md5 column.
+    """
+    # the database is only written if it doesn't exist
+    if database_file.exists():
+        return
+
+    export = ChunkExporter(export_mode, workers, fingerprints)
+    chunks = iter_encoded(records, table_name, chunk_size)
+    if export_mode == "checksum":
+        frames = (
+            df_sql.assign(content_md5=export(df_file_rename))
+            for df_file_rename, df_sql in chunks
+        )
+    else:
+        frames = (df_sql for _, df_sql in chunks)
+
+    logger.info(f"Creating {database_file}")
+    conn = database.create_connection(database_file)
+    with profiling.timer("database"):
+        database.insert_frames(
+            frames, table_name, conn, output_file=database_file, total=len(records)
+        )
+
+    if export_mode != "checksum":
+        for df_file_rename, _ in iter_encoded(records, table_name, chunk_size):
+            export(df_file_rename)
+
+
+def export_encoded(
+    df_file_rename: "pd.DataFrame",
+    export_mode: str,
+    workers: int = 8,
+    fingerprints: Optional["pd.DataFrame"] = None,
+    sources: Optional["pd.DataFrame"] = None,
+) -> Optional["pd.Series"]:
+    """Export files, hardlinking duplicates to the export of their first copy.
+
+    :param sources: First copies exported earlier, with old_filepath, new_filepath
+        and for checksum exports content_md5 columns, whose duplicates are linked.
+    :return: The content hash of each file for checksum exports, else None.
+    """
+    import pandas as pd
+
+    if sources is None:
+        sources = df_file_rename.iloc[:0].assign(content_md5=None)
+    df_export, df_links = split_duplicates(
+        pd.concat([sources[["old_filepath", "new_filepath"]], df_file_rename]),
+        fingerprints,
+    )
+    # the first copies were exported with their own chunk
+    df_export = df_export.drop(index=sources.index)
+
+    checksums = None
+    with profiling.timer("export"):
+        if export_mode == "checksum":
+            checksums = pd.Series(
+                export_checksums(df_export, workers=workers),
+                index=df_export.index,
+                dtype=object,
+            )
+        else:
+            export_files(df_export, mode=export_mode, workers=workers)
+        link_duplicates(df_links)
+
+    if checksums is not None:
+        known = pd.concat([sources["content_md5"], checksums])
+        duplicates = known.loc[df_links["source_index"]].to_numpy()
+        checksums = pd.concat(
+            [checksums, pd.Series(duplicates, index=df_links.index)]
+        ).reindex(df_file_rename.index)
+    return checksums
+
+
+def select_files(
+    file_list: list,
+    input_dir: Path,
+    database_file: Path,
+    shard: Optional[Tuple[int, int]] = None,
+    shard_by: str = "dir",
+) -> Tuple[list, Path]:
+    """Keep the files of a shard and name its database, if sharding."""
+    if shard is None:
+        return file_list, database_file
+
+    file_list = select_shard(file_list, input_dir, shard, by=shard_by)
+    database_file = database_file.with_name(
+        f"{database_file.stem}.shard-{shard[0]}-of-{shard[1]}{database_file.suffix}"
+    )
+    return file_list, database_file
+
+
+def find_duplicates(
+    file_list: list,
+    dedup: Optional[str] = None,
+    fingerprint_file: Optional[Path] = None,
+) -> Tuple[list, Optional["pd.DataFrame"]]:
+    """Fingerprint files if deduplicating, dropping duplicates in skip mode."""
+    if dedup is None:
+        return file_list, None
 
+    with profiling.timer("dedup"):
+        fingerprints = fingerprint_files(file_list, fingerprint_file)
+    if dedup == "skip":
+        return drop_duplicates(file_list, fingerprints), None
+    return file_list, fingerprints
 
-@click.command()
+
+def encode_and_save(
+    file_list: list,
+    input_dir: Path,
+    table_name: str,
+    database_file: Path,
+    pattern: Optional[str] = None,
+    output_dir: Optional[Path] = None,
+    ontology: Optional[Path] = None,
+    export_mode: str = "rename",
+    workers: int = 8,
+    fingerprints: Optional["pd.DataFrame"] = None,
+    plan_file: Optional[Path] = None,
+    chunk_size: int = 10_000,
+    dry_run: bool = False,
+) -> None:
+    """Rename in place with the core engine, or plan or export with records."""
+    if export_mode == "rename" and plan_file is None:
+        encode_in_place(
+            file_list,
+            table_name,
+            database_file,
+            pattern,
+            output_dir,
+            ontology,
+            chunk_size,
+            dry_run,
+        )
+        return
+
+    if plan_file is not None:
+        from deity.plan import check_database
+
+        # fail before encoding, as write_plan would
+        check_database(database_file, table_name)
+
+    records = encode_files(
+        file_list, input_dir, pattern, output_dir, ontology, export_mode
+    )
+    if plan_file is not None:
+        from deity.plan import write_plan_chunks
+
+        write_plan_chunks(
+            plan_file,
+            iter_encoded(records, table_name, chunk_size),
+            len(records),
+            table_name,
+            database_file,
+            chunk_size,
+        )
+    elif not dry_run:
+        save_encoded(
+            records,
+            table_name,
+            database_file,
+            export_mode,
+            workers,
+            fingerprints,
+            chunk_size,
+        )
+
+
+@click.group(cls=DefaultGroup)
+@click.version_option(__version__)
+def cli() -> None:
+    """Encode or decode files (default command), or apply a saved plan."""
+
+
+@cli.command("encode")
 @click.argument(
     "input-dir", type=click.Path(exists=True, path_type=Path, resolve_path=True)
 )
@@ -37,8 +501,127 @@ from deity.utils import rename_files
     type=click.STRING,
     help="Pattern",
 )
+@click.option(
+    "--ontology",
+    default=None,
+    type=click.Path(exists=True, path_type=Path),
+    help="Ontology CSV or JSON used to tag brain regions in filenames",
+)
+@click.option(
+    "--export-mode",
+    default="rename",
+    type=click.Choice(EXPORT_MODES),
+    help="Rename files in place, or mirror the tree in --output-dir with hardlinks, "
+    "reflinks or copies (auto picks the cheapest that works). checksum copies "
+    "and stores each file's md5 in the database",
+)
+@click.option(
+    "--workers",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Maximum files exported, renamed or checked concurrently",
+)
+@click.option(
+    "--io-ops",
+    default=None,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Maximum file operations per second, to limit the load on shared storage",
+)
+@click.option(
+    "--io-mbps",
+    default=None,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Maximum megabytes per second exported",
+)
+@click.option(
+    "--dedup",
+    default=None,
+    type=click.Choice(DEDUP_MODES),
+    help="With --export-mode, skip byte-identical duplicates, or hardlink them to "
+    "the first exported copy",
+)
+@click.option(
+    "--fingerprints",
+    "fingerprint_file",
+    default=None,
+    type=click.Path(path_type=Path),
+    help="SQLite cache of file fingerprints used by --dedup",
+)
+@click.option(
+    "--pipeline",
+    is_flag=True,
+    help="Walk, encode, write and rename concurrently in a staged pipeline",
+)
+@click.option(
+    "--encode-workers",
+    default=2,
+    type=click.IntRange(min=1),
+    help="Batches encoded concurrently with --pipeline",
+)
+@click.option(
+    "--batch-size",
+    default=1000,
+    type=click.IntRange(min=1),
+    help="Files per batch with --pipeline",
+)
 @click.option("--decode", is_flag=True, help="Decode files instead of encoding")
 @click.option("--dry-run", is_flag=True, help="Dry run")
+@click.option(
+    "--shard",
+    default=None,
+    callback=parse_shard,
+    help="Process shard K of N (K/N) and write it to its own database",
+)
+@click.option(
+    "--shard-by",
+    default="dir",
+    type=click.Choice(SHARD_KEYS),
+    help="Partition files by directory, by first directory below INPUT_DIR, or by "
+    "path (requires --output-dir, as files renamed in place could change shard)",
+)
+@click.option(
+    "--plan",
+    "plan_file",
+    default=None,
+    type=click.Path(path_type=Path),
+    help="Save the renames and database rows to this plan file instead of applying them",
+)
+@click.option(
+    "--chunk-size",
+    default=10_000,
+    type=click.IntRange(min=1),
+    help="Number of files per plan chunk or database insert",
+)
+@click.option(
+    "--profile",
+    default=None,
+    type=click.Path(path_type=Path),
+    help="Save stage timings (<PROFILE>.json) and cProfile stats (<PROFILE>.prof)",
+)
+@click.option(
+    "--progress-file",
+    default=None,
+    type=click.Path(path_type=Path),
+    help="Write progress events (throughput, ETA, errors) to this file",
+)
+@click.option(
+    "--progress-format",
+    default="jsonl",
+    type=click.Choice(["jsonl", "prometheus"]),
+    help="JSON lines events or a Prometheus textfile",
+)
+@click.option(
+    "--progress-interval",
+    default=5.0,
+    type=click.FloatRange(min=0),
+    help="Minimum seconds between progress events per stage",
+)
+@click.option(
+    "--log-mode",
+    default="rich",
+    type=click.Choice(MODES),
+    help="Rich console, plain text, or plain text written in the background",
+)
 @click.version_option(__version__)
 def main(
     input_dir: Path,
@@ -47,21 +630,47 @@ def main(
     output_dir: str = None,
     extension: str = "txt,jpg,png",
     pattern: Optional[str] = None,
+    ontology: Optional[Path] = None,
+    export_mode: str = "rename",
+    workers: int = 8,
+    io_ops: Optional[float] = None,
+    io_mbps: Optional[float] = None,
+    dedup: Optional[str] = None,
+    fingerprint_file: Optional[Path] = None,
+    pipeline: bool = False,
+    encode_workers: int = 2,
+    batch_size: int = 1000,
     decode: bool = False,
     dry_run: bool = False,
+    shard: Optional[Tuple[int, int]] = None,
+    shard_by: str = "dir",
+    plan_file: Optional[Path] = None,
+    chunk_size: int = 10_000,
+    profile: Optional[Path] = None,
+    progress_file: Optional[Path] = None,
+    progress_format: str = "jsonl",
+    progress_interval: float = 5.0,
+    log_mode: str = "rich",
 ) -> None:  # sourcery skip
     """Command line interface to encode or decode files in a directory."""
+    setup_logging(log_mode, log_to_file=not dry_run)
+    setup_reporting(profile, progress_file, progress_format, progress_interval)
+    setup_io(workers, io_ops, io_mbps)
+
     if dry_run:
         logger.info("Dry run")
-    else:
-        # setup
-        project_dir = Path(__file__).resolve().parents[2]
-        log_dir = project_dir.joinpath("logs")
-        logger.add(
-            log_dir.joinpath(f"{Path(__file__).stem}.log"),
-            rotation="10 MB",
-            level="INFO",
-        )
+
+    check_options(
+        export_mode, output_dir, dedup, pipeline, decode, shard, plan_file, shard_by
+    )
+    require_pandas(
+        **{
+            "--export-mode": export_mode != "rename",
+            "--pipeline": pipeline,
+            "--plan": plan_file,
+            "--ontology": ontology,
+        }
+    )
 
     # database must exist if decoding
     if decode and not database_file.exists():
@@ -71,8 +680,32 @@ def main(
     if database_file.parent == Path(".") and not dry_run:
         database_file = input_dir.joinpath(database_file)
 
+    if pipeline:
+        from deity.pipeline import run_pipeline
+
+        run_pipeline(
+            input_dir,
+            database_file,
+            table_name,
+            extension=extension,
+            pattern=pattern,
+            output_dir=output_dir,
+            region_matcher=load_region_matcher(ontology),
+            batch_size=batch_size,
+            encode_workers=encode_workers,
+            rename_workers=workers,
+            dry_run=dry_run,
+        )
+        return
+
     # glob all files in input directory
-    file_list = get_file_list(input_dir, extension)
+    with profiling.timer("walk"):
+        file_list = get_file_list(input_dir, extension)
+    file_list, database_file = select_files(
+        file_list, input_dir, database_file, shard, shard_by
+    )
+    file_list, fingerprints = find_duplicates(file_list, dedup, fingerprint_file)
+    profiling.count("files.found", len(file_list))
 
     # check if files were found
     if len(file_list) == 0:
@@ -86,30 +719,306 @@ def main(
 
     # encode/decode files
     if decode:
-        decode_all(database_file, table_name, extension=extension, dry_run=dry_run)
+        with profiling.timer("decode"):
+            decode_all(database_file, table_name, extension=extension, dry_run=dry_run)
     else:
-        df = encode_all(file_list, pattern=pattern, output_dir=output_dir)
+        encode_and_save(
+            file_list,
+            input_dir,
+            table_name,
+            database_file,
+            pattern=pattern,
+            output_dir=output_dir,
+            ontology=ontology,
+            export_mode=export_mode,
+            workers=workers,
+            fingerprints=fingerprints,
+            plan_file=plan_file,
+            chunk_size=chunk_size,
+            dry_run=dry_run,
+        )
 
-        # create dataframe for file renaming and sql export
-        df_file_rename, df_sql = create_df_sql(df, table_name)
 
-        # check if new_filepath is different from old_filepath
-        if (df_file_rename["old_filepath"] == df_file_rename["new_filepath"]).all():
-            logger.error("No files were encoded")
-            raise ValueError("No files were encoded")
+@cli.command("apply")
+@click.argument("plan-file", type=click.Path(exists=True, path_type=Path))
+@click.option(
+    "--chunk",
+    "chunks",
+    multiple=True,
+    type=click.IntRange(min=0),
+    help="Chunk to apply (repeatable). Defaults to all chunks not yet applied",
+)
+@click.option(
+    "--database-file",
+    default=None,
+    type=click.Path(path_type=Path),
+    help="Database to insert into instead of the one recorded in the plan",
+)
+@click.option(
+    "--workers",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Maximum threads renaming files",
+)
+@click.option(
+    "--lease",
+    default=3600.0,
+    type=click.FloatRange(min=0),
+    help="Seconds after which a chunk claimed by a run that did not finish it can be "
+    "applied again",
+)
+@click.option(
+    "--io-ops",
+    default=None,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Maximum file operations per second, to limit the load on shared storage",
+)
+@click.option(
+    "--log-mode",
+    default="rich",
+    type=click.Choice(MODES),
+    help="Rich console, plain text, or plain text written in the background",
+)
+def apply(
+    plan_file: Path,
+    chunks: Tuple[int, ...] = (),
+    database_file: Optional[Path] = None,
+    workers: int = 8,
+    lease: float = 3600.0,
+    io_ops: Optional[float] = None,
+    log_mode: str = "rich",
+) -> None:
+    """Apply a plan written with ``deity INPUT_DIR --plan PLAN_FILE``.
+
+    Hosts sharing the storage can apply the same plan at once; each chunk is applied
+    by the first run to claim it.
+    """
+    require_pandas(apply=True)
+    from deity.plan import apply_plan
 
-        # connect to database or create if it doesn't exist
-        if not dry_run and not database_file.exists():
-            logger.info(f"Creating {database_file}")
+    setup_logging(log_mode)
+    setup_io(workers, io_ops)
+    applied = apply_plan(
+        plan_file,
+        chunks=chunks or None,
+        database_file=database_file,
+        workers=workers,
+        lease=lease,
+    )
+    logger.info(f"Applied {len(applied)} chunk(s) of {plan_file}")
 
-            conn = database.create_connection(database_file)
 
-            database.create_update_sql(
-                df_sql, table_name, conn, output_file=database_file
-            )
+@cli.command("merge")
+@click.argument("database-file", type=click.Path(path_type=Path))
+@click.argument(
+    "shard-files", nargs=-1, required=True, type=click.Path(exists=True, path_type=Path)
+)
+@click.option(
+    "--table-name",
+    default="specimens",
+    type=click.Choice(["accession", "subjects", "specimens"]),
+)
+@click.option(
+    "--on-conflict",
+    default="error",
+    type=click.Choice(CONFLICT_MODES),
+    help="Abort a shard with conflicting rows, or skip the conflicting rows",
+)
+def merge(
+    database_file: Path,
+    shard_files: Tuple[Path, ...],
+    table_name: str = "specimens",
+    on_conflict: str = "error",
+) -> None:
+    """Merge shard databases written with ``--shard K/N`` into DATABASE_FILE."""
+    num_rows = database.merge_shards(
+        database_file, shard_files, table_name=table_name, on_conflict=on_conflict
+    )
+    logger.info(f"Merged {num_rows} row(s) from {len(shard_files)} shard(s)")
+
+
+@cli.command("migrate")
+@click.argument("database-file", type=click.Path(exists=True, path_type=Path))
+@click.option(
+    "--table-name",
+    default="specimens",
+    type=click.Choice(["accession", "subjects", "specimens"]),
+)
+@click.option(
+    "--vacuum/--no-vacuum",
+    default=True,
+    help="Rebuild the database file afterwards to return the freed space",
+)
+def migrate(
+    database_file: Path, table_name: str = "specimens", vacuum: bool = True
+) -> None:
+    """Store directories once per DATABASE_FILE instead of once per file.
+
+    The table is replaced by a view with the same columns, so it can still be read,
+    decoded and merged into.
+    """
+    size = database_file.stat().st_size
+    database.migrate(database_file, table_name=table_name, vacuum=vacuum)
+    logger.info(
+        f"{database_file}: {size / 2**20:.1f} MiB -> "
+        f"{database_file.stat().st_size / 2**20:.1f} MiB"
+    )
+
+
+@cli.command("verify")
+@click.argument(
+    "input-dir", type=click.Path(exists=True, path_type=Path, resolve_path=True)
+)
+@click.option("--database-file", default="deity.db", type=click.Path(path_type=Path))
+@click.option(
+    "--table-name",
+    default="specimens",
+    type=click.Choice(["accession", "subjects", "specimens"]),
+)
+@click.option(
+    "--extension", default="jpg,png,svs,txt,qpdata", type=click.STRING, help="Extension"
+)
+@click.option("--pattern", default=None, type=click.STRING, help="Pattern")
+@click.option(
+    "--workers",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Maximum directories scanned concurrently",
+)
+@click.option(
+    "--report",
+    default=None,
+    type=click.Path(path_type=Path),
+    help="Write every problem found to this CSV file",
+)
+@click.option(
+    "--log-mode",
+    default="rich",
+    type=click.Choice(MODES),
+    help="Rich console, plain text, or plain text written in the background",
+)
+def verify(
+    input_dir: Path,
+    database_file: Path,
+    table_name: str = "specimens",
+    extension: str = "jpg,png,svs,txt,qpdata",
+    pattern: Optional[str] = None,
+    workers: int = 8,
+    report: Optional[Path] = None,
+    log_mode: str = "rich",
+) -> None:
+    """Check that the files in INPUT_DIR and the database agree.
+
+    Reports rows whose file is missing, and files not in the database, separating
+    those with an identifier in their name. Exits with status 1 if any is found.
+    """
+    from deity.verify import verify_tree
+
+    setup_logging(log_mode, log_to_file=False)
+    setup_io(workers)
+
+    # set database path to input directory if not specified
+    if database_file.parent == Path("."):
+        database_file = input_dir.joinpath(database_file)
 
-            if len(df_file_rename) > 0 and not dry_run:
-                rename_files(df_file_rename)
+    counts = verify_tree(
+        input_dir, database_file, table_name, extension, pattern, report
+    )
+    if any(counts.values()):
+        click.get_current_context().exit(1)
+
+
+@cli.command("watch")
+@click.argument(
+    "input-dir", type=click.Path(exists=True, path_type=Path, resolve_path=True)
+)
+@click.option("--database-file", default="deity.db", type=click.Path(path_type=Path))
+@click.option(
+    "--table-name",
+    default="specimens",
+    type=click.Choice(["accession", "subjects", "specimens"]),
+)
+@click.option("--output-dir", default=None, type=click.Path(path_type=Path))
+@click.option(
+    "--extension", default="jpg,png,svs,txt,qpdata", type=click.STRING, help="Extension"
+)
+@click.option("--pattern", default=None, type=click.STRING, help="Pattern")
+@click.option(
+    "--ontology",
+    default=None,
+    type=click.Path(exists=True, path_type=Path),
+    help="Ontology CSV or JSON used to tag brain regions in filenames",
+)
+@click.option(
+    "--debounce",
+    default=2.0,
+    type=click.FloatRange(min=0),
+    help="Seconds without events before a written file is encoded",
+)
+@click.option(
+    "--batch-size",
+    default=1000,
+    type=click.IntRange(min=1),
+    help="Number of files per database transaction",
+)
+@click.option("--dry-run", is_flag=True, help="Dry run")
+@click.option(
+    "--progress-file",
+    default=None,
+    type=click.Path(path_type=Path),
+    help="Write progress events (throughput, ETA, errors) to this file",
+)
+@click.option(
+    "--log-mode",
+    default="rich",
+    type=click.Choice(MODES),
+    help="Rich console, plain text, or plain text written in the background",
+)
+def watch(
+    input_dir: Path,
+    database_file: Path,
+    table_name: str = "specimens",
+    output_dir: Optional[Path] = None,
+    extension: str = "jpg,png,svs,txt,qpdata",
+    pattern: Optional[str] = None,
+    ontology: Optional[Path] = None,
+    debounce: float = 2.0,
+    batch_size: int = 1000,
+    dry_run: bool = False,
+    progress_file: Optional[Path] = None,
+    log_mode: str = "rich",
+) -> None:
+    """Encode files written to INPUT_DIR until interrupted (Linux only).
+
+    Files already in INPUT_DIR are encoded first. Rows are appended to the database,
+    which is created if it does not exist.
+    """
+    from deity.watch import Watcher
+
+    setup_logging(log_mode, log_to_file=not dry_run)
+    setup_reporting(progress_file=progress_file)
+
+    # set database path to input directory if not specified
+    if database_file.parent == Path("."):
+        database_file = input_dir.joinpath(database_file)
+
+    watcher = Watcher(
+        input_dir,
+        database_file,
+        table_name,
+        extension=extension,
+        pattern=pattern,
+        output_dir=output_dir,
+        region_matcher=load_region_matcher(ontology),
+        debounce=debounce,
+        batch_size=batch_size,
+        dry_run=dry_run,
+    )
+    stats = watcher.run()
+    logger.info(
+        f"Encoded {stats['encoded']} files, renamed {stats['renamed']} "
+        f"({stats['errors']} errors)"
+    )
 
 
 if __name__ == "__main__":
@@ -117,4 +1026,4 @@ if __name__ == "__main__":
     # load up the .env entries as environment variables
     load_dotenv(find_dotenv())
 
-    main()
+    cli()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""accessor.py in src/deity.
+
+pandas accessors to encode identifier columns. Importing this module registers
+``DataFrame.deity`` and ``Series.deity``::
+
+    import deity.accessor  # noqa: F401
+
+    df = df.deity.encode("accession")
+"""
+
+import re
+from typing import Optional
+
+import pandas as pd
+
+from deity.encode import encode_series
+
+
+@pd.api.extensions.register_series_accessor("deity")
+class SeriesAccessor:
+    """Encode the identifiers in a Series."""
+
+    def __init__(self, series: pd.Series) -> None:
+        self._obj = series
+
+    def encode(
+        self,
+        pattern: Optional[str] = None,
+        ignore_case: bool = re.IGNORECASE,
+        num_chars: int = 16,
+    ) -> pd.DataFrame:
+        """Return the identifier, short_hash and full_hash of each value.
+
+        See ``deity.encode.encode_series``.
+        """
+        return encode_series(
+            self._obj, pattern=pattern, ignore_case=ignore_case, num_chars=num_chars
+        )
+
+
+@pd.api.extensions.register_dataframe_accessor("deity")
+class DataFrameAccessor:
+    """Encode the identifiers in the columns of a DataFrame."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self._obj = df
+
+    def encode(
+        self,
+        column: str,
+        pattern: Optional[str] = None,
+        ignore_case: bool = re.IGNORECASE,
+        num_chars: int = 16,
+        drop: bool = False,
+    ) -> pd.DataFrame:
+        """Return a copy with the hashes of the identifiers in column.
+
+        The hashes are added in the {column}_short_hash and {column}_full_hash
+        columns, named as in the mapping tables written by ``create_df_sql``.
+
+        :param column: Column holding the identifiers, e.g. "accession".
+        :param drop: If True, column is dropped so the copy is de-identified.
+        """
+        if column not in self._obj.columns:
+            raise KeyError(f"Column '{column}' not found in DataFrame")
+
+        encoded = encode_series(
+            self._obj[column],
+            pattern=pattern,
+            ignore_case=ignore_case,
+            num_chars=num_chars,
+        )
+        df = self._obj.assign(
+            **{
+                f"{column}_short_hash": encoded["short_hash"],
+                f"{column}_full_hash": encoded["full_hash"],
+            }
+        )
+        return df.drop(columns=column) if drop else df
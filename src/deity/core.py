@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""core.py in src/deity.
+
+Encode and decode files with plain tuples, ``csv`` and ``sqlite3``, without pandas.
+The rows written match those of ``encode_all``, ``create_df_sql`` and
+``create_update_sql``, so databases from either path are interchangeable. The
+DataFrame functions remain for interactive use; the command line uses this module.
+"""
+
+import csv
+import itertools
+import os
+import re
+import sqlite3
+from pathlib import Path
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sized
+from typing import Tuple
+from typing import Union
+
+from loguru import logger
+
+from deity import progress
+from deity.database.utils import create_connection
+from deity.encode import encode
+from deity.ontology.matcher import RegionMatcher
+from deity.profiling import count
+from deity.profiling import timer
+from deity.scheduler import io_map
+from deity.utils import DEFAULT_PATTERNS
+from deity.utils import find_existing_file
+from deity.utils import rename_pairs
+
+
+class Encoder:
+    """Encode the identifier in a filename, as ``encode_single`` does for a path.
+
+    The patterns are compiled once and tried in order; the first that matches is
+    replaced by the short hash of the identifier.
+    """
+
+    def __init__(
+        self,
+        pattern: Optional[str] = None,
+        ignore_case: bool = re.IGNORECASE,
+        num_chars: int = 16,
+    ) -> None:
+        patterns = (
+            [pattern] if pattern and isinstance(pattern, str) else DEFAULT_PATTERNS
+        )
+        self.patterns = [re.compile(elem, flags=ignore_case) for elem in patterns]
+        self.num_chars = num_chars
+
+    def __call__(
+        self, filename: str
+    ) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
+        """Return the identifier, full hash, short hash and new filename.
+
+        All four are None if no pattern matches.
+        """
+        for regex in self.patterns:
+            match = regex.search(filename)
+            if match:
+                identifier = match[0]
+                full_hash, short_hash = self.hash(identifier)
+                return (
+                    identifier,
+                    full_hash,
+                    short_hash,
+                    regex.sub(short_hash, filename),
+                )
+        return None, None, None, None
+
+    def hash(self, identifier: str) -> Tuple[str, str]:
+        """Return the full and short hash of identifier."""
+        return encode(identifier, num_chars=self.num_chars)
+
+
+def sql_columns(table_name: str, regions: bool = False) -> List[str]:
+    """Return the columns of the mapping table, as named by ``create_df_sql``."""
+    column_name = "accession" if table_name == "specimens" else "mrn"
+    columns = [
+        column_name,
+        f"{column_name}_short_hash",
+        f"{column_name}_full_hash",
+        "old_filepath",
+        "filepath",
+    ]
+    return columns + ["region_id", "region"] if regions else columns
+
+
+def encode_paths(
+    filepaths: Iterable[Union[str, Path]],
+    pattern: Optional[str] = None,
+    output_dir: Optional[Union[str, Path]] = None,
+    ignore_case: bool = re.IGNORECASE,
+    num_chars: int = 16,
+    region_matcher: Optional[RegionMatcher] = None,
+) -> Iterator[tuple]:
+    """Encode files and yield one row of ``sql_columns`` per file.
+
+    Rows hold the values written by ``encode_all``: the hashes of unmatched files are
+    the string "None", and unmatched files keep their resolved path.
+
+    :param region_matcher: Adds the region_id and region columns.
+    """
+    encoder = Encoder(pattern, ignore_case=ignore_case, num_chars=num_chars)
+    if output_dir is not None and not os.path.exists(output_dir):
+        output_dir = None
+
+    total = len(filepaths) if isinstance(filepaths, Sized) else None
+    with timer("encode.paths"), progress.track("encode", total=total) as tracker:
+        for filepath in filepaths:
+            yield _encode_path(os.fspath(filepath), encoder, output_dir, region_matcher)
+            tracker.update()
+
+
+def _encode_path(
+    filepath: str,
+    encoder: Encoder,
+    output_dir: Optional[Union[str, Path]] = None,
+    region_matcher: Optional[RegionMatcher] = None,
+) -> tuple:
+    resolved = os.path.realpath(filepath)
+    parent, name = os.path.split(resolved)
+    identifier, full_hash, short_hash, new_name = encoder(name)
+    new_filepath = resolved
+    if identifier is not None:
+        new_filepath = os.path.join(output_dir or parent, new_name)
+
+    row = (identifier, str(short_hash), str(full_hash), filepath, new_filepath)
+    if region_matcher is not None:
+        region_id = region_matcher.match(name)
+        row += (region_id, region_matcher.acronyms.get(region_id))
+    return row
+
+
+def create_table(conn: sqlite3.Connection, table_name: str, columns: List[str]) -> None:
+    """Create the mapping table with the schema ``DataFrame.to_sql`` would use."""
+    types = {"region_id": "INTEGER"}
+    definitions = ", ".join(
+        ['"id" INTEGER'] + [f'"{col}" {types.get(col, "TEXT")}' for col in columns]
+    )
+    conn.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" ({definitions})')
+    conn.execute(
+        f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_id" ON "{table_name}" ("id")'
+    )
+
+
+def insert_rows(
+    conn: sqlite3.Connection,
+    table_name: str,
+    columns: List[str],
+    rows: List[tuple],
+    start: int = 0,
+) -> None:
+    """Insert rows with consecutive ids from start.
+
+    Normalized tables are views; their insert trigger stores the paths.
+    """
+    conn.executemany(
+        f"INSERT INTO {table_name} (id, {', '.join(columns)}) "  # noqa: S608
+        f"VALUES ({', '.join('?' * (len(columns) + 1))})",
+        ((idx, *row) for idx, row in enumerate(rows, start)),
+    )
+
+
+def encode_to_database(
+    rows: Iterable[tuple],
+    table_name: str,
+    database_file: Path,
+    columns: List[str],
+    chunk_size: int = 10_000,
+) -> List[Tuple[str, str]]:
+    """Insert encoded rows into a new database_file and its CSV export.
+
+    Rows are written a chunk at a time. If no file has an identifier, both files are
+    removed and ValueError is raised, as no file would be renamed.
+
+    :return: The (old_filepath, filepath) pairs to rename.
+    """
+    database_file = Path(database_file)
+    csv_filename = database_file.with_name(f"{database_file.name}_{table_name}.csv")
+    renames: List[Tuple[str, str]] = []
+
+    conn = create_connection(database_file)
+    try:
+        create_table(conn, table_name, columns)
+        with open(csv_filename, "w", newline="") as f:
+            num_matched = _write_rows(
+                conn,
+                table_name,
+                columns,
+                rows,
+                csv.writer(f, lineterminator=os.linesep),
+                renames,
+                chunk_size,
+            )
+        if "region_id" in columns:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_{table_name}_region_id "
+                f"ON {table_name} (region_id)"
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+    if num_matched == 0:
+        database_file.unlink()
+        csv_filename.unlink()
+        logger.error("No files were encoded")
+        raise ValueError("No files were encoded")
+
+    count("database.rows", len(renames))
+    return renames
+
+
+def _write_rows(
+    conn: sqlite3.Connection,
+    table_name: str,
+    columns: List[str],
+    rows: Iterable[tuple],
+    writer,
+    renames: List[Tuple[str, str]],
+    chunk_size: int = 10_000,
+) -> int:
+    """Insert and export rows a chunk at a time, collecting their renames.
+
+    :return: The number of rows with an identifier.
+    """
+    num_matched = 0
+    writer.writerow(columns)
+    with timer("database.insert"), progress.track("database") as tracker:
+        for chunk in _chunks(rows, chunk_size):
+            insert_rows(conn, table_name, columns, chunk, start=tracker.done)
+            # pandas writes missing values as empty fields
+            writer.writerows(
+                ["" if value is None else value for value in row] for row in chunk
+            )
+            renames.extend((row[3], row[4]) for row in chunk)
+            num_matched += sum(row[0] is not None for row in chunk)
+            tracker.update(len(chunk))
+    return num_matched
+
+
+def _chunks(rows: Iterable[tuple], chunk_size: int) -> Iterator[List[tuple]]:
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        yield chunk
+
+
+def read_renames(
+    database_file: Path, table_name: str = "specimens"
+) -> List[Tuple[str, str]]:
+    """Read (filepath, old_filepath) pairs from a database or CSV export."""
+    database_file = Path(database_file)
+    if database_file.suffix == ".db":
+        conn = create_connection(database_file)
+        try:
+            return conn.execute(
+                f"SELECT filepath, old_filepath FROM {table_name} ORDER BY id"  # noqa: S608
+            ).fetchall()
+        finally:
+            conn.close()
+    if database_file.suffix == ".csv":
+        with open(database_file, newline="") as f:
+            return [(row["filepath"], row["old_filepath"]) for row in csv.DictReader(f)]
+    raise ValueError(
+        f"Database file must be a .db or .csv file, but received {database_file.suffix}"
+    )
+
+
+def find_missing(pairs: List[Tuple[str, str]]) -> List[str]:
+    """Return the first path of each pair that does not exist, checked concurrently."""
+    paths = [new for new, _ in pairs]
+    exists = io_map(os.path.exists, paths, chunk_size=256)
+    return [path for path, found in zip(paths, exists) if not found]
+
+
+def decode_files(
+    database_file: Path,
+    table_name: str = "specimens",
+    extension: Optional[str] = None,
+    dry_run: bool = False,
+) -> List[Tuple[str, str]]:
+    """Rename encoded files back to their original names, as ``decode_all`` does.
+
+    Encoded files not found are looked up with the alternate extensions, keeping the
+    original stem. Nothing is renamed unless every file is found.
+
+    :return: The (filepath, old_filepath) pairs renamed, or to rename in a dry run.
+    """
+    with timer("decode.read"):
+        pairs = read_renames(database_file, table_name)
+    count("decode.rows", len(pairs))
+
+    # original names are restored two levels above the encoded file
+    pairs = [
+        (new, os.path.join(os.path.dirname(os.path.dirname(new)), old))
+        for new, old in pairs
+    ]
+    with timer("decode.exists"):
+        missing = find_missing(pairs)
+    if missing and extension is not None:
+        logger.warning(
+            f"{len(missing)} of {len(pairs)} file(s) not found."
+            f" Checking for alternate extensions: {extension}..."
+        )
+        count("decode.missing", len(missing))
+        with timer("decode.alternate_extension"):
+            pairs = [
+                (str(find_existing_file(Path(new), extension)), old)
+                for new, old in pairs
+            ]
+            pairs = [
+                (new, os.path.splitext(old)[0] + os.path.splitext(new)[1])
+                for new, old in pairs
+            ]
+        missing = find_missing(pairs)
+
+    if missing:
+        logger.error(f"File(s) not found: {[os.path.basename(x) for x in missing]}")
+        raise FileNotFoundError(f"File(s) not found: {missing}")
+
+    if not dry_run:
+        logger.info("Reverting files to original name...")
+        with timer("decode.rename"):
+            rename_pairs(pairs, total=len(pairs))
+    return pairs
@@ -1,26 +1,42 @@
 #!/usr/bin/env python3
 """Script to arrange QR codes on a printable label sheet according to Avery Presta 94503 Round Labels."""
 
+import os
+import tempfile
 from pathlib import Path
+from typing import Dict
 from typing import Optional
-from uuid import uuid4
+from typing import Tuple
+from typing import Union
+from uuid import UUID
 
 import click
 import numpy as np
 import pandas as pd
+import ujson as json
 from dotenv import find_dotenv
 from dotenv import load_dotenv
 from loguru import logger
 from PIL import Image
 from PIL import ImageDraw
+from PIL import UnidentifiedImageError
 
-from deity import encode_single
+from deity import encode
+from deity import encode_batch
 from deity.barcodes.create_qr import convert_qr_to_pil
 from deity.barcodes.create_qr import create_qr_single
 from deity.barcodes.create_qr import set_font
+from deity.log import MODES
+from deity.log import configure_logging
+from deity.log import shutdown_logging
+from deity.utils import get_cache_dir
 from deity.utils import yaml_loader
 
 
+# in-process cache of rendered templates keyed by config hash
+_TEMPLATE_CACHE: Dict[str, Image.Image] = {}
+
+
 def load_config(config: str) -> dict:
     """Load the configuration file."""
     if not Path(config).exists() or not Path(config).is_file():
@@ -52,33 +68,241 @@ def draw_label(
     return image
 
 
+def config_hash(config_dict: dict) -> str:
+    """Return a stable md5 hash of the configuration settings."""
+    text = json.dumps(config_dict, sort_keys=True, default=str)
+    full_hash, _ = encode(text)
+    return full_hash
+
+
+def draw_template(config_dict: dict) -> Image.Image:
+    """Draw the static column and row headers of an empty label sheet."""
+    label_dia_px = config_dict["label_size"]["diameter"]
+    px_spacing_x = config_dict["label_spacing"]["x"]
+    px_spacing_y = config_dict["label_spacing"]["y"]
+    margin_lr = config_dict["margins"]["left_right"]
+    margin_tb = config_dict["margins"]["top_bottom"]
+
+    label_sheet = Image.new("RGB", config_dict["page_size"], "white")
+
+    # add column label above each column
+    for col in range(config_dict["columns"]):
+        x = margin_lr + (col * (label_dia_px + px_spacing_x))
+        y = margin_tb - 80
+        label_sheet = draw_label(label_sheet, (x, y), f"Col {col+1}", font_size=20)
+
+    # add row label to the left of each row
+    for row in range(config_dict["rows"]):
+        x = margin_lr - 100
+        y = margin_tb + (row * (label_dia_px + px_spacing_y))
+        label_sheet = draw_label(label_sheet, (x, y), f"Row {row+1}", font_size=20)
+        label_sheet = draw_label(
+            label_sheet, (x + 10, y + 18), f"{(row*11)+1}", font_size=20
+        )
+
+    return label_sheet
+
+
+def save_template(template: Image.Image, template_file: Path) -> None:
+    """Save a template as a grayscale PNG, replacing template_file atomically.
+
+    The PNG is written to a temporary file in the same directory first, so an
+    interrupted or concurrent run never leaves a truncated template behind.
+    """
+    template_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(
+        prefix=f".{template_file.stem}_", suffix=".png", dir=template_file.parent
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            template.convert("L").save(f, format="PNG", optimize=True)
+        os.replace(tmp_name, template_file)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def read_template(template_file: Path) -> Optional[Image.Image]:
+    """Return the cached template, or None if it is missing or unreadable."""
+    if not template_file.exists():
+        return None
+    try:
+        with Image.open(template_file) as img:
+            return img.convert("RGB")
+    except (OSError, UnidentifiedImageError) as e:
+        logger.warning(f"Rendering the template again, cannot read {template_file}: {e}")
+        return None
+
+
+def load_template(
+    config_dict: dict, cache_dir: Optional[Union[str, Path]] = None
+) -> Image.Image:
+    """Return a copy of the blank label sheet, rendering it only on first use.
+
+    Templates are cached in memory and on disk as a grayscale PNG named after the
+    hash of the configuration, so later runs with the same configuration skip
+    drawing the headers. Unreadable cached templates are rendered again.
+    """
+    key = config_hash(config_dict)
+    if key not in _TEMPLATE_CACHE:
+        cache_dir = (
+            Path(cache_dir) if cache_dir is not None else get_cache_dir("templates")
+        )
+        template_file = cache_dir.joinpath(f"contact_sheet_{key}.png")
+        template = read_template(template_file)
+        if template is not None:
+            logger.debug(f"Loaded cached template {template_file}")
+        else:
+            template = draw_template(config_dict)
+            save_template(template, template_file)
+            logger.debug(f"Saved template to {template_file}")
+
+        _TEMPLATE_CACHE[key] = template
+
+    return _TEMPLATE_CACHE[key].copy()
+
+
+def uuid4_batch(num: int) -> list:
+    """Return a list of random (version 4) uuid strings from a single urandom call."""
+    buffer = os.urandom(16 * num)
+    return [
+        str(UUID(bytes=buffer[idx : idx + 16], version=4))
+        for idx in range(0, 16 * num, 16)
+    ]
+
+
 def setup_df(df: pd.DataFrame) -> pd.DataFrame:
     """Add uuid, label_text, and new_filename columns to df."""
     if "uuid" not in df.columns:
         cols = list(df.columns)
         cols.insert(0, "uuid")
-        df["uuid"] = df.apply(
-            lambda x: str(uuid4()) if x.get("filename") else None, axis=1
+        has_filename = (
+            df["filename"].fillna("").astype(bool)
+            if "filename" in df.columns
+            else pd.Series(False, index=df.index)
         )
+        df["uuid"] = None
+        df.loc[has_filename, "uuid"] = uuid4_batch(int(has_filename.sum()))
         df = df[cols].copy()
     else:
         # only update uuids that are null
-        df["uuid"] = df["uuid"].apply(lambda x: str(uuid4()) if pd.isnull(x) else x)
+        is_null = df["uuid"].isnull()
+        df.loc[is_null, "uuid"] = uuid4_batch(int(is_null.sum()))
 
-    if "label_text" not in df.columns:
-        # add empty column for label text
-        df.loc[:, "label_text"] = ""
+    for col in ["label_text", "new_filename", "full_hash", "short_hash"]:
+        if col not in df.columns:
+            # add empty column
+            df.loc[:, col] = ""
 
-    if "new_filename" not in df.columns:
-        df.loc[:, "new_filename"] = ""
+    return df
 
-    if "full_hash" not in df.columns:
-        df.loc[:, "full_hash"] = ""
 
-    if "short_hash" not in df.columns:
-        df.loc[:, "short_hash"] = ""
+def prepare_labels(
+    df: pd.DataFrame,
+    config_dict: dict,
+    column: str = "filename",
+    start: int = 0,
+    no_encode: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Encode names and compute the position and text of every label.
 
-    return df
+    Rows without a name (or containing "____") separate accessions and become a
+    "Starting" label for the following block. They are dropped from the returned df.
+
+    :param df: DataFrame returned by ``setup_df``.
+    :param config_dict: Contact sheet configuration settings.
+    :param column: Name of the column containing the text data.
+    :param start: Start index for the contact sheet.
+    :param no_encode: If True, the QR code will contain the original name.
+    :return: Tuple of (df with encoded names, label table with one row per label).
+    """
+    label_dia_px = config_dict["label_size"]["diameter"]
+    px_spacing_x = config_dict["label_spacing"]["x"]
+    px_spacing_y = config_dict["label_spacing"]["y"]
+    margin_lr = config_dict["margins"]["left_right"]
+    margin_tb = config_dict["margins"]["top_bottom"]
+
+    names = df[column].fillna("").astype(str)
+    is_separator = (names == "") | names.str.contains("____", regex=False)
+    is_separator = is_separator.to_numpy()
+
+    # Calculate top-left position for each label
+    position = np.arange(len(df)) + start
+    row = position // config_dict["columns"]
+    col = position % config_dict["columns"]
+    labels = pd.DataFrame(
+        {
+            "x": np.round(margin_lr + (col * (label_dia_px + px_spacing_x))).astype(
+                int
+            ),
+            "y": np.round(margin_tb + (row * (label_dia_px + px_spacing_y))).astype(
+                int
+            ),
+            "separator": is_separator,
+            "name": names.to_numpy(),
+            "qr_data": None,
+            "qr_text": None,
+            "caption": None,
+        },
+        index=df.index,
+    )
+
+    # separators announce the accession, part and uuid of the next label
+    if is_separator.any():
+        sep = df.loc[is_separator]
+        next_part = df["part"].shift(-1)[is_separator].astype(str)
+        next_uuid = df["uuid"].shift(-1)[is_separator].fillna("").astype(str)
+        caption = (
+            "Starting\n"
+            + sep["accession"].astype(str)
+            + "\n"
+            + next_part
+            + ", "
+            + sep["stain"].astype(str)
+            + "\n"
+            + next_uuid.str[:8]
+        )
+        labels.loc[is_separator, "caption"] = caption.where(
+            sep["accession"].astype(bool), None
+        )
+
+    # encode the names
+    regular = ~is_separator
+    df = df.loc[regular].copy()
+    encoded = encode_batch(names[regular].tolist())
+    encoded.index = df.index
+    new_filename = df[column].astype(str) if no_encode else encoded["new_filename"]
+    df["new_filename"] = new_filename
+    df["full_hash"] = encoded["full_hash"].fillna("")
+    df["short_hash"] = encoded["short_hash"].fillna("")
+
+    # Extract the metadata from the filename
+    fields = new_filename.str.split("_", n=5, expand=True)
+    if fields.shape[1] < 5 or fields.iloc[:, :5].isna().any(axis=None):
+        invalid = new_filename[fields.reindex(columns=range(5)).isna().any(axis=1)]
+        logger.error(f"Names without five '_' separated fields: {list(invalid)}")
+        raise ValueError(f"Names without five '_' separated fields: {list(invalid)}")
+
+    text = df["uuid"].str[:8] + "\n" + df["uuid"].str[9:18]
+    df["label_text"] = text.str.replace("\n  ", "_", regex=False).str.strip()
+
+    # add text label with block number (aka part)
+    has_part = df["part"].astype(bool)
+    caption = (
+        df["abbrev"].astype(str).str[:4]
+        + " "
+        + df["part"].astype(str).where(has_part, "")
+        + np.where(has_part, " ", "")
+        + df["stain"].astype(str)
+    )
+
+    labels.loc[regular, "qr_data"] = new_filename
+    labels.loc[regular, "qr_text"] = text
+    labels.loc[regular, "caption"] = caption
+    for idx, name in enumerate(["id", "part", "loc", "dx", "stain"]):
+        labels.loc[regular, name] = fields[idx]
+
+    return df, labels
 
 
 @click.command()
@@ -104,6 +328,12 @@ def setup_df(df: pd.DataFrame) -> pd.DataFrame:
 )
 @click.option("--dry-run", is_flag=True, help="Perform a trial run with no changes.")
 @click.option("--debug", is_flag=True, help="Show debug information.")
+@click.option(
+    "--log-mode",
+    default="rich",
+    type=click.Choice(MODES),
+    help="Rich console, plain text, or plain text written in the background.",
+)
 def main(
     input_file: Path,
     output_file: Optional[str] = None,
@@ -113,6 +343,7 @@ def main(
     debug: bool = False,
     no_encode: bool = False,
     dry_run: bool = False,
+    log_mode: str = "rich",
 ) -> None:  # sourcery-skip
     """Arrange QR codes on a printable label sheet with specific dimensions and spacing.
 
@@ -123,6 +354,7 @@ def main(
     :param start: Start index for the contact sheet.
     :param debug: If True, debug information will be shown.
     :param dry_run: If True, no actual file will be written.
+    :param log_mode: Rich console, plain text, or plain text written in the background.
     """
     # setup
     project_dir = Path(__file__).resolve().parents[2]
@@ -133,19 +365,13 @@ def main(
         ).with_suffix(".tif")
         output_file.parent.mkdir(parents=True, exist_ok=True)
 
-    log_dir = project_dir.joinpath("logs")
-    logger.add(
-        log_dir.joinpath(f"{Path(__file__).stem}.log"),
-        rotation="10 MB",
-        level="INFO",
-    )
+    log_file = project_dir.joinpath("logs", f"{Path(__file__).stem}.log")
+    configure_logging(log_mode, log_file=log_file, max_repeats=3)
+    click.get_current_context().call_on_close(shutdown_logging)
 
     # load configuration settings
     config = config or conf_dir.joinpath("contact_sheet.yaml")
     config_dict = load_config(config)
-    label_dia_px = config_dict["label_size"]["diameter"]
-    px_spacing_x = config_dict["label_spacing"]["x"]
-    px_spacing_y = config_dict["label_spacing"]["y"]
     margin_lr = config_dict["margins"]["left_right"]
     margin_tb = config_dict["margins"]["top_bottom"]
 
@@ -154,29 +380,14 @@ def main(
     logger.info(f"Output file: {output_file}")
     logger.info(f"Configuration file: {config_dict['name']}")
 
-    # Initialize the label sheet
-    label_sheet = Image.new("RGB", config_dict["page_size"], "white")
+    # Initialize the label sheet from the cached template
+    label_sheet = load_template(config_dict)
 
     # add filename to top of label sheet
     x = margin_lr + 100
     y = margin_tb - 140
     label_sheet = draw_label(label_sheet, (x, y), f"{output_file.stem}", font_size=32)
 
-    # add column label above each column
-    for col in range(config_dict["columns"]):
-        x = margin_lr + (col * (label_dia_px + px_spacing_x))
-        y = margin_tb - 80
-        label_sheet = draw_label(label_sheet, (x, y), f"Col {col+1}", font_size=20)
-
-    # add row label to the left of each row
-    for row in range(config_dict["rows"]):
-        x = margin_lr - 100
-        y = margin_tb + (row * (label_dia_px + px_spacing_y))
-        label_sheet = draw_label(label_sheet, (x, y), f"Row {row+1}", font_size=20)
-        label_sheet = draw_label(
-            label_sheet, (x + 10, y + 18), f"{(row*11)+1}", font_size=20
-        )
-
     # Load csv with names to be encoded
     df = pd.read_csv(input_file, header=0)
     # fillna
@@ -189,48 +400,21 @@ def main(
     if df[column].str.len().max() > 54:
         logger.warning("Some names are longer than 54 characters")
 
-    # Loop through the rows of the csv and create QR codes
-    for idx, df_row in df.iterrows():
-        name = df_row.get(column)
-        if name is None or pd.isnull(name) or name == "" or "____" in name:
-            # logger.warning(f"Starting new accession: {df_row['accession']}")
-            # Calculate the row and column for this QR code
-            row = (idx + start) // config_dict["columns"]
-            col = (idx + start) % config_dict["columns"]
-
-            # Calculate top-left position for this QR code
-            x = np.round(margin_lr + (col * (label_dia_px + px_spacing_x))).astype(int)
-            y = np.round(margin_tb + (row * (label_dia_px + px_spacing_y))).astype(int)
-
-            #
-            label_text = (
-                f"Starting\n{df_row['accession']}\n{df.loc[idx+1, 'part']}, {df_row['stain']}"
-                f"\n{df.loc[idx+1, 'uuid'][:8]}"
-                if df_row["accession"]
-                else None
+    # encode names and compute the label table before rendering
+    df, labels = prepare_labels(
+        df, config_dict, column=column, start=start, no_encode=no_encode
+    )
+
+    # Loop through the labels and draw them on the sheet
+    for label in labels.itertuples(index=False):
+        if label.separator:
+            label_sheet = draw_label(
+                label_sheet, (label.x, label.y), label.caption, font_size=18
             )
-            label_sheet = draw_label(label_sheet, (x, y), label_text, font_size=18)
-            df.drop(idx, inplace=True)
             continue
 
-        # encode the name
-        identifier, filepath, full_hash, short_hash = encode_single(name)
-
-        # add filepath to column in df
-        new_filename = name if no_encode else filepath.name
-        df.at[idx, "new_filename"] = new_filename
-
         # Create the QR code
-        qr_code = create_qr_single(new_filename, encode=False, error="L")
-
-        # Extract the metadata from the filename
-        _id, _part, _loc, _dx, _stain = new_filename.split("_")[:5]
-        # stain = stain.replace("-", "")[:5]
-        # text = f"{df_row['uuid'][:12]}\n  {full_hash[:6]}_{part}\n  {loc}_{stain}"
-        text = f"{df_row['uuid'][:8]}\n{df_row['uuid'][9:18]}"
-
-        # add text to column in df
-        df.at[idx, "label_text"] = text.replace("\n  ", "_").strip()
+        qr_code = create_qr_single(label.qr_data, encode=False, error="L")
 
         # Convert the QR code to a PIL image
         qr_png = convert_qr_to_pil(
@@ -239,32 +423,25 @@ def main(
             scale=config_dict["scale"],
             font=config_dict["font"],
             font_size=config_dict["font_size"],
-            text=text,
+            text=label.qr_text,
             output_size=config_dict["output_size"],
         )
         if qr_png.size != config_dict["output_size"]:
             logger.warning(
-                f"QR code for {name} is not the correct size. "
+                f"QR code for {label.name} is not the correct size. "
                 f"Expected {config_dict['output_size']}, but got {qr_png.size}."
             )
-            logger.warning(f"QR code for {name} will be resized to {config_dict['output_size']}.")
-
-        # Calculate the row and column for this QR code
-        row = (idx + start) // config_dict["columns"]
-        col = (idx + start) % config_dict["columns"]
-
-        # Calculate top-left position for this QR code
-        x = np.round(margin_lr + (col * (label_dia_px + px_spacing_x))).astype(int)
-        y = np.round(margin_tb + (row * (label_dia_px + px_spacing_y))).astype(int)
+            logger.warning(
+                f"QR code for {label.name} will be resized to {config_dict['output_size']}."
+            )
 
         # Paste the QR code onto the label sheet
-        label_sheet.paste(qr_png, (x, y))
+        label_sheet.paste(qr_png, (label.x, label.y))
 
         # add text label with block number (aka part)
-        label_text = (
-            f"{df_row['abbrev'][:4]} {df_row['part']} {df_row['stain']}" if df_row["part"] else f"{df_row['abbrev'][:4]} {df_row['stain']}"
+        label_sheet = draw_label(
+            label_sheet, (label.x, label.y - 40), label.caption, font_size=18
         )
-        label_sheet = draw_label(label_sheet, (x, y - 40), label_text, font_size=18)
 
     if dry_run:
         logger.info("Dry run mode: No changes will be made.")
@@ -9,9 +9,15 @@ __ALL__ = [
     "execute_query",
     "close_connection",
     "create_update_sql",
+    "insert_frames",
+    "merge_shards",
+    "migrate",
 ]
 
 from deity.database.create_update_sql import create_update_sql
+from deity.database.create_update_sql import insert_frames
+from deity.database.merge import merge_shards
+from deity.database.normalize import migrate
 from deity.database.utils import close_connection
 from deity.database.utils import create_connection
 from deity.database.utils import create_cursor
@@ -1,24 +1,145 @@
 #!/usr/bin/env python3
 """create_update_sql.py in src/deity/database."""
+import os
 import sqlite3
 from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Iterable
+from typing import Optional
 
-import pandas as pd
 from loguru import logger
 
+from deity import progress
+from deity.database.normalize import insert_frame
+from deity.database.normalize import is_normalized
+from deity.profiling import count
+from deity.profiling import timer
 
-def create_update_sql(
-    df_sql: pd.DataFrame, table_name: str, conn: sqlite3.Connection, output_file: Path
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def _create_table(
+    conn: sqlite3.Connection, table_name: str, df_sql: "pd.DataFrame"
 ) -> None:
-    """Create or append a pandas DataFrame to a SQLite database table."""
+    """Create the table and id index ``DataFrame.to_sql`` would, if missing."""
+    from pandas.io.sql import get_schema
+
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (table_name,)
+    ).fetchone()
+    if exists:
+        return
+    conn.execute(get_schema(df_sql.rename_axis("id").reset_index(), table_name))
+    conn.execute(f'CREATE INDEX "ix_{table_name}_id" ON "{table_name}" ("id")')
+
+
+def _insert_chunks(
+    conn: sqlite3.Connection,
+    table_name: str,
+    frames: Iterable["pd.DataFrame"],
+    tracker: progress.Progress,
+    csv_file: Optional[Path] = None,
+) -> int:
+    """Insert all frames in one transaction, so a failure leaves the table unchanged.
+
+    Frames are also appended to csv_file, which is only complete once this returns.
+
+    :return: The number of rows inserted.
+    """
+    # DDL does not begin a transaction implicitly
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
     try:
-        if len(df_sql) > 0:
-            logger.info("Updating database...")
-            df_sql.to_sql(table_name, conn, if_exists="append", index_label="id")
-            csv_filename = output_file.with_name(f"{output_file.name}_{table_name}.csv")
-            df_sql.to_csv(csv_filename, index=False)
+        # normalized tables are views, whose trigger stores the paths
+        normalized = is_normalized(conn, table_name)
+        num_rows, regions = 0, False
+        for chunk in frames:
+            if not len(chunk):
+                continue
+            if not normalized:
+                _create_table(conn, table_name, chunk)
+            insert_frame(conn, table_name, chunk)
+            if csv_file is not None:
+                header = num_rows == 0
+                chunk.to_csv(
+                    csv_file, mode="w" if header else "a", header=header, index=False
+                )
+            num_rows += len(chunk)
+            regions = "region_id" in chunk.columns
+            tracker.update(len(chunk))
+        if regions and not normalized:
+            # index region ids so files can be queried by brain region
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_{table_name}_region_id "
+                f"ON {table_name} (region_id)"
+            )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return num_rows
+
+
+def insert_frames(
+    frames: Iterable["pd.DataFrame"],
+    table_name: str,
+    conn: sqlite3.Connection,
+    output_file: Path,
+    total: Optional[int] = None,
+    write_csv: bool = True,
+) -> int:
+    """Create or append DataFrames to a SQLite table in one transaction.
+
+    Frames are consumed one at a time, so a generator keeps only one in memory.
+    Unless write_csv is False, the rows are also saved to <output_file>_<table>.csv.
+
+    :param total: Number of rows, for progress reports.
+    :return: The number of rows inserted.
+    """
+    csv_filename = output_file.with_name(f"{output_file.name}_{table_name}.csv")
+    # written next to the CSV and moved into place once the rows are committed
+    tmp_filename = csv_filename.with_name(f".{csv_filename.name}.tmp")
+    try:
+        logger.info("Updating database...")
+        with timer("database.insert"), progress.track(
+            "database", total=total
+        ) as tracker:
+            num_rows = _insert_chunks(
+                conn, table_name, frames, tracker, tmp_filename if write_csv else None
+            )
+        count("database.rows", num_rows)
+        if write_csv and num_rows:
+            os.replace(tmp_filename, csv_filename)
     except Exception as e:
         logger.error(e)
         raise e
     finally:
         conn.close()
+        if write_csv:
+            tmp_filename.unlink(missing_ok=True)
+    return num_rows
+
+
+def create_update_sql(
+    df_sql: "pd.DataFrame",
+    table_name: str,
+    conn: sqlite3.Connection,
+    output_file: Path,
+    chunk_size: int = 10_000,
+    write_csv: bool = True,
+) -> None:
+    """Create or append a pandas DataFrame to a SQLite database table.
+
+    Unless write_csv is False, the rows are also saved to <output_file>_<table>.csv.
+    """
+    if len(df_sql) == 0:
+        conn.close()
+        return
+
+    frames = (
+        df_sql.iloc[start : start + chunk_size]
+        for start in range(0, len(df_sql), chunk_size)
+    )
+    insert_frames(frames, table_name, conn, output_file, len(df_sql), write_csv)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""merge.py in src/deity/database.
+
+Combine shard databases written by ``deity --shard K/N`` into the main mapping table
+with ``ATTACH DATABASE`` and bulk ``INSERT ... SELECT`` statements.
+"""
+
+import sqlite3
+from pathlib import Path
+from typing import Iterable
+from typing import List
+from typing import Union
+
+from loguru import logger
+
+from deity.database.normalize import is_normalized
+from deity.database.utils import create_connection
+from deity.profiling import count
+from deity.profiling import timer
+
+
+CONFLICT_MODES = ["error", "skip"]
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table_name: str) -> List[str]:
+    rows = conn.execute(f"PRAGMA {schema}.table_info({table_name})").fetchall()
+    return [row[1] for row in rows]
+
+
+def _count_rows(conn: sqlite3.Connection, table_name: str) -> int:
+    return conn.execute(f"SELECT COUNT(*) FROM main.{table_name}").fetchone()[0]
+
+
+def find_conflicts(conn: sqlite3.Connection, table_name: str) -> List[tuple]:
+    """Return (old_filepath, filepath) rows of the attached shard that conflict.
+
+    A row conflicts if main maps its old_filepath to another filepath, or maps
+    another old_filepath to its filepath. Rows already in main are not conflicts.
+    """
+    query = f"""
+        SELECT s.old_filepath, s.filepath FROM shard.{table_name} AS s
+        WHERE EXISTS (
+            SELECT 1 FROM main.{table_name} AS m
+            WHERE m.old_filepath = s.old_filepath AND m.filepath != s.filepath
+        ) OR EXISTS (
+            SELECT 1 FROM main.{table_name} AS m
+            WHERE m.filepath = s.filepath AND m.old_filepath != s.old_filepath
+        )
+    """  # noqa: S608
+    return conn.execute(query).fetchall()
+
+
+def _prepare_table(
+    conn: sqlite3.Connection,
+    shard_file: Union[str, Path],
+    table_name: str,
+    shard_columns: List[str],
+) -> None:
+    """Create the main table like the shard table, or check that its columns match."""
+    if not _columns(conn, "main", table_name):
+        conn.execute(
+            f"CREATE TABLE main.{table_name} AS "  # noqa: S608
+            f"SELECT * FROM shard.{table_name} WHERE 0"
+        )
+    missing = set(shard_columns) - set(_columns(conn, "main", table_name))
+    if missing:
+        raise ValueError(f"Columns {sorted(missing)} of {shard_file} not in main")
+
+    # shard rows are looked up in main by path; normalized tables index their files
+    if not is_normalized(conn, table_name):
+        for column in ("old_filepath", "filepath"):
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS main.ix_{table_name}_{column} "
+                f"ON {table_name} ({column})"
+            )
+
+
+def _check_conflicts(
+    conn: sqlite3.Connection,
+    shard_file: Union[str, Path],
+    table_name: str,
+    on_conflict: str,
+) -> None:
+    """Log conflicting rows, and raise if on_conflict is "error"."""
+    conflicts = find_conflicts(conn, table_name)
+    if not conflicts:
+        return
+
+    logger.warning(f"{len(conflicts)} conflicting row(s) in {shard_file}")
+    for old_filepath, filepath in conflicts[:10]:
+        logger.warning(f"Conflict: {old_filepath} -> {filepath}")
+    if on_conflict == "error":
+        raise ValueError(f"{len(conflicts)} row(s) of {shard_file} conflict with main")
+    count("merge.conflicts", len(conflicts))
+
+
+def merge_shard(
+    conn: sqlite3.Connection,
+    shard_file: Union[str, Path],
+    table_name: str = "specimens",
+    on_conflict: str = "error",
+) -> int:
+    """Insert the rows of one shard database into the main database.
+
+    The merge runs in a single transaction. Rows already in main are skipped, and
+    the shard ids are renumbered after the largest id in main.
+
+    :param conn: Connection to the main database, in autocommit mode.
+    :param shard_file: Shard database with the same table.
+    :param table_name: Table to merge.
+    :param on_conflict: "error" to abort the merge of this shard, or "skip" to
+        merge all rows that do not conflict.
+    :return: The number of rows inserted.
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(
+            f"Expected one of {CONFLICT_MODES}, but received {on_conflict}"
+        )
+
+    conn.execute("ATTACH DATABASE ? AS shard", (str(shard_file),))
+    try:
+        shard_columns = _columns(conn, "shard", table_name)
+        if not shard_columns:
+            raise ValueError(f"Table {table_name} not found in {shard_file}")
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _prepare_table(conn, shard_file, table_name, shard_columns)
+            _check_conflicts(conn, shard_file, table_name, on_conflict)
+
+            # renumber ids after main, keeping the order of the shard
+            offset = conn.execute(
+                f"SELECT COALESCE(MAX(id) + 1, 0) FROM main.{table_name}"  # noqa: S608
+            ).fetchone()[0]
+            columns = [col for col in shard_columns if col != "id"]
+            select = ", ".join(f"s.{col}" for col in columns)
+            num_rows = _count_rows(conn, table_name)
+            with timer("merge.insert"):
+                conn.execute(
+                    f"""
+                    INSERT INTO main.{table_name} (id, {", ".join(columns)})
+                    SELECT ? + ROW_NUMBER() OVER (ORDER BY s.id) - 1, {select}
+                    FROM shard.{table_name} AS s
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM main.{table_name} AS m
+                        WHERE m.old_filepath = s.old_filepath
+                           OR m.filepath = s.filepath
+                    )
+                    """,  # noqa: S608
+                    (offset,),
+                )
+            # rowcount misses rows inserted by the trigger of a normalized table
+            num_rows = _count_rows(conn, table_name) - num_rows
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.execute("DETACH DATABASE shard")
+
+    count("merge.rows", num_rows)
+    logger.info(f"Merged {num_rows} row(s) from {shard_file}")
+    return num_rows
+
+
+def merge_shards(
+    database_file: Union[str, Path],
+    shard_files: Iterable[Union[str, Path]],
+    table_name: str = "specimens",
+    on_conflict: str = "error",
+) -> int:
+    """Merge shard databases into database_file, creating it if needed.
+
+    :return: The total number of rows inserted.
+    """
+    conn = create_connection(database_file, verbose=True)
+    # transactions are managed explicitly, since ATTACH cannot run inside one
+    conn.isolation_level = None
+    try:
+        num_rows = sum(
+            merge_shard(conn, shard_file, table_name, on_conflict)
+            for shard_file in shard_files
+        )
+        # normalized tables are views, indexed on their files table
+        normalized = is_normalized(conn, table_name)
+        if "region_id" in _columns(conn, "main", table_name) and not normalized:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_{table_name}_region_id "
+                f"ON {table_name} (region_id)"
+            )
+    finally:
+        conn.close()
+
+    return num_rows
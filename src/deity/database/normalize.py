@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""normalize.py in src/deity/database.
+
+Store each directory once in a ``directories`` table and each file as a directory id
+and a basename. The mapping table is replaced by a view with the same name and
+columns, which rebuilds the full paths, and an ``INSTEAD OF INSERT`` trigger, so
+existing readers and writers keep working on migrated databases.
+"""
+
+import sqlite3
+from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import List
+from typing import Tuple
+from typing import Union
+
+from loguru import logger
+
+from deity.database.utils import create_connection
+from deity.profiling import count
+from deity.profiling import timer
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+PATH_COLUMNS = {"old_filepath": "old_dir_id", "filepath": "dir_id"}
+
+
+def _prefix(column: str) -> str:
+    """SQL for a path up to and including its last "/", or "" without one."""
+    return f"rtrim({column}, replace({column}, '/', ''))"
+
+
+def _basename(column: str) -> str:
+    """SQL for a path after its last "/"."""
+    return f"substr({column}, length({_prefix(column)}) + 1)"
+
+
+def _name_column(column: str) -> str:
+    return "old_name" if column == "old_filepath" else "name"
+
+
+def is_normalized(conn: sqlite3.Connection, table_name: str) -> bool:
+    """Return True if table_name is a view over the normalized tables."""
+    row = conn.execute(
+        "SELECT type FROM sqlite_master WHERE name = ?", (table_name,)
+    ).fetchone()
+    return row is not None and row[0] == "view"
+
+
+def _columns(conn: sqlite3.Connection, table_name: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+
+
+def _file_columns(columns: List[str]) -> List[str]:
+    """Columns of the files table for the columns of the original table."""
+    file_columns = []
+    for column in columns:
+        if column in PATH_COLUMNS:
+            file_columns.extend([PATH_COLUMNS[column], _name_column(column)])
+        else:
+            file_columns.append(column)
+    return file_columns
+
+
+def create_view(conn: sqlite3.Connection, table_name: str, columns: List[str]) -> None:
+    """Create the view and insert trigger that emulate the original table.
+
+    :param columns: Columns of the original table, in order.
+    """
+    files_table = f"{table_name}_files"
+    select = []
+    for column in columns:
+        if column in PATH_COLUMNS:
+            alias = f"d_{PATH_COLUMNS[column]}"
+            select.append(f"{alias}.path || f.{_name_column(column)} AS {column}")
+        else:
+            select.append(f"f.{column}")
+    conn.execute(
+        f"""
+            CREATE VIEW {table_name} AS
+            SELECT {", ".join(select)}
+            FROM {files_table} AS f
+            JOIN directories AS d_old_dir_id ON d_old_dir_id.id = f.old_dir_id
+            JOIN directories AS d_dir_id ON d_dir_id.id = f.dir_id
+            """  # noqa: S608
+    )
+
+    values = []
+    for column in columns:
+        if column in PATH_COLUMNS:
+            values.append(
+                f"(SELECT id FROM directories WHERE path = {_prefix('NEW.' + column)})"
+            )
+            values.append(_basename(f"NEW.{column}"))
+        else:
+            values.append(f"NEW.{column}")
+    conn.execute(
+        f"""
+            CREATE TRIGGER {table_name}_insert INSTEAD OF INSERT ON {table_name}
+            BEGIN
+                INSERT OR IGNORE INTO directories (path)
+                VALUES ({_prefix("NEW.old_filepath")}), ({_prefix("NEW.filepath")});
+                INSERT INTO {files_table} ({", ".join(_file_columns(columns))})
+                VALUES ({", ".join(values)});
+            END
+            """  # noqa: S608
+    )
+
+
+def insert_frame(conn: sqlite3.Connection, table_name: str, df: "pd.DataFrame") -> None:
+    """Insert df, indexed by id, into a table or view without committing."""
+    df = df.rename_axis("id").reset_index()
+    records = df.astype(object).where(df.notna(), None)
+    conn.executemany(
+        f"INSERT INTO {table_name} ({', '.join(df.columns)}) "  # noqa: S608
+        f"VALUES ({', '.join('?' * len(df.columns))})",
+        records.itertuples(index=False, name=None),
+    )
+
+
+def append_rows(conn: sqlite3.Connection, table_name: str, df: "pd.DataFrame") -> None:
+    """Insert df, indexed by id, through the view of a normalized table.
+
+    ``DataFrame.to_sql`` only appends to tables, not views.
+    """
+    insert_frame(conn, table_name, df)
+    conn.commit()
+
+
+def _indexes(conn: sqlite3.Connection, table_name: str) -> List[Tuple[str, List[str]]]:
+    """Return (name, columns) of the indexes on table_name that do not use paths."""
+    indexes = []
+    for row in conn.execute(f"PRAGMA index_list({table_name})").fetchall():
+        if row[3] != "c":
+            # skip UNIQUE and PRIMARY KEY constraints
+            continue
+        columns = [elem[2] for elem in conn.execute(f"PRAGMA index_info({row[1]})")]
+        if not set(columns) & set(PATH_COLUMNS):
+            indexes.append((row[1], columns))
+    return indexes
+
+
+def normalize_table(conn: sqlite3.Connection, table_name: str) -> Tuple[int, int]:
+    """Move the rows of table_name into the directories and files tables.
+
+    Runs in the caller's transaction. The original table is dropped and replaced by
+    a view with the same name and columns. Raises ValueError, leaving the rollback to
+    the caller, if a row could not be copied.
+
+    :return: The number of rows and of directories.
+    """
+    columns = _columns(conn, table_name)
+    if not set(PATH_COLUMNS) <= set(columns):
+        raise ValueError(f"Table {table_name} has no old_filepath and filepath columns")
+
+    files_table = f"{table_name}_files"
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS directories "
+        "(id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE)"
+    )
+    conn.execute(
+        f"""
+            INSERT OR IGNORE INTO directories (path)
+            SELECT {_prefix("old_filepath")} FROM {table_name}
+            UNION SELECT {_prefix("filepath")} FROM {table_name}
+            """  # noqa: S608
+    )
+
+    # keep the declared types of the original columns
+    types = {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({table_name})")}
+    definitions = []
+    for column in _file_columns(columns):
+        if column in PATH_COLUMNS.values():
+            definitions.append(f"{column} INTEGER NOT NULL REFERENCES directories (id)")
+        elif column in ("old_name", "name"):
+            definitions.append(f"{column} TEXT NOT NULL")
+        else:
+            definitions.append(f"{column} {types[column]}".strip())
+    conn.execute(f"CREATE TABLE {files_table} ({', '.join(definitions)})")
+
+    select = []
+    for column in columns:
+        if column in PATH_COLUMNS:
+            alias = f"d_{PATH_COLUMNS[column]}"
+            select.extend([f"{alias}.id", _basename(f"t.{column}")])
+        else:
+            select.append(f"t.{column}")
+    with timer("normalize.insert"):
+        cursor = conn.execute(
+            f"""
+                INSERT INTO {files_table} ({", ".join(_file_columns(columns))})
+                SELECT {", ".join(select)} FROM {table_name} AS t
+                JOIN directories AS d_old_dir_id
+                    ON d_old_dir_id.path = {_prefix("t.old_filepath")}
+                JOIN directories AS d_dir_id ON d_dir_id.path = {_prefix("t.filepath")}
+                """  # noqa: S608
+        )
+    num_rows = cursor.rowcount
+    expected = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]  # noqa: S608
+    if num_rows != expected:
+        # rows without a path would be lost with the original table
+        raise ValueError(
+            f"Copied {num_rows} of {expected} row(s) of {table_name}; "
+            "paths must not be NULL"
+        )
+
+    # indexes are dropped with the table, so recreate them on the files table
+    indexes = _indexes(conn, table_name)
+    conn.execute(f"DROP TABLE {table_name}")
+    create_view(conn, table_name, columns)
+    indexes += [(f"ix_{files_table}_{col}", [col]) for col in ("old_dir_id", "dir_id")]
+    if "region_id" in columns and not any(
+        name == f"ix_{table_name}_region_id" for name, _ in indexes
+    ):
+        # the view cannot be indexed later, as create_update_sql does for tables
+        indexes.append((f"ix_{table_name}_region_id", ["region_id"]))
+    for name, index_columns in indexes:
+        conn.execute(
+            f"CREATE INDEX {name} ON {files_table} ({', '.join(index_columns)})"
+        )
+
+    num_dirs = conn.execute("SELECT COUNT(*) FROM directories").fetchone()[0]
+    return num_rows, num_dirs
+
+
+def migrate(
+    database_file: Union[str, Path], table_name: str = "specimens", vacuum: bool = True
+) -> int:
+    """Normalize the paths of table_name in an existing database.
+
+    The migration runs in one transaction, so a failure leaves the database as it
+    was. Databases that are already normalized are left unchanged.
+
+    :param vacuum: Rebuild the file afterwards, so the space is returned to the disk.
+    :return: The number of rows migrated.
+    """
+    if not Path(database_file).exists():
+        raise FileNotFoundError(f"Database {database_file} does not exist")
+
+    conn = create_connection(database_file)
+    conn.isolation_level = None
+    try:
+        if is_normalized(conn, table_name):
+            logger.info(f"Table {table_name} of {database_file} is already normalized")
+            return 0
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            with timer("normalize"):
+                num_rows, num_dirs = normalize_table(conn, table_name)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if vacuum:
+            with timer("normalize.vacuum"):
+                conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    count("normalize.rows", num_rows)
+    logger.info(
+        f"Normalized {num_rows} row(s) of {table_name} into {num_dirs} directories"
+    )
+    return num_rows
@@ -10,8 +10,8 @@ from sqlite3 import Error
 from loguru import logger
 
 
-def create_connection(db_file, verbose=False) -> sqlite3.Connection:
-    """Wrapper for sqlite3.connect()."""
+def create_connection(db_file, verbose=False, **kwargs) -> sqlite3.Connection:
+    """Wrapper for sqlite3.connect(), passing it kwargs."""
     conn = None
 
     if verbose:
@@ -22,7 +22,7 @@ def create_connection(db_file, verbose=False) -> sqlite3.Connection:
 
     # try connecting to the database
     try:
-        conn = sqlite3.connect(db_file)
+        conn = sqlite3.connect(db_file, **kwargs)
     except Error as e:
         logger.error(e)
 
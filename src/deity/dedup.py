@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""dedup.py in src/deity.
+
+Find byte-identical files in stages: files are grouped by size, groups are split by a
+hash of their first and last blocks, and only files that still collide are hashed in
+full. Fingerprints are cached in SQLite, keyed on path, size and modification time.
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from loguru import logger
+
+from deity import progress
+from deity.encode import content_hash
+from deity.encode import hash_file
+from deity.profiling import count
+from deity.profiling import timer
+from deity.utils import get_cache_dir
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+BLOCK_SIZE = 2**16
+DEDUP_MODES = ["skip", "hardlink"]
+COLUMNS = ["filepath", "size", "mtime_ns", "quick_hash", "full_hash"]
+
+
+def quick_hash(filepath: Union[str, Path], block_size: int = BLOCK_SIZE) -> str:
+    """Return the content hash of the first and last block of a file."""
+    digest = content_hash()
+    with open(filepath, "rb") as f:
+        digest.update(f.read(block_size))
+        size = os.fstat(f.fileno()).st_size
+        if size > block_size:
+            f.seek(max(size - block_size, block_size))
+            digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def load_fingerprints(conn: sqlite3.Connection) -> Dict[str, tuple]:
+    """Return cached (size, mtime_ns, quick_hash, full_hash) by filepath."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS fingerprints (filepath TEXT PRIMARY KEY, "
+        "size INTEGER, mtime_ns INTEGER, quick_hash TEXT, full_hash TEXT)"
+    )
+    rows = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM fingerprints")
+    return {row[0]: row[1:] for row in rows}
+
+
+def save_fingerprints(conn: sqlite3.Connection, df: "pd.DataFrame") -> None:
+    """Insert or replace fingerprints of the files in df."""
+    records = df[COLUMNS].astype(object).where(df[COLUMNS].notna(), None)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO fingerprints VALUES ({', '.join('?' * len(COLUMNS))})",
+        records.itertuples(index=False, name=None),
+    )
+    conn.commit()
+
+
+def _fill_hashes(df: "pd.DataFrame", mask: "pd.Series", column: str, func) -> None:
+    """Compute missing hashes in column for rows in mask."""
+    todo = mask & df[column].isna()
+    with progress.track(f"dedup.{column}", total=int(todo.sum())) as tracker:
+        for idx in df.index[todo]:
+            df.at[idx, column] = func(df.at[idx, "filepath"])
+            tracker.update(nbytes=int(df.at[idx, "size"]))
+    count(f"dedup.{column}", int(todo.sum()))
+
+
+def fingerprint_files(
+    file_list: List[Union[str, Path]],
+    fingerprint_file: Optional[Union[str, Path]] = None,
+) -> "pd.DataFrame":
+    """Fingerprint files and mark byte-identical duplicates.
+
+    :param file_list: Files to fingerprint.
+    :param fingerprint_file: SQLite cache of fingerprints. Defaults to
+        ``fingerprints.db`` in the deity cache directory.
+    :return: DataFrame with the columns filepath, size, mtime_ns, quick_hash,
+        full_hash and duplicate_of, the first file with the same contents or None.
+        Hashes are only computed for files that share a size (and quick hash).
+    """
+    import pandas as pd
+
+    if fingerprint_file is None:
+        fingerprint_file = get_cache_dir("fingerprints").joinpath("fingerprints.db")
+
+    with timer("dedup.stat"):
+        stats = [os.stat(filepath) for filepath in file_list]
+    df = pd.DataFrame(
+        {
+            "filepath": [os.path.abspath(filepath) for filepath in file_list],
+            "size": [stat.st_size for stat in stats],
+            "mtime_ns": [stat.st_mtime_ns for stat in stats],
+        }
+    )
+
+    conn = sqlite3.connect(fingerprint_file)
+    try:
+        # reuse hashes of files that have not changed since they were cached
+        cache = load_fingerprints(conn)
+        cached = [
+            cache.get(filepath, (None,) * 4) for filepath in df["filepath"].tolist()
+        ]
+        valid = [
+            elem[:2] == (size, mtime)
+            for elem, size, mtime in zip(cached, df["size"], df["mtime_ns"])
+        ]
+        df["quick_hash"] = [elem[2] if ok else None for elem, ok in zip(cached, valid)]
+        df["full_hash"] = [elem[3] if ok else None for elem, ok in zip(cached, valid)]
+
+        # stage 1: only files sharing a size can be duplicates
+        candidates = df["size"].duplicated(keep=False) & (df["size"] > 0)
+        # stage 2: split candidates by the hash of their first and last blocks
+        _fill_hashes(df, candidates, "quick_hash", quick_hash)
+        candidates &= df.duplicated(["size", "quick_hash"], keep=False)
+        # stage 3: hash the remaining collisions in full
+        _fill_hashes(df, candidates, "full_hash", hash_file)
+
+        save_fingerprints(conn, df)
+    finally:
+        conn.close()
+
+    first = (
+        df[df["full_hash"].notna()]
+        .drop_duplicates(["size", "full_hash"])
+        .set_index(["size", "full_hash"])["filepath"]
+    )
+    keys = pd.MultiIndex.from_frame(df[["size", "full_hash"]])
+    df["duplicate_of"] = first.reindex(keys).to_numpy()
+    df.loc[df["duplicate_of"] == df["filepath"], "duplicate_of"] = None
+    df.loc[df["full_hash"].isna(), "duplicate_of"] = None
+
+    num_duplicates = int(df["duplicate_of"].notna().sum())
+    count("dedup.duplicates", num_duplicates)
+    logger.info(f"Found {num_duplicates} duplicate(s) in {len(df)} files")
+    return df
+
+
+def drop_duplicates(file_list: List[str], fingerprints: "pd.DataFrame") -> List[str]:
+    """Return the files of file_list that are not duplicates of an earlier file."""
+    keep = fingerprints["duplicate_of"].isna().tolist()
+    return [filepath for filepath, elem in zip(file_list, keep) if elem]
+
+
+def split_duplicates(
+    df_file_rename: "pd.DataFrame", fingerprints: Optional["pd.DataFrame"] = None
+) -> Tuple["pd.DataFrame", "pd.DataFrame"]:
+    """Split renames into files to export and duplicates to link to them.
+
+    :param df_file_rename: DataFrame with old_filepath and new_filepath columns.
+    :param fingerprints: Output of ``fingerprint_files`` for the same files.
+    :return: The rows to export, and the duplicate rows with a link_to column
+        holding the new_filepath of the first copy and its index in source_index.
+    """
+    import pandas as pd
+
+    if fingerprints is None:
+        return df_file_rename, df_file_rename.iloc[:0].assign(
+            link_to=None, source_index=None
+        )
+
+    old_paths = df_file_rename["old_filepath"].map(os.path.abspath)
+    row_of = pd.Series(df_file_rename.index, index=old_paths)
+    duplicate_of = old_paths.map(fingerprints.set_index("filepath")["duplicate_of"])
+    source_index = duplicate_of.map(row_of)
+    is_duplicate = source_index.notna()
+
+    df_links = df_file_rename[is_duplicate].copy()
+    df_links["source_index"] = source_index[is_duplicate].astype(int)
+    df_links["link_to"] = df_file_rename.loc[
+        df_links["source_index"], "new_filepath"
+    ].to_numpy()
+    return df_file_rename[~is_duplicate], df_links
+
+
+def link_duplicates(df_links: "pd.DataFrame") -> None:
+    """Hardlink each duplicate's new_filepath to the export of its first copy.
+
+    Links left by an earlier run are kept, other existing targets are counted as
+    errors.
+    """
+    linked = 0
+    with timer("dedup.link"), progress.track("link", total=len(df_links)) as tracker:
+        for link_to, new_filepath in zip(df_links["link_to"], df_links["new_filepath"]):
+            try:
+                os.link(link_to, new_filepath)
+            except FileExistsError as e:
+                if not os.path.samefile(link_to, new_filepath):
+                    logger.error(f"Failed to link {new_filepath}: {e}")
+                    tracker.update(errors=1)
+                    continue
+            linked += 1
+            tracker.update()
+    count("dedup.linked", linked)
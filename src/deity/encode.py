@@ -2,19 +2,27 @@
 """encde.py in src/deity.
 
 Helper functions to encode identifiers in a filename with an MD5 hash of the identifier.
+pandas is only imported by the functions returning DataFrames.
 """
+
 import hashlib
 import re
 from pathlib import Path
+from typing import TYPE_CHECKING
 from typing import Optional
 from typing import Union
 
-import pandas as pd
-from tqdm import tqdm
-
+from deity import progress
+from deity.ontology.matcher import RegionMatcher
+from deity.profiling import count
+from deity.profiling import timer
 from deity.utils import DEFAULT_PATTERNS
 
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+
 def encode(text: str, num_chars: int = 16) -> tuple:
     """Accept identifier as string and return md5 hash of str identifier."""
     if not isinstance(text, str):
@@ -28,6 +36,21 @@ def encode(text: str, num_chars: int = 16) -> tuple:
     return full_hash, short_hash
 
 
+def content_hash() -> "hashlib._Hash":
+    """Return a new hash object for file contents (md5)."""
+    return hashlib.md5(usedforsecurity=False)
+
+
+def hash_file(filepath: Union[str, Path], chunk_size: int = 2**20) -> str:
+    """Return the md5 hash of a file's contents, read in chunks."""
+    md5 = content_hash()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
 def encode_single(
     filepath: Union[str, Path],
     pattern: Union[str] = None,
@@ -36,25 +59,27 @@ def encode_single(
     num_chars: int = 16,
 ) -> tuple:
     """Accept filepath and return new filepath with encoded identifier."""
-    # create Path object
-    filepath = Path(filepath).resolve()
+    with timer("encode.resolve"):
+        # create Path object
+        filepath = Path(filepath).resolve()
 
-    pattern = [pattern] if pattern and isinstance(pattern, str) else DEFAULT_PATTERNS
+        # set output_dir to source filepath if not specified
+        if output_dir is None or not Path(output_dir).exists():
+            output_dir = filepath.parent
+        else:
+            output_dir = Path(output_dir)
 
-    # set output_dir to source filepath if not specified
-    if output_dir is None or not Path(output_dir).exists():
-        output_dir = filepath.parent
-    else:
-        output_dir = Path(output_dir)
+    pattern = [pattern] if pattern and isinstance(pattern, str) else DEFAULT_PATTERNS
 
-    # compile regex to replace identifier
-    for elem in pattern:
-        pattern_regex = re.compile(elem, flags=ignore_case)
+    with timer("encode.regex"):
+        # compile regex to replace identifier
+        for elem in pattern:
+            pattern_regex = re.compile(elem, flags=ignore_case)
 
-        match = pattern_regex.search(filepath.name)
-        # break on first match
-        if match:
-            break
+            match = pattern_regex.search(filepath.name)
+            # break on first match
+            if match:
+                break
 
     identifier = match[0] if match else None
 
@@ -71,14 +96,146 @@ def encode_single(
     return identifier, new_filepath, full_hash, short_hash
 
 
+def _extract_identifiers(
+    names: "pd.Series", patterns: list, ignore_case: bool = re.IGNORECASE
+) -> tuple:
+    """Extract the identifier of each name with the first pattern that matches.
+
+    :return: The identifiers (None if unmatched) and the index of the pattern that
+        matched (-1 if unmatched), both aligned to names.
+    """
+    import pandas as pd
+
+    identifier = pd.Series([None] * len(names), index=names.index, dtype=object)
+    pattern_idx = pd.Series(-1, index=names.index)
+    for idx, elem in enumerate(patterns):
+        todo = identifier.isna()
+        if not todo.any():
+            break
+
+        found = names[todo].str.extract(f"({elem})", flags=ignore_case, expand=True)[0]
+        found = found.dropna()
+        identifier[found.index] = found
+        pattern_idx[found.index] = idx
+
+    return identifier, pattern_idx
+
+
+def _hash_unique(identifier: "pd.Series", num_chars: int = 16) -> tuple:
+    """Hash each unique identifier once and map the hashes back to every row.
+
+    :return: The full and short hashes (None if unmatched), aligned to identifier.
+    """
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(identifier)
+    hashes = [encode(elem, num_chars) for elem in uniques]
+    # code -1 marks a missing identifier and takes the trailing None
+    full = np.array([elem[0] for elem in hashes] + [None], dtype=object)
+    short = np.array([elem[1] for elem in hashes] + [None], dtype=object)
+    return (
+        pd.Series(full[codes], index=identifier.index, dtype=object),
+        pd.Series(short[codes], index=identifier.index, dtype=object),
+    )
+
+
+def encode_series(
+    values: "pd.Series",
+    pattern: Optional[str] = None,
+    ignore_case: bool = re.IGNORECASE,
+    num_chars: int = 16,
+) -> "pd.DataFrame":
+    """Encode the identifier found in each value of a Series.
+
+    Values are matched as in ``encode_batch``, without building paths, so a column
+    of accession numbers is encoded in a few vectorized passes.
+
+    :return: DataFrame with identifier, short_hash and full_hash columns, indexed
+        like values. All three are None where no identifier is found.
+    """
+    import pandas as pd
+
+    if not isinstance(values, pd.Series):
+        raise TypeError(
+            f"Requires 'Series' input, but received {values} ({type(values)})"
+        )
+
+    pattern = [pattern] if pattern and isinstance(pattern, str) else DEFAULT_PATTERNS
+    with timer("encode.series"):
+        # missing values stay unmatched instead of becoming the string "nan"
+        names = values.astype(str).where(values.notna())
+        identifier, _ = _extract_identifiers(names, pattern, ignore_case)
+        full_hash, short_hash = _hash_unique(identifier, num_chars)
+    count("values.encoded", int(identifier.notna().sum()))
+
+    return pd.DataFrame(
+        {"identifier": identifier, "short_hash": short_hash, "full_hash": full_hash}
+    )
+
+
+def encode_batch(
+    filenames: list,
+    pattern: Optional[str] = None,
+    ignore_case: bool = re.IGNORECASE,
+    num_chars: int = 16,
+) -> "pd.DataFrame":
+    """Encode identifiers in a list of filenames without touching the filesystem.
+
+    Identifiers are extracted column-wise one pattern at a time, so each filename is
+    matched by the first pattern that finds an identifier, as in ``encode_single``.
+    Each unique identifier is hashed once and the hash is mapped back to every row.
+    """
+    import pandas as pd
+
+    if not isinstance(filenames, list):
+        raise TypeError(
+            f"Requires 'list' input, but received {filenames} ({type(filenames)})"
+        )
+
+    pattern = [pattern] if pattern and isinstance(pattern, str) else DEFAULT_PATTERNS
+    names = pd.Series(filenames, dtype=object).astype(str)
+    identifier, pattern_idx = _extract_identifiers(names, pattern, ignore_case)
+    full_hash, short_hash = _hash_unique(identifier, num_chars)
+
+    # replace identifiers with the short hash, one pattern at a time
+    new_filename = names.copy()
+    for idx, elem in enumerate(pattern):
+        mask = pattern_idx == idx
+        if mask.any():
+            pattern_regex = re.compile(elem, flags=ignore_case)
+            new_filename[mask] = [
+                pattern_regex.sub(code, name)
+                for code, name in zip(short_hash[mask], names[mask])
+            ]
+
+    return pd.DataFrame(
+        {
+            "identifier": identifier,
+            "short_hash": short_hash,
+            "full_hash": full_hash,
+            "filename": names,
+            "new_filename": new_filename,
+        }
+    )
+
+
 def encode_all(
     filepath_list: list,
     pattern: Optional[str] = None,
     output_dir: str = None,
     ignore_case: bool = re.IGNORECASE,
     num_chars: int = 16,
-) -> pd.DataFrame:
-    """Accept filepath and return new filepath with encoded identifier."""
+    region_matcher: Optional[RegionMatcher] = None,
+) -> "pd.DataFrame":
+    """Accept filepath and return new filepath with encoded identifier.
+
+    If a region_matcher is given, the first brain region named in each filename is
+    added in the region_id and region columns.
+    """
+    import pandas as pd
+    from tqdm import tqdm
+
     if not isinstance(filepath_list, list):
         raise TypeError(
             f"Requires 'list' input, but received {filepath_list} ({type(filepath_list)})"
@@ -92,7 +249,9 @@ def encode_all(
     new_filepath_list = []
     full_hash_list = []
     short_hash_list = []
-    for file in tqdm(filepath_list):
+    region_id_list = []
+    tracker = progress.track("encode", total=len(filepath_list))
+    for file in tqdm(filepath_list, disable=progress.is_enabled()):
         specimen_id, new_filename, full_hash, short_hash = encode_single(
             file,
             pattern=pattern,
@@ -104,8 +263,16 @@ def encode_all(
         new_filepath_list.append(str(new_filename))
         full_hash_list.append(str(full_hash))
         short_hash_list.append(str(short_hash))
+        if region_matcher is not None:
+            with timer("encode.region"):
+                region_id_list.append(region_matcher.match(file.name))
+        tracker.update()
+    tracker.close()
 
-    return pd.DataFrame(
+    count("files.encoded", sum(elem is not None for elem in id_list))
+    count("files.unmatched", sum(elem is None for elem in id_list))
+
+    df = pd.DataFrame(
         {
             "identifier": id_list,
             "short_hash": short_hash_list,
@@ -114,3 +281,8 @@ def encode_all(
             "new_filepath": new_filepath_list,
         }
     )
+    if region_matcher is not None:
+        df["region_id"] = pd.array(region_id_list, dtype="Int64")
+        df["region"] = [region_matcher.acronyms.get(elem) for elem in region_id_list]
+
+    return df
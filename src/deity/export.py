@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""export.py in src/deity.
+
+Materialize encoded files in an output directory without moving the originals. Each
+file is hardlinked, reflinked (``FICLONE``), copied in the kernel with
+``copy_file_range``, or copied in chunks, whichever is the first to work.
+"""
+
+import errno
+import filecmp
+import mmap
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
+
+from loguru import logger
+
+from deity import progress
+from deity.encode import content_hash
+from deity.profiling import count
+from deity.profiling import timer
+from deity.scheduler import io_map
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+EXPORT_MODES = ["rename", "auto", "hardlink", "reflink", "copy", "checksum"]
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+# a multiple of the page size, so reads and writes stay aligned
+CHUNK_SIZE = 2**23
+
+# copy buffers of checksum_copy, one per thread
+_BUFFERS = threading.local()
+
+# errors meaning a method is unsupported between two filesystems, not that it failed
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EMLINK,
+}
+
+
+def same_content(src: Union[str, Path], dst: Union[str, Path]) -> bool:
+    """Whether dst is a link to src or holds the same bytes."""
+    return os.path.samefile(src, dst) or filecmp.cmp(src, dst, shallow=False)
+
+
+def hardlink(src: Path, dst: Path) -> None:
+    """Link dst to the inode of src."""
+    os.link(src, dst)
+
+
+def reflink(src: Path, dst: Path) -> None:
+    """Clone src to dst sharing extents (btrfs, xfs and other CoW filesystems)."""
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+
+
+def copy_range(src: Path, dst: Path) -> None:
+    """Copy src to dst in the kernel with copy_file_range."""
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(
+                    fsrc.fileno(), fdst.fileno(), min(remaining, 2**30)
+                )
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def chunked_copy(src: Path, dst: Path) -> None:
+    """Copy src to dst in user space, CHUNK_SIZE bytes at a time."""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+    shutil.copystat(src, dst)
+
+
+def _buffer(size: int) -> memoryview:
+    """Return the buffer of this thread, allocated once per size.
+
+    Anonymous maps are page-aligned and their pages are only touched when used, so
+    small files do not pay for a large buffer.
+    """
+    buffer = getattr(_BUFFERS, "buffer", None)
+    if buffer is None or len(buffer) != size:
+        buffer = _BUFFERS.buffer = mmap.mmap(-1, size)
+    return memoryview(buffer)
+
+
+def checksum_copy(
+    src: Union[str, Path], dst: Union[str, Path], chunk_size: int = CHUNK_SIZE
+) -> str:
+    """Copy src to dst in chunks and return the content hash of the copied bytes.
+
+    The hash is computed from the same buffer that is written, so the file is read
+    only once.
+    """
+    digest = content_hash()
+    view = _buffer(chunk_size)
+    with open(src, "rb", buffering=0) as fsrc, open(dst, "wb", buffering=0) as fdst:
+        while True:
+            num = fsrc.readinto(view)
+            if not num:
+                break
+            digest.update(view[:num])
+            written = 0
+            while written < num:
+                written += fdst.write(view[written:num])
+    shutil.copystat(src, dst)
+    return digest.hexdigest()
+
+
+METHODS: Dict[str, Callable[[Path, Path], None]] = {
+    "hardlink": hardlink,
+    "reflink": reflink,
+    "copy_file_range": copy_range,
+    "copy": chunked_copy,
+}
+MODE_METHODS = {
+    "auto": ["hardlink", "reflink", "copy_file_range", "copy"],
+    "hardlink": ["hardlink"],
+    "reflink": ["reflink"],
+    "copy": ["copy_file_range", "copy"],
+}
+
+
+class Exporter:
+    """Export files with the first method that works for each pair of devices.
+
+    Methods that are unsupported between two devices are remembered, so they are
+    tried once per device pair instead of once per file. Existing targets with the
+    content of their source are kept, other existing targets are never replaced.
+    """
+
+    def __init__(self, mode: str = "auto") -> None:
+        if mode not in MODE_METHODS:
+            raise ValueError(
+                f"Expected one of {list(MODE_METHODS)}, but received {mode}"
+            )
+        self.methods = MODE_METHODS[mode]
+        self._unsupported: Dict[Tuple[int, int], Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, src: Union[str, Path], dst: Union[str, Path]) -> str:
+        """Export src to dst and return the name of the method used."""
+        src, dst = Path(src), Path(dst)
+        if os.path.lexists(dst):
+            if not same_content(src, dst):
+                raise FileExistsError(
+                    errno.EEXIST, "Export target exists with other content", str(dst)
+                )
+            return "existing"
+
+        devices = (src.stat().st_dev, dst.parent.stat().st_dev)
+        unsupported = self._unsupported.get(devices, set())
+
+        error = None
+        for name in self.methods:
+            if name in unsupported:
+                continue
+            try:
+                METHODS[name](src, dst)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                error = e
+                with self._lock:
+                    self._unsupported.setdefault(devices, set()).add(name)
+                continue
+            return name
+
+        raise OSError(f"Could not export {src} with {self.methods}") from error
+
+
+def mirror_paths(
+    df: "pd.DataFrame", input_dir: Union[str, Path], output_dir: Union[str, Path]
+) -> "pd.DataFrame":
+    """Place each new_filepath at the same relative directory under output_dir."""
+    input_dir, output_dir = Path(input_dir), Path(output_dir)
+    df = df.copy()
+    df["new_filepath"] = [
+        str(
+            output_dir.joinpath(Path(old).parent.relative_to(input_dir), Path(new).name)
+        )
+        for old, new in zip(df["old_filepath"], df["new_filepath"])
+    ]
+    return df
+
+
+def make_dirs(destinations: List[Union[str, Path]]) -> None:
+    """Create the parent directories, with one mkdir per directory, not per file."""
+    with timer("export.mkdir"):
+        for directory in sorted({Path(dst).parent for dst in destinations}):
+            directory.mkdir(parents=True, exist_ok=True)
+
+
+def _size(src: Union[str, Path], *args) -> int:
+    return os.stat(src).st_size
+
+
+def export_files(
+    df_file_rename: "pd.DataFrame", mode: str = "auto", workers: int = 8
+) -> List[str]:
+    """Export each old_filepath to new_filepath, creating directories first.
+
+    :param df_file_rename: DataFrame with old_filepath and new_filepath columns.
+    :param mode: "auto", "hardlink", "reflink" or "copy".
+    :param workers: Maximum number of threads exporting files.
+    :return: The method used for each file, None if its target already existed with
+        other content.
+    """
+    exporter = Exporter(mode)
+
+    def export_file(src: Union[str, Path], dst: Union[str, Path]) -> Optional[str]:
+        try:
+            return exporter(src, dst)
+        except FileExistsError as e:
+            logger.error(f"Failed to export {src}: {e}")
+            return None
+
+    sources = df_file_rename["old_filepath"].tolist()
+    destinations = df_file_rename["new_filepath"].tolist()
+
+    make_dirs(destinations)
+
+    logger.info(f"Exporting {len(sources)} files ({mode})...")
+    methods = []
+    with timer("export.files"), progress.track("export", total=len(sources)) as tracker:
+        results = io_map(
+            export_file, sources, destinations, max_workers=workers, nbytes=_size
+        )
+        for dst, method in zip(destinations, results):
+            methods.append(method)
+            if method is None:
+                tracker.update(errors=1)
+                continue
+            count(f"export.{method}")
+            tracker.update(nbytes=os.stat(dst).st_size)
+
+    errors = methods.count(None)
+    if errors:
+        logger.warning(f"{errors} of {len(sources)} files were not exported")
+    return methods
+
+
+def export_checksums(
+    df_file_rename: "pd.DataFrame", workers: int = 8, chunk_size: int = CHUNK_SIZE
+) -> List[str]:
+    """Copy each old_filepath to new_filepath and return the content hashes.
+
+    :param df_file_rename: DataFrame with old_filepath and new_filepath columns.
+    :param workers: Maximum number of files copied concurrently (I/O depth).
+    :param chunk_size: Bytes read and written per call.
+    :return: The content hash of each copied file.
+    """
+    sources = df_file_rename["old_filepath"].tolist()
+    destinations = df_file_rename["new_filepath"].tolist()
+    make_dirs(destinations)
+
+    logger.info(f"Copying {len(sources)} files with checksums...")
+    checksums = []
+    with (
+        timer("export.checksum"),
+        progress.track("export", total=len(sources)) as tracker,
+    ):
+        results = io_map(
+            checksum_copy,
+            sources,
+            destinations,
+            [chunk_size] * len(sources),
+            max_workers=workers,
+            nbytes=_size,
+        )
+        for dst, checksum in zip(destinations, results):
+            checksums.append(checksum)
+            tracker.update(nbytes=os.stat(dst).st_size)
+    count("export.checksum", len(checksums))
+
+    return checksums
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""log.py in src/deity.
+
+Logging configuration. The default ``rich`` mode renders every message through a
+Rich console handler. The ``plain`` mode uses a fast text formatter, and the
+``async`` mode additionally writes from a background thread and flushes the console
+in batches. Repeated warnings from the same line are collapsed into a count, so the
+cost of logging does not grow with the number of files.
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import TextIO
+from typing import Tuple
+from typing import Union
+
+from loguru import logger
+from rich.console import Console
+from rich.logging import RichHandler
+
+
+MODES = ["auto", "rich", "plain", "async"]
+RICH_FORMAT = "[blue]{function}[/blue]: {message}"
+PLAIN_FORMAT = "{time:HH:mm:ss.SSS} | {level: <8} | {function}: {message}\n{exception}"
+
+_HANDLER_IDS: List[int] = []
+_AGGREGATOR: Optional["WarningAggregator"] = None
+
+
+class WarningAggregator:
+    """Loguru filter that passes the first warnings from each line and counts the rest.
+
+    A record is counted once even if several handlers share the filter.
+    """
+
+    def __init__(self, max_repeats: int = 3) -> None:
+        self.max_repeats = max_repeats
+        self.counts: Dict[Tuple[str, str, int], int] = {}
+        self._lock = threading.Lock()
+        self._last_record: Optional[dict] = None
+        self._last_result = True
+
+    def __call__(self, record: dict) -> bool:
+        if record["level"].name != "WARNING" or record["extra"].get("aggregated"):
+            return True
+
+        with self._lock:
+            if record is not self._last_record:
+                key = (record["name"], record["function"], record["line"])
+                self.counts[key] = self.counts.get(key, 0) + 1
+                self._last_record = record
+                self._last_result = self.counts[key] <= self.max_repeats
+            return self._last_result
+
+    def suppressed(self) -> Dict[Tuple[str, str, int], int]:
+        """Return the number of suppressed warnings per (module, function, line)."""
+        return {
+            key: num - self.max_repeats
+            for key, num in self.counts.items()
+            if num > self.max_repeats
+        }
+
+    def log_summary(self) -> None:
+        """Log one warning per line with suppressed warnings, then reset the counts."""
+        for (name, function, line), num in self.suppressed().items():
+            logger.bind(aggregated=True).warning(
+                f"{num} similar warning(s) from {name}:{function}:{line} suppressed"
+            )
+        self.counts.clear()
+
+
+class BatchedStream:
+    """Stream wrapper that buffers messages and writes them in batches.
+
+    Loguru flushes stream sinks after every message, so ``flush`` only writes once
+    ``batch_size`` messages are buffered or ``flush_interval`` seconds have passed.
+    A background thread also writes every ``flush_interval`` seconds, so messages are
+    not held back while no others arrive, and messages at ``flush_level`` or above
+    are written at once. ``stop`` (called when the handler is removed) writes the
+    remainder.
+    """
+
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        flush_level: int = 30,
+    ) -> None:
+        self.stream = stream or sys.stderr
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self.buffer: List[str] = []
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+
+    def write(self, message: str) -> None:
+        # loguru messages carry their record
+        record = getattr(message, "record", None)
+        with self._lock:
+            self.buffer.append(message)
+            if record is not None and record["level"].no >= self.flush_level:
+                self._write()
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run, daemon=True)
+                self._timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            if (
+                len(self.buffer) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval
+            ):
+                self._write()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._timer is not None:
+            self._timer.join()
+            self._timer = None
+        self._stopped.clear()
+        with self._lock:
+            self._write()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            with self._lock:
+                if self.buffer:
+                    self._write()
+
+    def _write(self) -> None:
+        """Write the buffered messages. The lock must be held."""
+        if self.buffer:
+            self.stream.write("".join(self.buffer))
+            self.buffer.clear()
+        self.stream.flush()
+        self.last_flush = time.monotonic()
+
+
+def rich_handler() -> RichHandler:
+    """Return the Rich console handler used by the ``rich`` mode."""
+    return RichHandler(
+        markup=True,
+        level="INFO",
+        console=Console(width=120, color_system="auto"),
+    )
+
+
+def configure_logging(
+    mode: str = "rich",
+    log_file: Optional[Union[str, Path]] = None,
+    level: str = "INFO",
+    max_repeats: Optional[int] = None,
+) -> Optional[WarningAggregator]:
+    """Replace the deity log handlers.
+
+    :param mode: "rich", "plain", "async", or "auto" for rich on a terminal and
+        plain otherwise.
+    :param log_file: Optional log file, rotated every 10 MB.
+    :param level: Minimum level of the console handler.
+    :param max_repeats: If set, warnings from the same line after the first
+        ``max_repeats`` are counted instead of logged, see ``shutdown_logging``.
+    :return: The warning aggregator, if any.
+    """
+    global _AGGREGATOR
+    if mode not in MODES:
+        raise ValueError(f"Expected one of {MODES}, but received {mode}")
+    if mode == "auto":
+        mode = "rich" if sys.stderr.isatty() else "plain"
+
+    for handler_id in _HANDLER_IDS:
+        logger.remove(handler_id)
+    _HANDLER_IDS.clear()
+
+    _AGGREGATOR = WarningAggregator(max_repeats) if max_repeats is not None else None
+    enqueue = mode == "async"
+    if mode == "rich":
+        console = {"sink": rich_handler(), "format": RICH_FORMAT}
+    else:
+        sink = BatchedStream(sys.stderr) if enqueue else sys.stderr
+        console = {"sink": sink, "format": PLAIN_FORMAT, "colorize": False}
+
+    _HANDLER_IDS.append(
+        logger.add(**console, level=level, filter=_AGGREGATOR, enqueue=enqueue)
+    )
+    if log_file is not None:
+        _HANDLER_IDS.append(
+            logger.add(
+                log_file,
+                rotation="10 MB",
+                level="INFO",
+                filter=_AGGREGATOR,
+                enqueue=enqueue,
+                # written by the file object in blocks instead of per message
+                buffering=2**16 if enqueue else -1,
+            )
+        )
+
+    return _AGGREGATOR
+
+
+def shutdown_logging() -> None:
+    """Log suppressed warning counts, write pending messages and restore the default.
+
+    Removing the handlers waits for queued messages and flushes batched streams.
+    """
+    if _AGGREGATOR is not None:
+        _AGGREGATOR.log_summary()
+    configure_logging()
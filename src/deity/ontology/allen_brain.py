@@ -1,12 +1,23 @@
 #!/usr/bin/env python3
 """allen_brain.py in src/deity/ontology."""
 
+from pathlib import Path
 from typing import Any
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
 
 import pandas as pd
 
+from deity.utils import json_loader
+
+
+_END = object()
+
 
 def flatten_ontology_tree(
     node: Dict[str, Any],
@@ -47,6 +58,150 @@ def flatten_ontology_tree(
     return flattened_list
 
 
+def iter_json_events(obj: Any) -> Iterator[Tuple[str, Any]]:
+    """
+    Iteratively walks a loaded JSON object and yields ijson-style parser events.
+
+    Args:
+        obj (Any): The loaded JSON document.
+
+    Yields:
+        Tuple[str, Any]: (event, value) pairs such as ("start_map", None),
+            ("map_key", "id") or ("number", 997).
+    """
+    stack: List[Tuple[Optional[str], Iterator[Any]]] = [(None, iter((obj,)))]
+    while stack:
+        kind, items = stack[-1]
+        item = next(items, _END)
+        if item is _END:
+            stack.pop()
+            if kind is not None:
+                yield f"end_{kind}", None
+            continue
+
+        if kind == "map":
+            key, item = item
+            yield "map_key", key
+
+        if isinstance(item, dict):
+            yield "start_map", None
+            stack.append(("map", iter(item.items())))
+        elif isinstance(item, list):
+            yield "start_array", None
+            stack.append(("array", iter(item)))
+        elif item is None:
+            yield "null", None
+        elif isinstance(item, bool):
+            yield "boolean", item
+        elif isinstance(item, (int, float)):
+            yield "number", item
+        else:
+            yield "string", item
+
+
+def _open_frame(
+    event: str, frame: Optional[list], parent_rows: List[Optional[int]]
+) -> list:
+    """Return the stack frame for a new JSON object or array."""
+    kind, target, key = frame if frame else (None, None, None)
+    is_children = kind == "children" or (kind == "node" and key == "children")
+
+    if event == "start_map":
+        if kind is None:
+            return ["top", None, None]
+        if kind in ("top", "roots") or is_children:
+            # allocate a row for a new node
+            parent_rows.append(None if kind in ("top", "roots") else target)
+            return ["node", len(parent_rows) - 1, None]
+        return ["dict", {}, None]
+
+    if kind in (None, "top"):
+        return ["roots", None, None]
+    if kind == "node" and key == "children":
+        return ["children", target, None]
+    return ["list", [], None]
+
+
+def _store_value(frame: Optional[list], columns: Dict[str, list], value: Any) -> None:
+    """Store a completed value in the enclosing stack frame."""
+    kind, target, key = frame if frame else (None, None, None)
+    if kind == "node" and key != "children":
+        column = columns.setdefault(key, [])
+        column.extend([None] * (target + 1 - len(column)))
+        column[target] = value
+    elif kind == "dict":
+        target[key] = value
+    elif kind == "list":
+        target.append(value)
+
+
+def flatten_ontology_events(events: Iterable[Tuple[str, Any]]) -> Dict[str, list]:
+    """
+    Flattens a stream of JSON parser events into columnar arrays with an explicit stack.
+
+    Each value of the top-level object is a root node (as in ``ontology_to_dataframe``),
+    and a top-level list is treated as a list of root nodes. Nodes are numbered in
+    pre-order, so the rows match those of ``flatten_ontology_tree``.
+
+    Args:
+        events (Iterable[Tuple[str, Any]]): Events from ``iter_json_events`` or
+            ``ijson.basic_parse``.
+
+    Returns:
+        Dict[str, list]: A dictionary of equal length columns, including parent_id.
+    """
+    columns: Dict[str, list] = {}
+    parent_rows: List[Optional[int]] = []
+    # frames are [kind, row or container, current key]
+    stack: List[list] = []
+
+    for event, value in events:
+        if event == "map_key":
+            stack[-1][2] = value
+        elif event in ("start_map", "start_array"):
+            stack.append(_open_frame(event, stack[-1] if stack else None, parent_rows))
+        elif event in ("end_map", "end_array"):
+            kind, target, _key = stack.pop()
+            if kind in ("dict", "list"):
+                _store_value(stack[-1] if stack else None, columns, target)
+        else:
+            _store_value(stack[-1] if stack else None, columns, value)
+
+    # pad columns for keys missing from the last nodes and resolve parent ids
+    num_rows = len(parent_rows)
+    for column in columns.values():
+        column.extend([None] * (num_rows - len(column)))
+
+    ids = columns.get("id", [None] * num_rows)
+    columns["parent_id"] = [
+        None if parent is None else ids[parent] for parent in parent_rows
+    ]
+    return columns
+
+
+def stream_ontology_file(file_path: Union[str, Path]) -> Dict[str, list]:
+    """
+    Flattens an ontology JSON file into columnar arrays without recursion.
+
+    The file is parsed incrementally with ``ijson`` if it is installed, as by
+    ``pip install deity[streaming]``, otherwise it is loaded with ``json_loader`` and
+    walked iteratively.
+
+    Args:
+        file_path (Union[str, Path]): Path to the nested ontology JSON file.
+
+    Returns:
+        Dict[str, list]: A dictionary of equal length columns, including parent_id.
+    """
+    try:
+        import ijson
+    except ImportError:
+        return flatten_ontology_events(iter_json_events(json_loader(file_path)))
+
+    with open(file_path, "rb") as f:
+        return flatten_ontology_events(ijson.basic_parse(f, use_float=True))
+
+
 def ontology_to_dataframe(nested_dict: Dict[str, Any]) -> pd.DataFrame:
     """
     Converts a nested ontology dictionary into a Pandas DataFrame.
@@ -57,11 +212,17 @@ def ontology_to_dataframe(nested_dict: Dict[str, Any]) -> pd.DataFrame:
     Returns:
         pd.DataFrame: A DataFrame where each row is a node in the ontology tree.
     """
-    flattened_nodes = []
+    return pd.DataFrame(flatten_ontology_events(iter_json_events(nested_dict)))
+
+
+def ontology_file_to_dataframe(file_path: Union[str, Path]) -> pd.DataFrame:
+    """
+    Streams a nested ontology JSON file into a Pandas DataFrame.
 
-    # Process each top-level key
-    for root_key, root_node in nested_dict.items():
-        flattened_nodes.extend(flatten_ontology_tree(root_node))
+    Args:
+        file_path (Union[str, Path]): Path to the nested ontology JSON file.
 
-    # Create and return a DataFrame from the flattened list
-    return pd.DataFrame(flattened_nodes)
\ No newline at end of file
+    Returns:
+        pd.DataFrame: A DataFrame where each row is a node in the ontology tree.
+    """
+    return pd.DataFrame(stream_ontology_file(file_path))
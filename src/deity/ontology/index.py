@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""index.py in src/deity/ontology.
+
+Tree index over a flattened ontology table for fast ancestor, descendant, lowest
+common ancestor and path queries.
+"""
+
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+
+Key = Union[int, str]
+
+
+class OntologyIndex:
+    """Nested-set index of an ontology tree.
+
+    Nodes are numbered in pre-order, so the descendants of a node occupy the
+    interval ``[start, stop]`` of the pre-order and ancestor tests are a pair of
+    comparisons. Lowest common ancestors are answered in constant time with a sparse
+    table over the node depths. Nodes can be referenced by id, name or acronym.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        parent: np.ndarray,
+        depth: np.ndarray,
+        stop: np.ndarray,
+        names: np.ndarray,
+        acronyms: np.ndarray,
+        sparse: Optional[List[np.ndarray]] = None,
+    ) -> None:
+        """Create an index from arrays in pre-order, see ``from_dataframe``."""
+        self.ids = ids
+        self.parent = parent
+        self.depth = depth
+        self.stop = stop
+        self.names = names
+        self.acronyms = acronyms
+        self.sparse = sparse if sparse is not None else self._build_sparse(depth)
+
+        # hash maps from id, acronym and name to pre-order position
+        self._keys: Dict[Key, int] = {}
+        for labels in (self.names, self.acronyms):
+            for pos, label in enumerate(labels.tolist()):
+                if label:
+                    self._keys.setdefault(label.lower(), pos)
+        self._keys.update({node_id: pos for pos, node_id in enumerate(ids.tolist())})
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        df: pd.DataFrame,
+        id_col: str = "id",
+        parent_col: str = "parent_id",
+        name_col: str = "name",
+        acronym_col: str = "acronym",
+    ) -> "OntologyIndex":
+        """Build the index from a flattened ontology such as ``ontology_to_dataframe``."""
+        node_ids = df[id_col].astype("int64").to_numpy()
+        parent_ids = df[parent_col].to_numpy()
+        duplicated = pd.Series(node_ids).duplicated().to_numpy()
+        if duplicated.any():
+            duplicates = sorted(set(node_ids[duplicated].tolist()))
+            raise ValueError(f"Ontology contains duplicate ids {duplicates}")
+        row_of = {node_id: row for row, node_id in enumerate(node_ids.tolist())}
+
+        # children of each row, preserving the table order
+        children: Dict[int, List[int]] = {}
+        roots = []
+        for row, parent_id in enumerate(parent_ids.tolist()):
+            if pd.isnull(parent_id) or int(parent_id) not in row_of:
+                roots.append(row)
+            else:
+                children.setdefault(row_of[int(parent_id)], []).append(row)
+
+        # iterative depth first search to number nodes in pre-order
+        order: List[int] = []
+        parent = np.full(len(df), -1, dtype=np.int64)
+        depth = np.zeros(len(df), dtype=np.int64)
+        stop = np.zeros(len(df), dtype=np.int64)
+        stack = [(row, -1, 0, False) for row in reversed(roots)]
+        while stack:
+            row, parent_pos, level, visited = stack.pop()
+            if visited:
+                stop[row] = len(order) - 1
+                continue
+
+            pos = len(order)
+            order.append(row)
+            parent[row] = parent_pos
+            depth[row] = level
+            stack.append((row, parent_pos, level, True))
+            stack.extend(
+                (child, pos, level + 1, False)
+                for child in reversed(children.get(row, []))
+            )
+
+        if len(order) != len(df):
+            raise ValueError("Ontology contains a cycle")
+
+        order = np.asarray(order, dtype=np.int64)
+
+        def labels(col: str) -> np.ndarray:
+            if col not in df.columns:
+                return np.full(len(df), "", dtype=str)
+            return df[col].fillna("").astype(str).to_numpy()[order].astype(str)
+
+        return cls(
+            ids=node_ids[order],
+            parent=parent[order],
+            depth=depth[order],
+            stop=stop[order],
+            names=labels(name_col),
+            acronyms=labels(acronym_col),
+        )
+
+    @staticmethod
+    def _build_sparse(depth: np.ndarray) -> List[np.ndarray]:
+        """Sparse table of the position with minimum depth in each 2**k interval."""
+        sparse = [np.arange(len(depth), dtype=np.int64)]
+        width = 1
+        while 2 * width <= len(depth):
+            prev = sparse[-1]
+            left, right = prev[:-width], prev[width:]
+            sparse.append(np.where(depth[left] <= depth[right], left, right))
+            width *= 2
+        return sparse
+
+    def __len__(self) -> int:
+        """Number of nodes in the index."""
+        return len(self.ids)
+
+    def __contains__(self, key: Key) -> bool:
+        """Whether the id, name or acronym is in the index."""
+        return self._normalize(key) in self._keys
+
+    @staticmethod
+    def _normalize(key: Key) -> Key:
+        return key.lower() if isinstance(key, str) else int(key)
+
+    def position(self, key: Key) -> int:
+        """Return the pre-order position of a node by id, name or acronym."""
+        try:
+            return self._keys[self._normalize(key)]
+        except KeyError:
+            raise KeyError(f"Structure {key} not found in ontology") from None
+
+    def id(self, key: Key) -> int:
+        """Return the structure id of a node by id, name or acronym."""
+        return int(self.ids[self.position(key)])
+
+    def is_ancestor(self, ancestor: Key, node: Key) -> bool:
+        """Whether ``node`` is inside ``ancestor`` (a node is its own ancestor)."""
+        pos_a, pos_n = self.position(ancestor), self.position(node)
+        return bool(pos_a <= pos_n <= self.stop[pos_a])
+
+    def descendants(self, key: Key, include_self: bool = False) -> np.ndarray:
+        """Return the ids of all structures below a node in pre-order."""
+        pos = self.position(key)
+        return self.ids[pos if include_self else pos + 1 : self.stop[pos] + 1]
+
+    def num_descendants(self, key: Key) -> int:
+        """Return the number of structures below a node."""
+        pos = self.position(key)
+        return int(self.stop[pos] - pos)
+
+    def ancestors(self, key: Key, include_self: bool = False) -> List[int]:
+        """Return the ids from a node (or its parent) up to the root."""
+        pos = self.position(key)
+        path = []
+        if not include_self:
+            pos = self.parent[pos]
+        while pos >= 0:
+            path.append(int(self.ids[pos]))
+            pos = self.parent[pos]
+        return path
+
+    def lca(self, first: Key, second: Key) -> Optional[int]:
+        """Return the id of the lowest common ancestor, or None for separate trees."""
+        left, right = sorted((self.position(first), self.position(second)))
+        if left == right:
+            return int(self.ids[left])
+
+        # the shallowest node in (left, right] is a child of the common ancestor
+        left += 1
+        level = (right - left + 1).bit_length() - 1
+        table = self.sparse[level]
+        cand_a, cand_b = table[left], table[right - (1 << level) + 1]
+        shallowest = cand_a if self.depth[cand_a] <= self.depth[cand_b] else cand_b
+        pos = self.parent[shallowest]
+        return int(self.ids[pos]) if pos >= 0 else None
+
+    def path(self, first: Key, second: Key) -> List[int]:
+        """Return the ids on the tree path between two nodes, inclusive."""
+        common = self.lca(first, second)
+        if common is None:
+            raise ValueError(f"{first} and {second} are not in the same tree")
+
+        up = self.ancestors(first, include_self=True)
+        down = self.ancestors(second, include_self=True)
+        up = up[: up.index(common) + 1]
+        down = down[: down.index(common)]
+        return up + down[::-1]
+
+    def save(self, file_path: Union[str, Path]) -> Path:
+        """Save the index arrays to an uncompressed ``.npz`` file.
+
+        Like ``np.savez``, ``.npz`` is appended unless file_path already ends in it,
+        and the path of the written archive is returned.
+        """
+        file_path = Path(file_path)
+        if file_path.suffix != ".npz":
+            file_path = Path(f"{file_path}.npz")
+        arrays = {f"sparse_{level}": table for level, table in enumerate(self.sparse)}
+        np.savez(
+            file_path,
+            ids=self.ids,
+            parent=self.parent,
+            depth=self.depth,
+            stop=self.stop,
+            names=self.names,
+            acronyms=self.acronyms,
+            **arrays,
+        )
+        return file_path
+
+    @classmethod
+    def load(cls, file_path: Union[str, Path]) -> "OntologyIndex":
+        """Load an index saved with ``save``."""
+        with np.load(file_path, allow_pickle=False) as data:
+            num_levels = sum(name.startswith("sparse_") for name in data.files)
+            return cls(
+                ids=data["ids"],
+                parent=data["parent"],
+                depth=data["depth"],
+                stop=data["stop"],
+                names=data["names"],
+                acronyms=data["acronyms"],
+                sparse=[data[f"sparse_{level}"] for level in range(num_levels)],
+            )
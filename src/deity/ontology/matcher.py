@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""matcher.py in src/deity/ontology.
+
+Find brain region names and acronyms in filenames with an Aho-Corasick automaton
+built from the ontology table.
+"""
+
+import re
+from collections import deque
+from typing import TYPE_CHECKING
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# separators between tokens in filenames and region names
+DELIMITERS = re.compile(r"[\s_\-.,/()]+")
+
+
+def normalize_region(text: str) -> str:
+    """Lowercase text and collapse separators into single spaces."""
+    return DELIMITERS.sub(" ", str(text).lower()).strip()
+
+
+class RegionMatcher:
+    """Multi-string matcher for ontology region names and acronyms.
+
+    All terms are matched in a single pass over the normalized filename. Matches
+    must span whole tokens, so the acronym "CA" does not match inside "CA1".
+    """
+
+    def __init__(
+        self,
+        terms: Iterable[Tuple[str, int]],
+        acronyms: Optional[Dict[int, str]] = None,
+        min_length: int = 2,
+    ) -> None:
+        """Build the automaton from (term, region_id) pairs."""
+        self.acronyms = acronyms or {}
+        self.region_ids: List[int] = []
+        self.lengths: List[int] = []
+
+        # trie of goto transitions, with the pattern index ending at each state
+        self._goto: List[Dict[str, int]] = [{}]
+        self._end: List[int] = [-1]
+        for term, region_id in terms:
+            term = normalize_region(term)
+            if len(term) < min_length:
+                continue
+
+            state = 0
+            for char in term:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._end.append(-1)
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+
+            # keep the first region for duplicate terms
+            if self._end[state] < 0:
+                self._end[state] = len(self.region_ids)
+                self.region_ids.append(int(region_id))
+                self.lengths.append(len(term))
+
+        self._build_links()
+
+    def _build_links(self) -> None:
+        """Compute failure links and output links breadth first."""
+        self._fail = [0] * len(self._goto)
+        # nearest state on the failure chain that ends a pattern
+        self._output = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                self._output[child] = (
+                    fail if self._end[fail] >= 0 else self._output[fail]
+                )
+                queue.append(child)
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        df: "pd.DataFrame",
+        id_col: str = "id",
+        columns: Tuple[str, ...] = ("acronym", "name"),
+        min_length: int = 2,
+    ) -> "RegionMatcher":
+        """Build a matcher from a flattened ontology such as ``load_ontology``."""
+        terms = [
+            (term, region_id)
+            for col in columns
+            if col in df.columns
+            for term, region_id in zip(df[col], df[id_col])
+            if isinstance(term, str) and term
+        ]
+        acronyms = {}
+        if "acronym" in df.columns:
+            acronyms = {
+                int(region_id): acronym
+                for region_id, acronym in zip(df[id_col], df["acronym"])
+            }
+        return cls(terms, acronyms=acronyms, min_length=min_length)
+
+    def find_all(self, text: str) -> List[Tuple[int, int, int]]:
+        """Return [start, end) and region_id of whole-token matches in normalized text."""
+        text = f" {normalize_region(text)} "
+        matches = []
+        state = 0
+        for pos, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+
+            match = state if self._end[state] >= 0 else self._output[state]
+            while match:
+                idx = self._end[match]
+                start = pos + 1 - self.lengths[idx]
+                if text[start - 1] == " " and text[pos + 1] == " ":
+                    matches.append((start - 1, pos, self.region_ids[idx]))
+                match = self._output[match]
+
+        return matches
+
+    def find(self, text: str) -> List[int]:
+        """Return region ids of the leftmost-longest, non-overlapping matches."""
+        region_ids = []
+        last_end = -1
+        for start, end, region_id in sorted(
+            self.find_all(text), key=lambda x: (x[0], x[0] - x[1])
+        ):
+            if start >= last_end:
+                region_ids.append(region_id)
+                last_end = end
+        return region_ids
+
+    def match(self, text: str) -> Optional[int]:
+        """Return the region id of the first match, or None."""
+        region_ids = self.find(text)
+        return region_ids[0] if region_ids else None
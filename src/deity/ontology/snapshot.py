@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""snapshot.py in src/deity/ontology.
+
+Cache the flattened ontology table as memory-mappable NumPy arrays, keyed on the md5
+of the source file, so later loads skip parsing the CSV or JSON.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import ujson as json
+from loguru import logger
+
+from deity.encode import hash_file
+from deity.ontology.allen_brain import ontology_file_to_dataframe
+from deity.utils import get_cache_dir
+
+
+ALLEN_BRAIN_CSV = (
+    Path(__file__).resolve().parents[3].joinpath("allen_brain_ontology.csv")
+)
+MANIFEST = "columns.json"
+
+
+def write_snapshot(df: pd.DataFrame, snapshot_dir: Union[str, Path]) -> Path:
+    """Write each column of df to a ``.npy`` file in snapshot_dir.
+
+    Numeric and boolean columns are saved with their dtype. Text columns are saved as
+    integer codes plus a fixed-width string table of the unique values.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.parent.mkdir(parents=True, exist_ok=True)
+
+    # write to a temporary directory and rename, so readers never see partial files
+    tmp_dir = Path(tempfile.mkdtemp(dir=snapshot_dir.parent))
+    columns = []
+    for idx, (name, series) in enumerate(df.items()):
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            kind = "values"
+            np.save(tmp_dir.joinpath(f"{idx}.npy"), series.to_numpy())
+        else:
+            try:
+                codes, uniques = pd.factorize(series)
+                kind = "strings"
+            except TypeError:
+                # nested values (lists or dicts) are stored as JSON text
+                codes, uniques = pd.factorize(series.map(json.dumps))
+                kind = "json"
+            np.save(tmp_dir.joinpath(f"{idx}.npy"), codes.astype(np.int32))
+            np.save(tmp_dir.joinpath(f"{idx}_table.npy"), np.asarray(uniques, str))
+        columns.append({"name": str(name), "kind": kind})
+
+    tmp_dir.joinpath(MANIFEST).write_text(json.dumps({"columns": columns}))
+    try:
+        os.replace(tmp_dir, snapshot_dir)
+    except OSError:
+        # another process wrote the snapshot first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return snapshot_dir
+
+
+def read_snapshot(
+    snapshot_dir: Union[str, Path], mmap: bool = True, categorical: bool = False
+) -> pd.DataFrame:
+    """Read a snapshot written by ``write_snapshot``.
+
+    :param snapshot_dir: Directory containing the snapshot.
+    :param mmap: If True, numeric columns are memory-mapped instead of read.
+    :param categorical: If True, text columns are returned as pandas Categoricals.
+    :return: The ontology table.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    manifest = json.loads(snapshot_dir.joinpath(MANIFEST).read_text())
+    mmap_mode = "r" if mmap else None
+
+    data = {}
+    for idx, column in enumerate(manifest["columns"]):
+        values = np.load(snapshot_dir.joinpath(f"{idx}.npy"), mmap_mode=mmap_mode)
+        if column["kind"] == "values":
+            data[column["name"]] = values
+            continue
+
+        table = np.load(snapshot_dir.joinpath(f"{idx}_table.npy"))
+        if column["kind"] == "json":
+            table = np.asarray([json.loads(elem) for elem in table], dtype=object)
+
+        if categorical and column["kind"] == "strings":
+            data[column["name"]] = pd.Categorical.from_codes(values, table)
+        else:
+            # code -1 marks missing values
+            strings = np.append(table.astype(object), None)
+            data[column["name"]] = strings[values]
+
+    return pd.DataFrame(data)
+
+
+def load_ontology(
+    source: Optional[Union[str, Path]] = None,
+    cache_dir: Optional[Union[str, Path]] = None,
+    mmap: bool = True,
+    categorical: bool = False,
+) -> pd.DataFrame:
+    """Load a flattened ontology, converting it to a binary snapshot on first use.
+
+    :param source: Ontology CSV or nested JSON file. Defaults to the Allen Brain
+        ontology CSV at the root of the repository.
+    :param cache_dir: Directory for snapshots. Defaults to the deity cache directory.
+    :param mmap: If True, numeric columns are memory-mapped.
+    :param categorical: If True, text columns are returned as pandas Categoricals.
+    :return: The ontology table.
+    """
+    source = Path(source) if source is not None else ALLEN_BRAIN_CSV
+    if not source.exists():
+        logger.error(f"Ontology file {source} does not exist.")
+        raise FileNotFoundError(f"Ontology file {source} does not exist.")
+
+    cache_dir = Path(cache_dir) if cache_dir is not None else get_cache_dir("ontology")
+    snapshot_dir = cache_dir.joinpath(f"{source.stem}-{hash_file(source)}")
+
+    if not snapshot_dir.joinpath(MANIFEST).exists():
+        logger.info(f"Creating ontology snapshot {snapshot_dir}")
+        if source.suffix == ".csv":
+            df = pd.read_csv(source)
+        elif source.suffix == ".json":
+            df = ontology_file_to_dataframe(source)
+        else:
+            raise ValueError(
+                f"Ontology file must be a .csv or .json file, but received {source.suffix}"
+            )
+        write_snapshot(df, snapshot_dir)
+
+    return read_snapshot(snapshot_dir, mmap=mmap, categorical=categorical)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""pipeline.py in src/deity.
+
+Encode a directory as a pipeline of concurrent stages connected by bounded queues:
+walking directories, encoding batches of filenames, writing batches to SQLite and
+renaming files. The stages overlap, so a run takes about as long as its slowest
+stage, and the bounded queues keep a fast stage from running far ahead.
+"""
+
+import asyncio
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import Executor
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import pandas as pd
+from loguru import logger
+
+from deity import progress
+from deity.database.normalize import is_normalized
+from deity.encode import encode_batch
+from deity.ontology.matcher import RegionMatcher
+from deity.profiling import count
+from deity.profiling import timer
+from deity.utils import create_df_sql
+from deity.utils import rename_batch
+from deity.utils import scan_dir
+
+
+def encode_chunk(
+    filepaths: List[str],
+    pattern: Optional[str] = None,
+    output_dir: Optional[Path] = None,
+    region_matcher: Optional[RegionMatcher] = None,
+) -> pd.DataFrame:
+    """Encode a batch of files, returning the same columns as ``encode_all``."""
+    old_filepaths = [Path(filepath).resolve() for filepath in filepaths]
+    df = encode_batch([filepath.name for filepath in old_filepaths], pattern=pattern)
+    # files without an identifier stay where they are
+    if output_dir is not None and Path(output_dir).exists():
+        parents = [
+            filepath.parent if pd.isnull(identifier) else Path(output_dir)
+            for filepath, identifier in zip(old_filepaths, df["identifier"])
+        ]
+    else:
+        parents = [filepath.parent for filepath in old_filepaths]
+
+    df = pd.DataFrame(
+        {
+            "identifier": df["identifier"],
+            "short_hash": df["short_hash"].map(str),
+            "full_hash": df["full_hash"].map(str),
+            "old_filepath": old_filepaths,
+            "new_filepath": [
+                str(parent.joinpath(name))
+                for parent, name in zip(parents, df["new_filename"])
+            ],
+        }
+    )
+    if region_matcher is not None:
+        region_ids = [region_matcher.match(path.name) for path in old_filepaths]
+        df["region_id"] = pd.array(region_ids, dtype="Int64")
+        df["region"] = [region_matcher.acronyms.get(elem) for elem in region_ids]
+    return df
+
+
+class Pipeline:
+    """Walk, encode, insert and rename stages connected by bounded queues.
+
+    CPU and file system work runs in ``executor``; the event loop only moves batches
+    between stages. All database writes run in one thread, in batch order.
+    """
+
+    def __init__(
+        self,
+        input_dir: Path,
+        database_file: Path,
+        table_name: str = "specimens",
+        extension: str = "txt,jpg,png",
+        pattern: Optional[str] = None,
+        output_dir: Optional[Path] = None,
+        region_matcher: Optional[RegionMatcher] = None,
+        batch_size: int = 1000,
+        queue_size: int = 4,
+        encode_workers: int = 2,
+        rename_workers: int = 4,
+        dry_run: bool = False,
+    ) -> None:
+        self.input_dir = Path(input_dir)
+        self.database_file = Path(database_file)
+        self.table_name = table_name
+        self.extensions = tuple(
+            f".{ext.strip().lstrip('.')}" for ext in extension.split(",")
+        )
+        self.pattern = pattern
+        self.output_dir = output_dir
+        self.region_matcher = region_matcher
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.encode_workers = encode_workers
+        self.rename_workers = rename_workers
+        self.dry_run = dry_run
+        self.stats = {"files": 0, "rows": 0, "renamed": 0, "errors": 0}
+
+        # renamed files are not walked again if output_dir is below input_dir
+        self.excluded = os.path.realpath(output_dir) if output_dir else None
+        # filepaths and old_filepaths of the rows of an existing database
+        self.recorded: Set[str] = set()
+        self.unrenamed: Set[str] = set()
+        self.next_id = 0
+        self.csv_started = False
+
+    def resume(self) -> None:
+        """Load the rows of an existing database, to continue an interrupted run."""
+        conn = sqlite3.connect(self.database_file)
+        try:
+            if is_normalized(conn, self.table_name):
+                raise ValueError(f"Cannot resume normalized {self.database_file}")
+            for old_filepath, filepath in conn.execute(
+                f"SELECT old_filepath, filepath FROM {self.table_name}"  # noqa: S608
+            ):
+                self.recorded.add(filepath)
+                self.unrenamed.add(old_filepath)
+            self.next_id = conn.execute(
+                f"SELECT COALESCE(MAX(id) + 1, 0) FROM {self.table_name}"  # noqa: S608
+            ).fetchone()[0]
+        finally:
+            conn.close()
+        self.csv_started = self.csv_file.exists()
+        logger.info(f"Resuming {self.database_file} with {self.next_id} row(s)")
+
+    @property
+    def csv_file(self) -> Path:
+        return self.database_file.with_name(
+            f"{self.database_file.name}_{self.table_name}.csv"
+        )
+
+    async def walk(self, executor: Executor, out: asyncio.Queue) -> None:
+        """Scan directories breadth first and emit batches of matching files.
+
+        output_dir is not scanned, as files are renamed into it during the walk.
+        """
+        loop = asyncio.get_running_loop()
+        pending = deque([str(self.input_dir)])
+        batch: List[str] = []
+        with progress.track("walk") as tracker:
+            while pending:
+                files, subdirs = await loop.run_in_executor(
+                    executor, scan_dir, pending.popleft(), self.extensions
+                )
+                pending.extend(
+                    subdir
+                    for subdir in subdirs
+                    if os.path.realpath(subdir) != self.excluded
+                )
+                batch.extend(files)
+                tracker.update(len(files))
+                while len(batch) >= self.batch_size:
+                    await out.put(batch[: self.batch_size])
+                    batch = batch[self.batch_size :]
+            if batch:
+                await out.put(batch)
+        self.stats["files"] = tracker.done
+
+        for _ in range(self.encode_workers):
+            await out.put(None)
+
+    async def encode(
+        self, executor: Executor, inp: asyncio.Queue, out: asyncio.Queue
+    ) -> None:
+        """Encode batches of files in the executor."""
+        loop = asyncio.get_running_loop()
+        while (batch := await inp.get()) is not None:
+            df = await loop.run_in_executor(
+                executor,
+                encode_chunk,
+                batch,
+                self.pattern,
+                self.output_dir,
+                self.region_matcher,
+            )
+            await out.put(df)
+        await out.put(None)
+
+    def insert(self, conn: sqlite3.Connection, df: pd.DataFrame, first: bool) -> None:
+        """Append a batch to the table and the CSV export."""
+        df_sql = create_df_sql(df, self.table_name)[1]
+        df_sql.to_sql(self.table_name, conn, if_exists="append", index_label="id")
+        conn.commit()
+        df_sql.to_csv(
+            self.csv_file, mode="w" if first else "a", header=first, index=False
+        )
+
+    async def write(
+        self, db_executor: Executor, inp: asyncio.Queue, out: asyncio.Queue
+    ) -> None:
+        """Insert encoded batches in one thread, then pass them on for renaming."""
+        loop = asyncio.get_running_loop()
+        conn = None
+        if not self.dry_run:
+            conn = await loop.run_in_executor(
+                db_executor,
+                lambda: sqlite3.connect(self.database_file, check_same_thread=False),
+            )
+
+        finished = 0
+        with progress.track("database") as tracker:
+            while finished < self.encode_workers:
+                df = await inp.get()
+                if df is None:
+                    finished += 1
+                    continue
+
+                df, df_new = self.split_recorded(df)
+                if conn is not None and len(df_new) > 0:
+                    await loop.run_in_executor(
+                        db_executor, self.insert, conn, df_new, not self.csv_started
+                    )
+                    self.csv_started = True
+                tracker.update(len(df_new))
+                await out.put(list(zip(df["old_filepath"], df["new_filepath"])))
+        self.stats["rows"] = tracker.done
+
+        if conn is not None:
+            await loop.run_in_executor(db_executor, self.finish, conn)
+        for _ in range(self.rename_workers):
+            await out.put(None)
+
+    def split_recorded(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Drop the files renamed by a previous run and number the new rows.
+
+        :return: The files to rename, and those of them not in the database yet.
+        """
+        if self.recorded:
+            old_filepaths = df["old_filepath"].map(str)
+            df = df[~old_filepaths.isin(self.recorded)]
+            # rows inserted by a previous run are renamed without inserting them
+            df_new = df[~old_filepaths[df.index].isin(self.unrenamed)].copy()
+        else:
+            df_new = df.copy()
+        # number rows consecutively across batches
+        df_new.index = pd.RangeIndex(self.next_id, self.next_id + len(df_new))
+        self.next_id += len(df_new)
+        return df, df_new
+
+    def finish(self, conn: sqlite3.Connection) -> None:
+        """Index region ids and close the database."""
+        try:
+            columns = [
+                row[1] for row in conn.execute(f"PRAGMA table_info({self.table_name})")
+            ]
+            if "region_id" in columns:
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS ix_{self.table_name}_region_id "
+                    f"ON {self.table_name} (region_id)"
+                )
+                conn.commit()
+        finally:
+            conn.close()
+
+    async def rename(
+        self, executor: Executor, inp: asyncio.Queue, tracker: progress.Progress
+    ) -> None:
+        """Rename batches of files in the executor."""
+        loop = asyncio.get_running_loop()
+        while (pairs := await inp.get()) is not None:
+            errors = 0
+            if not self.dry_run:
+                errors = await loop.run_in_executor(executor, rename_batch, pairs)
+            self.stats["renamed"] += len(pairs) - errors
+            self.stats["errors"] += errors
+            tracker.update(len(pairs) - errors, errors=errors)
+
+    async def run(self) -> dict:
+        """Run all stages to completion and return file, row and rename counts."""
+        files: asyncio.Queue = asyncio.Queue(self.queue_size)
+        encoded: asyncio.Queue = asyncio.Queue(self.queue_size)
+        written: asyncio.Queue = asyncio.Queue(self.queue_size)
+
+        num_threads = 1 + self.encode_workers + self.rename_workers
+        with (
+            ThreadPoolExecutor(num_threads) as executor,
+            ThreadPoolExecutor(1) as db_executor,
+            progress.track("rename") as rename_tracker,
+        ):
+            await asyncio.gather(
+                self.walk(executor, files),
+                *(
+                    self.encode(executor, files, encoded)
+                    for _ in range(self.encode_workers)
+                ),
+                self.write(db_executor, encoded, written),
+                *(
+                    self.rename(executor, written, rename_tracker)
+                    for _ in range(self.rename_workers)
+                ),
+            )
+
+        for name, value in self.stats.items():
+            count(f"pipeline.{name}", value)
+        return self.stats
+
+
+def run_pipeline(
+    input_dir: Path, database_file: Path, table_name: str = "specimens", **kwargs
+) -> dict:
+    """Encode input_dir with a ``Pipeline``, see its arguments.
+
+    An existing database is resumed, so an interrupted run is completed by running
+    it again: files recorded in the database are renamed if they have not been,
+    and only the other files are encoded and inserted.
+
+    :return: The number of files found, rows written, files renamed and errors.
+    """
+    pipeline = Pipeline(input_dir, database_file, table_name, **kwargs)
+    if Path(database_file).exists():
+        pipeline.resume()
+    with timer("pipeline"):
+        stats = asyncio.run(pipeline.run())
+
+    logger.info(
+        f"Encoded {stats['rows']} of {stats['files']} files, renamed "
+        f"{stats['renamed']} ({stats['errors']} errors)"
+    )
+    if stats["files"] == 0:
+        raise FileNotFoundError(
+            f"No {kwargs.get('extension')} files found in {input_dir}"
+        )
+    return stats
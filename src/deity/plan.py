@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""plan.py in src/deity.
+
+Write the renames and database rows computed by an encode run to a SQLite plan file,
+and apply the plan later. Plans are split into chunks that can be applied
+independently, e.g. by several machines sharing the same storage.
+"""
+
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import pandas as pd
+from loguru import logger
+
+from deity import database
+from deity import progress
+from deity.core import create_table
+from deity.database.normalize import is_normalized
+from deity.profiling import count
+from deity.profiling import timer
+from deity.scheduler import io_map
+
+
+PLAN_VERSION = 2
+
+
+def check_database(
+    database_file: Union[str, Path],
+    table_name: str,
+    plan_file: Optional[Union[str, Path]] = None,
+) -> None:
+    """Raise FileExistsError if table_name already has rows, other than plan_file's.
+
+    Plans number their rows from 0, as a new database does, so they are only applied
+    to a new table or to one holding their own rows.
+    """
+    if not Path(database_file).exists():
+        return
+
+    conn = database.create_connection(database_file)
+    try:
+        if not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (table_name,)
+        ).fetchone():
+            return
+        query = f"SELECT COUNT(*) FROM {table_name} AS t"  # noqa: S608
+        if plan_file is not None:
+            conn.execute("ATTACH DATABASE ? AS plan", (str(plan_file),))
+            query += (
+                " WHERE NOT EXISTS (SELECT 1 FROM plan.records AS r "
+                "WHERE r.id = t.id AND r.old_filepath = t.old_filepath)"
+            )
+        num_rows = conn.execute(query).fetchone()[0]
+    finally:
+        conn.close()
+
+    if num_rows:
+        raise FileExistsError(
+            f"Table {table_name} of {database_file} already has {num_rows} row(s); "
+            "plans are only applied to a new database"
+        )
+
+
+def write_plan(
+    plan_file: Union[str, Path],
+    df_file_rename: pd.DataFrame,
+    df_sql: pd.DataFrame,
+    table_name: str,
+    database_file: Union[str, Path],
+    chunk_size: int = 10_000,
+) -> Path:
+    """Save the output of ``create_df_sql`` as a plan.
+
+    :param plan_file: SQLite file to write. An existing file is replaced.
+    :param df_file_rename: Renames with old_filepath and new_filepath columns.
+    :param df_sql: Rows to insert into the database, aligned with df_file_rename.
+    :param table_name: Database table the rows are inserted into.
+    :param database_file: Database the plan is applied to.
+    :param chunk_size: Number of files per chunk.
+    :return: The plan file.
+    """
+    chunks = (
+        (
+            df_file_rename.iloc[start : start + chunk_size],
+            df_sql.iloc[start : start + chunk_size],
+        )
+        for start in range(0, len(df_sql), chunk_size)
+    )
+    return write_plan_chunks(
+        plan_file, chunks, len(df_sql), table_name, database_file, chunk_size
+    )
+
+
+def write_plan_chunks(
+    plan_file: Union[str, Path],
+    chunks: Iterable[Tuple[pd.DataFrame, pd.DataFrame]],
+    num_files: int,
+    table_name: str,
+    database_file: Union[str, Path],
+    chunk_size: int = 10_000,
+) -> Path:
+    """Save a plan from the ``create_df_sql`` output of each chunk, see ``write_plan``.
+
+    Chunks are written as they are consumed, so a generator keeps only one in memory.
+
+    :param chunks: (df_file_rename, df_sql) of chunk_size files each, but the last.
+    :param num_files: Number of files in all chunks.
+    """
+    check_database(database_file, table_name)
+    plan_file = Path(plan_file)
+    plan_file.parent.mkdir(parents=True, exist_ok=True)
+    plan_file.unlink(missing_ok=True)
+
+    num_chunks = (num_files + chunk_size - 1) // chunk_size
+    meta = {
+        "version": PLAN_VERSION,
+        "table_name": table_name,
+        "database_file": str(Path(database_file).resolve()),
+        "chunk_size": chunk_size,
+        "num_chunks": num_chunks,
+        "num_files": num_files,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    conn = sqlite3.connect(plan_file)
+    try:
+        pd.DataFrame(
+            {"key": list(meta), "value": [str(v) for v in meta.values()]}
+        ).to_sql("meta", conn, index=False)
+        for chunk, (df_file_rename, df_sql) in enumerate(chunks):
+            renames = df_file_rename[["old_filepath", "new_filepath"]].astype(str)
+            renames.insert(0, "chunk", chunk)
+            renames.to_sql("renames", conn, index=False, if_exists="append")
+            df_sql.assign(chunk=chunk).to_sql(
+                "records", conn, index_label="id", if_exists="append"
+            )
+        conn.executescript("""
+            CREATE INDEX ix_renames_chunk ON renames (chunk);
+            CREATE INDEX ix_records_chunk ON records (chunk);
+            CREATE TABLE applied (
+                chunk INTEGER PRIMARY KEY, host TEXT, claimed REAL, finished TEXT
+            );
+            """)
+        conn.commit()
+    finally:
+        conn.close()
+
+    logger.info(
+        f"Plan for {num_files} files in {num_chunks} chunk(s) saved to {plan_file}"
+    )
+    return plan_file
+
+
+def read_plan_meta(plan_file: Union[str, Path]) -> dict:
+    """Return the plan metadata, with integer values converted."""
+    conn = sqlite3.connect(plan_file)
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        applied = [
+            row[0]
+            for row in conn.execute(
+                "SELECT chunk FROM applied WHERE finished IS NOT NULL"
+            )
+        ]
+    finally:
+        conn.close()
+
+    for key in ("version", "chunk_size", "num_chunks", "num_files"):
+        meta[key] = int(meta[key])
+    meta["applied"] = sorted(applied)
+    return meta
+
+
+def _rename(paths: tuple) -> bool:
+    old_filepath, new_filepath = paths
+    try:
+        os.rename(old_filepath, new_filepath)
+    except FileNotFoundError as e:
+        # renamed by an earlier attempt at the chunk
+        if os.path.lexists(new_filepath) and not os.path.lexists(old_filepath):
+            return True
+        logger.error(f"Failed to rename {old_filepath}: {e}")
+        return False
+    except OSError as e:
+        logger.error(f"Failed to rename {old_filepath}: {e}")
+        return False
+    return True
+
+
+def claim_chunk(plan_conn: sqlite3.Connection, chunk: int, lease: float) -> bool:
+    """Claim a chunk for this host, unless it is applied or claimed by another run.
+
+    :param lease: Seconds after which an unfinished claim, e.g. of a run that
+        crashed, may be taken over.
+    :return: True if the chunk was claimed.
+    """
+    now = time.time()
+    plan_conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = plan_conn.execute(
+            "SELECT finished, claimed FROM applied WHERE chunk = ?", (chunk,)
+        ).fetchone()
+        if row is not None and (row[0] is not None or now - row[1] < lease):
+            plan_conn.rollback()
+            return False
+        plan_conn.execute(
+            "INSERT OR REPLACE INTO applied (chunk, host, claimed) VALUES (?, ?, ?)",
+            (chunk, socket.gethostname(), now),
+        )
+        plan_conn.commit()
+    except BaseException:
+        plan_conn.rollback()
+        raise
+    return True
+
+
+def release_chunk(plan_conn: sqlite3.Connection, chunk: int) -> None:
+    """Remove the claim of an unfinished chunk, so it can be applied again."""
+    with plan_conn:
+        plan_conn.execute(
+            "DELETE FROM applied WHERE chunk = ? AND finished IS NULL", (chunk,)
+        )
+
+
+def record_chunk(
+    plan_file: Path, chunk: int, table_name: str, database_file: Path
+) -> None:
+    """Insert the rows of a chunk and mark it applied in one transaction.
+
+    Rows inserted by an earlier attempt at the chunk are skipped. If an id of the
+    chunk is taken by another file, nothing is inserted and ValueError is raised, as
+    the renamed file would have no row.
+    """
+    conn = database.create_connection(database_file, timeout=60)
+    try:
+        conn.execute("ATTACH DATABASE ? AS plan", (str(plan_file),))
+        columns = [
+            row[1]
+            for row in conn.execute("PRAGMA plan.table_info(records)")
+            if row[1] not in ("id", "chunk")
+        ]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not is_normalized(conn, table_name):
+                create_table(conn, table_name, columns)
+                if "region_id" in columns:
+                    conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table_name}_region_id "
+                        f"ON {table_name} (region_id)"
+                    )
+            conn.execute(
+                f"INSERT INTO {table_name} (id, {', '.join(columns)}) "  # noqa: S608
+                f"SELECT id, {', '.join(columns)} FROM plan.records AS r "
+                f"WHERE chunk = ? AND NOT EXISTS "
+                f"(SELECT 1 FROM {table_name} WHERE id = r.id) ORDER BY id",
+                (chunk,),
+            )
+            _check_recorded(conn, chunk, table_name)
+            conn.execute(
+                "UPDATE plan.applied SET host = ?, finished = ? WHERE chunk = ?",
+                (socket.gethostname(), time.strftime("%Y-%m-%dT%H:%M:%S"), chunk),
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+
+
+def _check_recorded(conn: sqlite3.Connection, chunk: int, table_name: str) -> None:
+    """Raise ValueError unless every row of the chunk is in the table."""
+    missing = conn.execute(
+        f"SELECT COUNT(*) FROM plan.records AS r "  # noqa: S608
+        f"WHERE chunk = ? AND NOT EXISTS (SELECT 1 FROM {table_name} AS t "
+        f"WHERE t.id = r.id AND t.old_filepath = r.old_filepath)",
+        (chunk,),
+    ).fetchone()[0]
+    if missing:
+        raise ValueError(
+            f"{missing} row(s) of chunk {chunk} have ids taken by other files "
+            f"in {table_name}"
+        )
+
+
+def apply_chunk(
+    plan_file: Path,
+    plan_conn: sqlite3.Connection,
+    chunk: int,
+    table_name: str,
+    database_file: Path,
+    workers: int = 1,
+) -> int:
+    """Rename the files of one chunk, then record its rows if all were renamed.
+
+    The plan keeps the mapping of renamed files until they are recorded, and files
+    renamed by an earlier attempt count as renamed, so a failed chunk can be retried.
+
+    :return: The number of files that could not be renamed.
+    """
+    renames = plan_conn.execute(
+        "SELECT old_filepath, new_filepath FROM renames WHERE chunk = ?", (chunk,)
+    ).fetchall()
+
+    with timer("apply.rename"), progress.track("rename", total=len(renames)) as tracker:
+        results = list(io_map(_rename, renames, max_workers=workers, chunk_size=64))
+        errors = results.count(False)
+        tracker.update(len(renames) - errors, errors=errors)
+    count("apply.renamed", len(renames) - errors)
+    count("apply.errors", errors)
+
+    if not errors:
+        with timer("apply.insert"):
+            record_chunk(plan_file, chunk, table_name, database_file)
+    return errors
+
+
+def apply_plan(
+    plan_file: Union[str, Path],
+    chunks: Optional[Iterable[int]] = None,
+    database_file: Optional[Union[str, Path]] = None,
+    workers: int = 1,
+    lease: float = 3600.0,
+) -> List[int]:
+    """Apply the chunks of a plan that have not been applied yet.
+
+    Each chunk is claimed before it is applied, so several hosts can apply the same
+    plan: a chunk claimed by another run is skipped.
+
+    :param plan_file: Plan written by ``write_plan``.
+    :param chunks: Chunks to apply. Defaults to all chunks.
+    :param database_file: Database to insert into. Defaults to the plan's database.
+    :param workers: Maximum number of threads renaming files.
+    :param lease: Seconds after which the claim of an unfinished chunk expires.
+    :return: The chunks that were applied.
+    """
+    plan_file = Path(plan_file)
+    meta = read_plan_meta(plan_file)
+    if meta["version"] != PLAN_VERSION:
+        raise ValueError(
+            f"Expected plan version {PLAN_VERSION}, but received {meta['version']}"
+        )
+
+    all_chunks = list(range(meta["num_chunks"]))
+    chunks = all_chunks if chunks is None else sorted(set(chunks))
+    invalid = set(chunks) - set(all_chunks)
+    if invalid:
+        raise ValueError(f"Plan has chunks 0-{meta['num_chunks'] - 1}, not {invalid}")
+
+    database_file = Path(database_file or meta["database_file"])
+    check_database(database_file, meta["table_name"], plan_file)
+    pending = [chunk for chunk in chunks if chunk not in meta["applied"]]
+    logger.info(
+        f"Applying {len(pending)} of {meta['num_chunks']} chunk(s) to {database_file}"
+    )
+
+    applied = []
+    conn = sqlite3.connect(plan_file, timeout=60)
+    try:
+        for chunk in pending:
+            if not claim_chunk(conn, chunk, lease):
+                logger.info(f"Skipping chunk {chunk}, claimed by another run")
+                continue
+            try:
+                errors = apply_chunk(
+                    plan_file,
+                    conn,
+                    chunk,
+                    meta["table_name"],
+                    database_file,
+                    workers=workers,
+                )
+            finally:
+                release_chunk(conn, chunk)
+            if errors:
+                raise OSError(f"{errors} file(s) in chunk {chunk} could not be renamed")
+            applied.append(chunk)
+
+        # export the CSV once every chunk has been applied, as a direct run does
+        num_applied = conn.execute(
+            "SELECT COUNT(*) FROM applied WHERE finished IS NOT NULL"
+        ).fetchone()[0]
+        if applied and num_applied == meta["num_chunks"]:
+            csv_filename = database_file.with_name(
+                f"{database_file.name}_{meta['table_name']}.csv"
+            )
+            frames = pd.read_sql(
+                "SELECT * FROM records ORDER BY id", conn, chunksize=meta["chunk_size"]
+            )
+            for idx, df in enumerate(frames):
+                df.drop(columns=["id", "chunk"]).to_csv(
+                    csv_filename, mode="a" if idx else "w", header=not idx, index=False
+                )
+    finally:
+        conn.close()
+
+    return applied
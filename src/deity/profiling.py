@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""profiling.py in src/deity.
+
+Lightweight per-stage timers and counters. Instrumentation is disabled by default,
+in which case ``timer`` returns a shared no-op context manager and ``count`` returns
+immediately, so instrumented hot paths cost next to nothing.
+"""
+import cProfile
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict
+from typing import Optional
+from typing import Union
+
+import ujson as json
+from loguru import logger
+
+
+_ENABLED = False
+_NULL_TIMER = nullcontext()
+_TIMERS: Dict[str, list] = defaultdict(lambda: [0.0, 0])
+_COUNTERS: Dict[str, int] = defaultdict(int)
+
+
+class _Timer:
+    """Context manager that adds the elapsed time to a named timer."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        stats = _TIMERS[self.name]
+        stats[0] += time.perf_counter() - self.start
+        stats[1] += 1
+
+
+def enable() -> None:
+    """Enable timers and counters."""
+    global _ENABLED
+    _ENABLED = True
+
+
+def disable() -> None:
+    """Disable timers and counters."""
+    global _ENABLED
+    _ENABLED = False
+
+
+def is_enabled() -> bool:
+    """Whether timers and counters are enabled."""
+    return _ENABLED
+
+
+def reset() -> None:
+    """Clear all timers and counters."""
+    _TIMERS.clear()
+    _COUNTERS.clear()
+
+
+def timer(name: str) -> Union[_Timer, nullcontext]:
+    """Return a context manager that times a stage, e.g. ``with timer("walk"):``."""
+    return _Timer(name) if _ENABLED else _NULL_TIMER
+
+
+def count(name: str, num: int = 1) -> None:
+    """Add num to a named counter."""
+    if _ENABLED:
+        _COUNTERS[name] += num
+
+
+def summary() -> dict:
+    """Return the timers and counters as a JSON serializable dictionary."""
+    return {
+        "timers": {
+            name: {"seconds": round(seconds, 6), "calls": calls}
+            for name, (seconds, calls) in _TIMERS.items()
+        },
+        "counters": dict(_COUNTERS),
+    }
+
+
+def log_summary(json_file: Optional[Union[str, Path]] = None) -> dict:
+    """Log the timers and counters, and optionally save them as JSON."""
+    stats = summary()
+    for name, elem in stats["timers"].items():
+        logger.info(f"{name}: {elem['seconds']:.3f} s ({elem['calls']} calls)")
+    for name, value in stats["counters"].items():
+        logger.info(f"{name}: {value}")
+
+    if json_file is not None:
+        Path(json_file).write_text(json.dumps(stats, indent=2))
+        logger.info(f"Timings saved to {json_file}")
+
+    return stats
+
+
+def start_profile() -> cProfile.Profile:
+    """Reset and enable the timers, and start the cProfile profiler."""
+    reset()
+    enable()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler: cProfile.Profile, output_prefix: Union[str, Path]) -> dict:
+    """Stop profiling and save ``<prefix>.prof`` (pstats) and ``<prefix>.json``."""
+    profiler.disable()
+    disable()
+
+    output_prefix = Path(output_prefix)
+    output_prefix.parent.mkdir(parents=True, exist_ok=True)
+    prof_file = output_prefix.with_name(f"{output_prefix.name}.prof")
+    profiler.dump_stats(prof_file)
+    logger.info(f"Profile saved to {prof_file}")
+
+    return log_summary(output_prefix.with_name(f"{output_prefix.name}.json"))
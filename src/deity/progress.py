@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""progress.py in src/deity.
+
+Structured progress events for unattended runs. Each stage reports the number of
+files (and optionally bytes) processed, from which throughput and ETA are derived.
+Events are written as JSON lines or as a Prometheus textfile, at most once per
+interval per stage, so updating progress never costs more than a few additions.
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import Dict
+from typing import Optional
+from typing import Union
+
+import ujson as json
+
+
+_SINK = None
+_INTERVAL = 5.0
+
+
+class JsonLinesSink:
+    """Append each event as one JSON object per line."""
+
+    def __init__(self, file_path: Union[str, Path]) -> None:
+        self.file_path = Path(file_path)
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def __call__(self, event: dict) -> None:
+        with open(self.file_path, "a") as f:
+            f.write(json.dumps(event) + "\n")
+
+
+class PrometheusSink:
+    """Rewrite a Prometheus textfile with the latest metrics of every stage."""
+
+    METRICS = [
+        ("deity_files_total", "counter", "Files processed", "done"),
+        ("deity_bytes_total", "counter", "Bytes processed", "bytes"),
+        ("deity_errors_total", "counter", "Errors", "errors"),
+        ("deity_files_expected", "gauge", "Files expected", "total"),
+        ("deity_files_per_second", "gauge", "Files per second", "files_per_s"),
+        ("deity_megabytes_per_second", "gauge", "Megabytes per second", "mb_per_s"),
+        ("deity_eta_seconds", "gauge", "Estimated seconds remaining", "eta_s"),
+    ]
+
+    def __init__(self, file_path: Union[str, Path]) -> None:
+        self.file_path = Path(file_path)
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.stages: Dict[str, dict] = {}
+
+    def __call__(self, event: dict) -> None:
+        self.stages[event["stage"]] = event
+        lines = []
+        for name, kind, description, key in self.METRICS:
+            lines.append(f"# HELP {name} {description} by deity stage.")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(
+                f'{name}{{stage="{stage}"}} {elem[key]}'
+                for stage, elem in self.stages.items()
+                if elem.get(key) is not None
+            )
+
+        # write atomically so the collector never reads a partial file
+        tmp_file = self.file_path.with_name(f".{self.file_path.name}.tmp")
+        tmp_file.write_text("\n".join(lines) + "\n")
+        os.replace(tmp_file, self.file_path)
+
+
+class Progress:
+    """Progress of one stage; call ``update`` per item and ``close`` at the end."""
+
+    __slots__ = ("stage", "total", "done", "bytes", "errors", "start", "next_emit")
+
+    def __init__(self, stage: str, total: Optional[int] = None) -> None:
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.bytes = 0
+        self.errors = 0
+        self.start = time.monotonic()
+        self.next_emit = self.start + _INTERVAL
+        self.emit("start")
+
+    def __enter__(self) -> "Progress":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def update(self, num: int = 1, nbytes: int = 0, errors: int = 0) -> None:
+        """Add processed items, bytes and errors, emitting an event if due."""
+        self.done += num
+        self.bytes += nbytes
+        self.errors += errors
+        if _SINK is not None:
+            now = time.monotonic()
+            if now >= self.next_emit:
+                self.next_emit = now + _INTERVAL
+                self.emit("progress", now)
+
+    def close(self) -> None:
+        """Emit the final event of the stage."""
+        self.emit("end")
+
+    def emit(self, event: str, now: Optional[float] = None) -> None:
+        """Send an event with throughput and ETA to the configured sink."""
+        if _SINK is None:
+            return
+
+        elapsed = (now or time.monotonic()) - self.start
+        files_per_s = self.done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and files_per_s > 0:
+            eta = round(max(self.total - self.done, 0) / files_per_s, 1)
+
+        _SINK(
+            {
+                "ts": time.time(),
+                "event": event,
+                "stage": self.stage,
+                "done": self.done,
+                "total": self.total,
+                "bytes": self.bytes,
+                "errors": self.errors,
+                "elapsed_s": round(elapsed, 3),
+                "files_per_s": round(files_per_s, 2),
+                "mb_per_s": round(self.bytes / elapsed / 1e6, 3) if elapsed else 0.0,
+                "eta_s": eta,
+            }
+        )
+
+
+def configure(
+    file_path: Union[str, Path], fmt: str = "jsonl", interval: float = 5.0
+) -> None:
+    """Send progress events to a JSON lines file or a Prometheus textfile."""
+    global _SINK, _INTERVAL
+    if fmt == "jsonl":
+        _SINK = JsonLinesSink(file_path)
+    elif fmt == "prometheus":
+        _SINK = PrometheusSink(file_path)
+    else:
+        raise ValueError(f"Expected one of ['jsonl', 'prometheus'], but received {fmt}")
+    _INTERVAL = interval
+
+
+def disable() -> None:
+    """Stop sending progress events."""
+    global _SINK
+    _SINK = None
+
+
+def is_enabled() -> bool:
+    """Whether progress events are being sent."""
+    return _SINK is not None
+
+
+def track(stage: str, total: Optional[int] = None) -> Progress:
+    """Start tracking the progress of a stage."""
+    return Progress(stage, total)
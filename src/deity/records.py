@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""records.py in src/deity.
+
+Compact column store for encoding results. Directories are interned and referenced
+by integer codes, file names are packed into one UTF-8 buffer with offsets, and
+hashes are kept as 16 raw bytes, so a result costs a few dozen bytes plus its names
+instead of several Python objects. DataFrames are only built on output.
+"""
+
+import os
+import re
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from deity import progress
+from deity.encode import encode_batch
+from deity.ontology.matcher import RegionMatcher
+from deity.profiling import count
+from deity.profiling import timer
+
+
+class StringColumn:
+    """Immutable strings packed into a UTF-8 buffer with int64 offsets."""
+
+    __slots__ = ("data", "offsets")
+
+    def __init__(self, strings: Sequence[str]) -> None:
+        encoded = [elem.encode() for elem in strings]
+        self.data = b"".join(encoded)
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(elem) for elem in encoded], out=self.offsets[1:])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        return self.data[self.offsets[idx] : self.offsets[idx + 1]].decode()
+
+    def tolist(self, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        """Decode the strings in [start, stop)."""
+        bounds = self.offsets[
+            start : (len(self) if stop is None else stop) + 1
+        ].tolist()
+        return [self.data[a:b].decode() for a, b in zip(bounds[:-1], bounds[1:])]
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + self.offsets.nbytes
+
+
+class EncodedRecords:
+    """Column store of encoded files, see ``encode_records``.
+
+    :param directories: Interned directory paths.
+    :param old_dir: Code of each file's directory.
+    :param old_name: File names.
+    :param new_dir: Code of each file's output directory.
+    :param new_name: Encoded file names.
+    :param identifier: Identifiers, "" where none was found.
+    :param full_hash: md5 of each identifier as raw bytes, zeros where none was found.
+    :param region_id: Region ids, -1 where none was found. None without an ontology.
+    :param acronyms: Region acronyms by id.
+    :param num_chars: Length of the short hash, a prefix of the hex digest.
+    """
+
+    def __init__(
+        self,
+        directories: List[str],
+        old_dir: np.ndarray,
+        old_name: StringColumn,
+        new_dir: np.ndarray,
+        new_name: StringColumn,
+        identifier: StringColumn,
+        full_hash: np.ndarray,
+        region_id: Optional[np.ndarray] = None,
+        acronyms: Optional[Dict[int, str]] = None,
+        num_chars: int = 16,
+    ) -> None:
+        self.directories = directories
+        self.old_dir = old_dir
+        self.old_name = old_name
+        self.new_dir = new_dir
+        self.new_name = new_name
+        self.identifier = identifier
+        self.full_hash = full_hash
+        self.region_id = region_id
+        self.acronyms = acronyms or {}
+        self.num_chars = num_chars
+
+    def __len__(self) -> int:
+        return len(self.old_dir)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory used by the columns."""
+        arrays = [self.old_dir, self.new_dir, self.full_hash]
+        if self.region_id is not None:
+            arrays.append(self.region_id)
+        return (
+            sum(elem.nbytes for elem in arrays)
+            + sum(
+                elem.nbytes for elem in (self.old_name, self.new_name, self.identifier)
+            )
+            + sum(len(elem) for elem in self.directories)
+        )
+
+    @property
+    def matched(self) -> np.ndarray:
+        """Boolean mask of files with an identifier."""
+        return np.diff(self.identifier.offsets) > 0
+
+    def old_filepaths(self, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        """Return the original paths in [start, stop) as strings."""
+        dirs = self.old_dir[start:stop].tolist()
+        names = self.old_name.tolist(start, stop)
+        return [os.path.join(self.directories[d], n) for d, n in zip(dirs, names)]
+
+    def new_filepaths(self, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        """Return the encoded paths in [start, stop) as strings."""
+        dirs = self.new_dir[start:stop].tolist()
+        names = self.new_name.tolist(start, stop)
+        return [os.path.join(self.directories[d], n) for d, n in zip(dirs, names)]
+
+    def renames(self) -> pd.DataFrame:
+        """Return the old_filepath and new_filepath columns as strings."""
+        return pd.DataFrame(
+            {"old_filepath": self.old_filepaths(), "new_filepath": self.new_filepaths()}
+        )
+
+    def mirror(
+        self, input_dir: Union[str, Path], output_dir: Union[str, Path]
+    ) -> "EncodedRecords":
+        """Place each encoded file at its relative directory under output_dir.
+
+        Only the interned directories are rewritten, not one path per file.
+        """
+        input_dir, output_dir = os.fspath(input_dir), os.fspath(output_dir)
+        directories = list(self.directories)
+        mirrored = [
+            os.path.join(output_dir, os.path.relpath(elem, input_dir))
+            for elem in self.directories
+        ]
+        codes = {elem: idx for idx, elem in enumerate(directories)}
+        for elem in mirrored:
+            codes.setdefault(os.path.normpath(elem), len(directories))
+            if len(codes) > len(directories):
+                directories.append(os.path.normpath(elem))
+        lookup = np.array(
+            [codes[os.path.normpath(elem)] for elem in mirrored], dtype=np.int32
+        )
+        return EncodedRecords(
+            directories,
+            self.old_dir,
+            self.old_name,
+            lookup[self.old_dir],
+            self.new_name,
+            self.identifier,
+            self.full_hash,
+            self.region_id,
+            self.acronyms,
+            self.num_chars,
+        )
+
+    def to_dataframe(self, start: int = 0, stop: Optional[int] = None) -> pd.DataFrame:
+        """Return rows [start, stop) with the columns of ``encode_all``."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        matched = self.matched[start:stop]
+        hex_hash = [elem.hex() for elem in self.full_hash[start:stop].tolist()]
+        identifier = self.identifier.tolist(start, stop)
+        # unmatched hashes are the string "None", as in encode_all
+        full_hash = [h if m else "None" for h, m in zip(hex_hash, matched)]
+        df = pd.DataFrame(
+            {
+                "identifier": [i if m else None for i, m in zip(identifier, matched)],
+                "short_hash": [
+                    h[: self.num_chars] if m else h for h, m in zip(full_hash, matched)
+                ],
+                "full_hash": full_hash,
+                "old_filepath": [
+                    Path(elem) for elem in self.old_filepaths(start, stop)
+                ],
+                "new_filepath": self.new_filepaths(start, stop),
+            },
+            index=pd.RangeIndex(start, stop),
+        )
+        if self.region_id is not None:
+            region_id = self.region_id[start:stop]
+            df["region_id"] = pd.array(
+                np.where(region_id < 0, None, region_id).tolist(), dtype="Int64"
+            )
+            df["region"] = [
+                self.acronyms.get(elem) if elem >= 0 else None
+                for elem in region_id.tolist()
+            ]
+        return df
+
+
+def _split(paths: List[str]) -> Tuple[List[str], List[str]]:
+    """Split paths into their directories and names."""
+    pairs = [os.path.split(elem) for elem in paths]
+    return [elem[0] for elem in pairs], [elem[1] for elem in pairs]
+
+
+class _Builder:
+    """Accumulate encode_batch results into the columns of EncodedRecords."""
+
+    def __init__(self) -> None:
+        self.codes: Dict[str, int] = {}
+        self.old_dir: List[np.ndarray] = []
+        self.new_dir: List[np.ndarray] = []
+        self.old_name: List[str] = []
+        self.new_name: List[str] = []
+        self.identifier: List[str] = []
+        self.full_hash: List[bytes] = []
+
+    def code(self, directory: str) -> int:
+        return self.codes.setdefault(directory, len(self.codes))
+
+    def add(
+        self,
+        old_dirs: List[str],
+        new_dirs: List[str],
+        names: List[str],
+        df: pd.DataFrame,
+    ) -> None:
+        self.old_dir.append(np.array(list(map(self.code, old_dirs)), dtype=np.int32))
+        self.new_dir.append(np.array(list(map(self.code, new_dirs)), dtype=np.int32))
+        self.old_name.extend(names)
+        self.new_name.extend(df["new_filename"].tolist())
+        identifiers = df["identifier"].tolist()
+        self.identifier.extend(elem or "" for elem in identifiers)
+        self.full_hash.extend(
+            bytes.fromhex(h) if i else bytes(16)
+            for i, h in zip(identifiers, df["full_hash"].tolist())
+        )
+
+    def build(
+        self, region_matcher: Optional[RegionMatcher], num_chars: int
+    ) -> EncodedRecords:
+        region_id = None
+        if region_matcher is not None:
+            region_id = np.array(
+                [
+                    -1 if elem is None else elem
+                    for elem in map(region_matcher.match, self.old_name)
+                ],
+                dtype=np.int64,
+            )
+        return EncodedRecords(
+            directories=list(self.codes),
+            old_dir=np.concatenate(self.old_dir or [np.zeros(0, np.int32)]),
+            old_name=StringColumn(self.old_name),
+            new_dir=np.concatenate(self.new_dir or [np.zeros(0, np.int32)]),
+            new_name=StringColumn(self.new_name),
+            identifier=StringColumn(self.identifier),
+            # void, not S16, which would strip trailing zero bytes
+            full_hash=np.array(self.full_hash, dtype="V16"),
+            region_id=region_id,
+            acronyms=region_matcher.acronyms if region_matcher else None,
+            num_chars=num_chars,
+        )
+
+
+def encode_records(
+    filepath_list: List[Union[str, Path]],
+    pattern: Optional[str] = None,
+    output_dir: Optional[Union[str, Path]] = None,
+    ignore_case: bool = re.IGNORECASE,
+    num_chars: int = 16,
+    region_matcher: Optional[RegionMatcher] = None,
+    batch_size: int = 100_000,
+) -> EncodedRecords:
+    """Encode files like ``encode_all``, returning compact ``EncodedRecords``.
+
+    Filenames are encoded in batches with ``encode_batch``; no Path objects are
+    created. ``EncodedRecords.to_dataframe`` returns the same frame as ``encode_all``.
+    """
+    if not isinstance(filepath_list, list):
+        raise TypeError(
+            f"Requires 'list' input, but received {filepath_list} ({type(filepath_list)})"
+        )
+
+    # as in encode_single, a missing output directory means next to the source
+    if output_dir is not None and not Path(output_dir).exists():
+        output_dir = None
+
+    builder = _Builder()
+    with (
+        timer("encode.records"),
+        progress.track("encode", total=len(filepath_list)) as tracker,
+    ):
+        for start in range(0, len(filepath_list), batch_size):
+            batch = [
+                os.fspath(elem) for elem in filepath_list[start : start + batch_size]
+            ]
+            old_dirs, names = _split(batch)
+            new_dirs = _split([os.path.realpath(elem) for elem in batch])[0]
+            df = encode_batch(
+                names, pattern=pattern, ignore_case=ignore_case, num_chars=num_chars
+            )
+            if output_dir is not None:
+                # unmatched files keep their path, as in encode_single
+                new_dirs = [
+                    os.fspath(output_dir) if matched else new_dir
+                    for matched, new_dir in zip(df["identifier"].notna(), new_dirs)
+                ]
+            builder.add(old_dirs, new_dirs, names, df)
+            tracker.update(len(batch))
+
+    with timer("encode.region"):
+        records = builder.build(region_matcher, num_chars)
+    count("files.encoded", int(records.matched.sum()))
+    count("files.unmatched", int((~records.matched).sum()))
+    return records
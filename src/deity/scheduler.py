@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""scheduler.py in src/deity.
+
+Run file system operations on threads whose concurrency adapts to the observed
+latency of the operations: it grows by one while latency stays near its baseline
+and halves when latency rises, as in TCP congestion control (AIMD). An optional
+budget of operations or megabytes per second is shared by all schedulers, capping
+the load deity puts on shared storage.
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+
+class RateLimiter:
+    """Token bucket refilled at rate units per second, holding at most burst units.
+
+    A caller may take more than the bucket holds; the debt is paid by sleeping, so
+    large files are admitted without splitting them.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, but received {rate}")
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Take amount units, sleeping until the bucket is out of debt.
+
+        :return: The seconds slept.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.last) * self.rate
+            )
+            self.last = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class AIMD:
+    """Concurrency limit adjusted once per window of ``limit`` operations.
+
+    The limit grows by one while the smoothed latency stays within ``tolerance``
+    times the baseline, and is multiplied by ``decrease`` otherwise. Until the first
+    decrease it doubles instead, so short runs reach full concurrency. The baseline is
+    the lowest smoothed latency seen, drifting up by ``drift`` per window so that
+    storage that became slower for good is not throttled forever.
+    """
+
+    def __init__(
+        self,
+        max_limit: int = 8,
+        min_limit: int = 1,
+        tolerance: float = 2.0,
+        decrease: float = 0.5,
+        alpha: float = 0.2,
+        drift: float = 0.05,
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = min_limit
+        self.tolerance = tolerance
+        self.decrease = decrease
+        self.alpha = alpha
+        self.drift = drift
+        self.latency: Optional[float] = None
+        self.baseline: Optional[float] = None
+        self.samples = 0
+        self.slow_start = True
+        self.lock = threading.Lock()
+
+    def update(self, latency: float) -> int:
+        """Record the latency of one operation and return the limit."""
+        with self.lock:
+            if self.latency is None:
+                self.latency = self.baseline = latency
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+            self.samples += 1
+            if self.samples >= self.limit:
+                self.samples = 0
+                self._adjust()
+            return self.limit
+
+    def _adjust(self) -> None:
+        if self.latency > self.baseline * self.tolerance:
+            self.slow_start = False
+            self.limit = max(self.min_limit, int(self.limit * self.decrease))
+        else:
+            increase = self.limit if self.slow_start else 1
+            self.limit = min(self.max_limit, self.limit + increase)
+        self.baseline = min(self.latency, self.baseline * (1 + self.drift))
+
+
+_OPS: Optional[RateLimiter] = None
+_BYTES: Optional[RateLimiter] = None
+_MAX_WORKERS = 8
+
+
+def configure(
+    max_workers: Optional[int] = None,
+    ops_per_s: Optional[float] = None,
+    mb_per_s: Optional[float] = None,
+) -> None:
+    """Set the default concurrency ceiling and the budget shared by all schedulers.
+
+    :param max_workers: Threads used by schedulers not given max_workers.
+    :param ops_per_s: Maximum file operations per second, if any.
+    :param mb_per_s: Maximum megabytes per second, counted for exports only.
+    """
+    global _OPS, _BYTES, _MAX_WORKERS
+    if max_workers is not None:
+        _MAX_WORKERS = max_workers
+    _OPS = RateLimiter(ops_per_s) if ops_per_s else None
+    _BYTES = RateLimiter(mb_per_s * 1e6) if mb_per_s else None
+
+
+def disable() -> None:
+    """Remove the budget and restore the default concurrency ceiling."""
+    configure(max_workers=8)
+
+
+class IOScheduler:
+    """Map a function over items on threads, adapting concurrency with ``AIMD``.
+
+    Items are run in chunks of ``chunk_size`` so that cheap metadata operations are
+    not dominated by the cost of handing work to a thread.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        chunk_size: int = 1,
+        nbytes: Optional[Callable[..., int]] = None,
+    ) -> None:
+        self.controller = AIMD(max_limit=max_workers or _MAX_WORKERS)
+        self.chunk_size = chunk_size
+        self.nbytes = nbytes
+
+    def _run(self, func: Callable, chunk: List[tuple]) -> List[Any]:
+        start = time.perf_counter()
+        results = [func(*args) for args in chunk]
+        self.controller.update((time.perf_counter() - start) / len(chunk))
+        if _BYTES is not None and self.nbytes is not None:
+            _BYTES.acquire(sum(self.nbytes(*args) for args in chunk))
+        return results
+
+    def map(self, func: Callable, *iterables: Iterable) -> Iterator[Any]:
+        """Yield func(*args) for the items of iterables in order, as ``Executor.map``.
+
+        No item is started after an exception, which is raised when its result is
+        reached.
+        """
+        items = zip(*iterables)
+        pending: Deque[Future] = deque()
+        with ThreadPoolExecutor(self.controller.max_limit) as executor:
+            try:
+                while chunk := list(itertools.islice(items, self.chunk_size)):
+                    yield from self._ready(pending)
+                    if _OPS is not None:
+                        _OPS.acquire(len(chunk))
+                    pending.append(executor.submit(self._run, func, chunk))
+                while pending:
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _ready(self, pending: Deque[Future]) -> Iterator[Any]:
+        """Yield the completed results in order until another chunk may start."""
+        # completed chunks are buffered up to this many behind a slow one
+        backlog = 4 * self.controller.max_limit
+        while True:
+            while pending and pending[0].done():
+                yield from pending.popleft().result()
+            running = [future for future in pending if not future.done()]
+            failed = any(
+                future.exception() is not None for future in pending if future.done()
+            )
+            if (
+                not failed
+                and len(running) < self.controller.limit
+                and len(pending) < backlog
+            ):
+                return
+            # the first chunk is running, or it would have been yielded
+            wait(running, return_when=FIRST_COMPLETED)
+
+
+def io_map(
+    func: Callable,
+    *iterables: Iterable,
+    max_workers: Optional[int] = None,
+    chunk_size: int = 1,
+    nbytes: Optional[Callable[..., int]] = None,
+) -> Iterator[Any]:
+    """Map func over iterables with a new ``IOScheduler``, see its arguments.
+
+    :param nbytes: Returns the bytes moved by func for the same arguments. Only
+        called if a megabytes per second budget is configured.
+    """
+    scheduler = IOScheduler(max_workers, chunk_size=chunk_size, nbytes=nbytes)
+    return scheduler.map(func, *iterables)
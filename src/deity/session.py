@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""session.py in src/deity.
+
+Deidentify files from other Python programs. A ``Deidentifier`` compiles its
+patterns, caches hashes and opens its database once, so each call only encodes.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from deity.core import Encoder
+from deity.core import _encode_path
+from deity.core import create_table
+from deity.core import insert_rows
+from deity.core import sql_columns
+from deity.database.normalize import is_normalized
+from deity.database.utils import create_connection
+from deity.ontology.matcher import RegionMatcher
+from deity.profiling import count
+from deity.profiling import timer
+
+
+class _CachedEncoder(Encoder):
+    """``Encoder`` remembering the hashes of up to cache_size identifiers."""
+
+    def __init__(self, *args, cache_size: int = 100_000, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.cache_size = cache_size
+        self.hashes: Dict[str, Tuple[str, str]] = {}
+
+    def hash(self, identifier: str) -> Tuple[str, str]:
+        hashes = self.hashes.get(identifier)
+        if hashes is None:
+            if len(self.hashes) >= self.cache_size:
+                self.hashes.clear()
+            hashes = self.hashes[identifier] = super().hash(identifier)
+        return hashes
+
+
+class Deidentifier:
+    """Encode files and record them in a mapping table, sharing setup between calls.
+
+    Rows are those of ``deity.core.encode_paths``. The rows of files with an
+    identifier are kept until ``commit`` inserts them in one transaction; files are
+    not renamed. Instances may be shared by threads. Copies in other processes,
+    pickled or forked, open their own connection and drop the uncommitted rows of
+    the original; ids are allocated under a database lock, so they share the table::
+
+        with Deidentifier("deity.db") as deidentifier:
+            identifier, short_hash, *_, filepath = deidentifier.encode(path)
+
+    :param database_file: Database recording the rows, if any. Its table is created
+        on first use.
+    :param cache_size: Number of identifiers whose hashes are kept in memory.
+    """
+
+    def __init__(
+        self,
+        database_file: Optional[Union[str, Path]] = None,
+        table_name: str = "specimens",
+        pattern: Optional[str] = None,
+        output_dir: Optional[Union[str, Path]] = None,
+        ignore_case: bool = re.IGNORECASE,
+        num_chars: int = 16,
+        region_matcher: Optional[RegionMatcher] = None,
+        cache_size: int = 100_000,
+    ) -> None:
+        self.database_file = database_file
+        self.table_name = table_name
+        self.encoder = _CachedEncoder(
+            pattern, ignore_case=ignore_case, num_chars=num_chars, cache_size=cache_size
+        )
+        if output_dir is not None and not os.path.exists(output_dir):
+            output_dir = None
+        self.output_dir = output_dir
+        self.region_matcher = region_matcher
+        self.columns = sql_columns(table_name, regions=region_matcher is not None)
+        # short and full hash -> identifier
+        self.identifiers: Dict[str, str] = {}
+        self.pending: List[tuple] = []
+        self.conn: Optional[sqlite3.Connection] = None
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    def encode(self, path: Union[str, Path]) -> tuple:
+        """Encode one file and return its row."""
+        return self.encode_batch([path])[0]
+
+    def encode_batch(self, paths: Iterable[Union[str, Path]]) -> List[tuple]:
+        """Encode files and return their rows in order."""
+        with timer("session.encode"):
+            rows = [
+                _encode_path(
+                    os.fspath(path), self.encoder, self.output_dir, self.region_matcher
+                )
+                for path in paths
+            ]
+        matched = [row for row in rows if row[0] is not None]
+        with self.lock:
+            self._check_fork()
+            if len(self.identifiers) >= 2 * self.encoder.cache_size:
+                self.identifiers.clear()
+            for identifier, short_hash, full_hash, *_ in matched:
+                self.identifiers[short_hash] = self.identifiers[full_hash] = identifier
+            if self.database_file is not None:
+                self.pending.extend(matched)
+        count("session.files", len(rows))
+        return rows
+
+    def lookup(self, hash: str) -> Optional[str]:
+        """Return the identifier of a short or full hash, or None if it is unknown.
+
+        Hashes encoded by this instance are found without a query.
+        """
+        with self.lock:
+            identifier = self.identifiers.get(hash)
+            if identifier is not None or self.database_file is None:
+                return identifier
+
+            column = self.columns[0]
+            row = (
+                self._connect()
+                .execute(
+                    f"SELECT {column} FROM {self.table_name} "  # noqa: S608
+                    f"WHERE {column}_short_hash = ? OR {column}_full_hash = ? LIMIT 1",
+                    (hash, hash),
+                )
+                .fetchone()
+            )
+        return row[0] if row else None
+
+    def commit(self) -> int:
+        """Insert the rows encoded since the last commit in one transaction.
+
+        :return: The number of rows inserted.
+        """
+        with self.lock:
+            self._check_fork()
+            rows, self.pending = self.pending, []
+            if not rows:
+                return 0
+            try:
+                conn = self._connect()
+                with conn, timer("session.commit"):
+                    # lock the database before reading the ids other processes used
+                    conn.execute("BEGIN IMMEDIATE")
+                    start = conn.execute(
+                        f"SELECT COALESCE(MAX(id) + 1, 0) "  # noqa: S608
+                        f"FROM {self.table_name}"
+                    ).fetchone()[0]
+                    insert_rows(conn, self.table_name, self.columns, rows, start=start)
+            except sqlite3.Error:
+                self.pending = rows + self.pending
+                raise
+        count("session.rows", len(rows))
+        return len(rows)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return the connection, opening it and creating the table on first use.
+
+        The lock must be held.
+        """
+        self._check_fork()
+        if self.conn is None:
+            self.conn = create_connection(
+                self.database_file, timeout=60, check_same_thread=False
+            )
+            if not is_normalized(self.conn, self.table_name):
+                create_table(self.conn, self.table_name, self.columns)
+            self.conn.commit()
+        return self.conn
+
+    def _check_fork(self) -> None:
+        """Drop the connection and rows inherited by a forked child of the owner.
+
+        The lock must be held.
+        """
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.conn = None
+            self.pending = []
+
+    def close(self) -> None:
+        """Close the connection, discarding uncommitted rows."""
+        with self.lock:
+            self._check_fork()
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+            self.pending = []
+
+    def __enter__(self) -> "Deidentifier":
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            self.close()
+
+    def __getstate__(self) -> dict:
+        with self.lock:
+            state = self.__dict__.copy()
+            state["identifiers"] = dict(self.identifiers)
+        state.update(conn=None, pending=[])
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
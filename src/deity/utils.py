@@ -1,18 +1,28 @@
 #!/usr/bin/env python3
 """utils.py in src/deity."""
 
-import glob
+import os
+import zlib
 from pathlib import Path
+from typing import TYPE_CHECKING
 from typing import Any
 from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
 from typing import Tuple
 from typing import Union
 
-import pandas as pd
 import ujson as json
 import yaml
 from loguru import logger
 
+from deity import progress
+from deity.scheduler import io_map
+
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 DEFAULT_PATTERNS = [
     "[SL]([A-Z]?[SDFNA]?)-\\d{2}-\\d{5,6}",
@@ -25,6 +35,22 @@ DEFAULT_PATTERNS = [
 ]
 
 
+def get_cache_dir(subdir: Optional[str] = None) -> Path:
+    """Return the deity cache directory, creating it if it does not exist.
+
+    The location defaults to ``~/.cache/deity`` and may be overridden with the
+    ``DEITY_CACHE_DIR`` environment variable.
+    """
+    cache_dir = Path(
+        os.environ.get("DEITY_CACHE_DIR", Path.home().joinpath(".cache", "deity"))
+    )
+    if subdir is not None:
+        cache_dir = cache_dir.joinpath(subdir)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
 def json_loader(file_path: Union[str, Path]) -> Any:
     """Load a json file."""
     with open(file_path) as f:
@@ -38,32 +64,123 @@ def yaml_loader(file_path: Union[str, Path]) -> Dict:
 
 
 def get_file_list(input_dir: Path, extension: str = "txt,jpg,png") -> list:
-    """Get list of files in input directory with specified extensions."""
-    # convert extension string to list of extensions
-    extension = extension.split(",")
+    """Get list of files in input directory with specified extensions.
 
+    The tree is scanned a level at a time, with the directories of a level scanned
+    concurrently on an ``IOScheduler``. Hidden entries are skipped and symbolic
+    links to directories are not followed.
+    """
     # remove leading dot from extensions
-    extension = [ext.lstrip(".") for ext in extension]
+    extensions = tuple(f".{ext.strip().lstrip('.')}" for ext in extension.split(","))
 
     file_list = []
-    for ext in extension:
-        search_path = str(input_dir.joinpath(f"**/*.{ext}"))
-        file_list.extend(glob.glob(search_path, recursive=True))
+    directories = [str(input_dir)]
+    with progress.track("walk") as walk:
+        while directories:
+            subdirs = []
+            for files, found in io_map(
+                scan_dir, directories, [extensions] * len(directories)
+            ):
+                file_list.extend(files)
+                subdirs.extend(found)
+                walk.update(len(files))
+            directories = subdirs
     return file_list
 
 
-def rename_files(df_file_rename: pd.DataFrame) -> None:
-    """Rename files based on pandas DataFrame."""
+def scan_dir(
+    directory: str, extensions: Tuple[str, ...]
+) -> Tuple[List[str], List[str]]:
+    """Return the matching files and the subdirectories of a directory.
+
+    Hidden entries are skipped, and unreadable directories are skipped with a warning.
+    """
+    files, subdirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.endswith(extensions):
+                    files.append(entry.path)
+    except PermissionError as e:
+        logger.warning(f"Skipping {directory}: {e}")
+    return files, subdirs
+
+
+SHARD_KEYS = ["dir", "subdir", "path"]
+
+
+def select_shard(
+    file_list: List[str],
+    input_dir: Path,
+    shard: Tuple[int, int],
+    by: str = "dir",
+) -> List[str]:
+    """Return the files of shard (index, count), partitioned by a stable hash.
+
+    With by="dir" the directory of each file is hashed, and with by="subdir" its
+    first directory below input_dir, so files renamed in place stay on their shard.
+    With by="path" each file is assigned on its own, which is only stable if renamed
+    files leave input_dir: a renamed file may hash to another shard and be encoded
+    again.
+    """
+    index, num_shards = shard
+    if not 0 <= index < num_shards:
+        raise ValueError(f"Shard index must be in [0, {num_shards}), but got {index}")
+    if by not in SHARD_KEYS:
+        raise ValueError(f"Expected one of {SHARD_KEYS}, but received {by}")
+
+    selected = []
+    for filepath in file_list:
+        key = os.path.relpath(filepath, input_dir)
+        if by == "dir":
+            key = os.path.dirname(key)
+        elif by == "subdir":
+            key = Path(key).parts[0]
+        # crc32 is stable across processes, unlike hash()
+        if zlib.crc32(key.encode()) % num_shards == index:
+            selected.append(filepath)
+    return selected
+
+
+def rename_pairs(pairs: Iterable[Tuple[str, str]], total: Optional[int] = None) -> None:
+    """Rename each (old, new) pair on an ``IOScheduler``, stopping at the first error."""
     logger.info("Renaming files...")
-    df_file_rename.apply(
-        lambda row: row["old_filepath"].rename(row["new_filepath"]),
-        axis=1,
+    with progress.track("rename", total=total) as tracker:
+        try:
+            for _ in io_map(lambda pair: os.rename(*pair), pairs, chunk_size=64):
+                tracker.update()
+        except OSError:
+            tracker.update(errors=1)
+            raise
+
+
+def rename_batch(pairs: List[Tuple[Path, str]]) -> int:
+    """Rename (old, new) pairs and return the number of failures."""
+    errors = 0
+    for old_filepath, new_filepath in pairs:
+        try:
+            os.rename(old_filepath, new_filepath)
+        except OSError as e:
+            logger.error(f"Failed to rename {old_filepath}: {e}")
+            errors += 1
+    return errors
+
+
+def rename_files(df_file_rename: "pd.DataFrame") -> None:
+    """Rename files based on pandas DataFrame."""
+    rename_pairs(
+        zip(df_file_rename["old_filepath"], df_file_rename["new_filepath"]),
+        total=len(df_file_rename),
     )
 
 
 def create_df_sql(
-    df: pd.DataFrame, table_name: str
-) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    df: "pd.DataFrame", table_name: str
+) -> Tuple["pd.DataFrame", "pd.DataFrame"]:
     """Create pandas DataFrame from SQL query."""
     df_file_rename = df[["old_filepath", "new_filepath"]].copy()
 
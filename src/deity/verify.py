@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""verify.py in src/deity.
+
+Check that a directory and its mapping table agree. The files on disk and the
+filepaths in the table are both sorted and compared in one merge pass, so the table
+is streamed from SQLite instead of loaded into memory.
+"""
+
+import csv
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+from loguru import logger
+
+from deity.core import Encoder
+from deity.database.utils import create_connection
+from deity.profiling import count
+from deity.profiling import timer
+from deity.utils import get_file_list
+
+
+# missing: in the table, not on disk
+# identifiable: on disk, not in the table, with an identifier in its name
+# orphan: on disk, not in the table, without an identifier
+STATUSES = ["missing", "identifiable", "orphan"]
+
+
+def stream_filepaths(
+    conn: sqlite3.Connection, table_name: str, prefix: str
+) -> Iterator[str]:
+    """Yield the distinct filepaths of the table starting with prefix, sorted.
+
+    Paths are compared as bytes by SQLite and as code points by Python, which agree
+    for UTF-8.
+    """
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    cursor = conn.execute(
+        f"SELECT DISTINCT filepath FROM {table_name} "  # noqa: S608
+        "WHERE filepath >= ? AND filepath < ? ORDER BY filepath",
+        (prefix, upper),
+    )
+    for (filepath,) in cursor:
+        yield filepath
+
+
+def merge_sorted(
+    on_disk: Iterable[str], in_table: Iterable[str]
+) -> Iterator[Tuple[str, bool, bool]]:
+    """Merge two sorted iterables of unique paths.
+
+    :return: (path, on_disk, in_table) once per path.
+    """
+    on_disk, in_table = iter(on_disk), iter(in_table)
+    disk_path, table_path = next(on_disk, None), next(in_table, None)
+    while disk_path is not None or table_path is not None:
+        if table_path is None or (disk_path is not None and disk_path < table_path):
+            yield disk_path, True, False
+            disk_path = next(on_disk, None)
+        elif disk_path is None or table_path < disk_path:
+            yield table_path, False, True
+            table_path = next(in_table, None)
+        else:
+            yield disk_path, True, True
+            disk_path, table_path = next(on_disk, None), next(in_table, None)
+
+
+def find_problems(
+    input_dir: Path,
+    database_file: Path,
+    table_name: str = "specimens",
+    extension: str = "txt,jpg,png",
+    pattern: Optional[str] = None,
+) -> Iterator[Tuple[str, str]]:
+    """Yield (status, path) for each file or row below input_dir that disagrees.
+
+    Rows outside input_dir, or without one of the extensions, are not checked, as
+    they may have been encoded by a run with other extensions.
+    """
+    if not Path(database_file).exists():
+        raise FileNotFoundError(f"Database {database_file} does not exist")
+
+    # filepaths are stored resolved
+    input_dir = os.path.realpath(input_dir)
+    with timer("verify.walk"):
+        file_list = sorted(get_file_list(Path(input_dir), extension))
+    count("verify.files", len(file_list))
+
+    encoder = Encoder(pattern)
+    conn = create_connection(database_file)
+    try:
+        prefix = os.path.join(input_dir, "")
+        extensions = tuple(
+            f".{ext.strip().lstrip('.')}" for ext in extension.split(",")
+        )
+        in_table = (
+            path
+            for path in stream_filepaths(conn, table_name, prefix)
+            if path.endswith(extensions)
+        )
+        merged = merge_sorted(file_list, in_table)
+        for path, on_disk, in_table in merged:
+            if not on_disk:
+                yield "missing", path
+            elif not in_table:
+                found = encoder(os.path.basename(path))[0] is not None
+                yield "identifiable" if found else "orphan", path
+    finally:
+        conn.close()
+
+
+def verify_tree(
+    input_dir: Path,
+    database_file: Path,
+    table_name: str = "specimens",
+    extension: str = "txt,jpg,png",
+    pattern: Optional[str] = None,
+    report: Optional[Path] = None,
+    max_examples: int = 10,
+) -> Dict[str, int]:
+    """Log the problems found by ``find_problems``, writing them all to report.
+
+    :param report: CSV file with status and path columns.
+    :param max_examples: Number of paths logged per status.
+    :return: The number of problems per status.
+    """
+    counts = dict.fromkeys(STATUSES, 0)
+    problems = find_problems(input_dir, database_file, table_name, extension, pattern)
+    with open(report or os.devnull, "w", newline="") as f, timer("verify.compare"):
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(["status", "path"])
+        for status, path in problems:
+            if counts[status] < max_examples:
+                logger.warning(f"{status}: {path}")
+            counts[status] += 1
+            writer.writerow([status, path])
+
+    for status, num in counts.items():
+        count(f"verify.{status}", num)
+    logger.info(", ".join(f"{num} {status}" for status, num in counts.items()))
+    return counts
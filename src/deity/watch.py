@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""watch.py in src/deity.
+
+Encode files as soon as they are written to a watched directory, using Linux
+inotify through ``ctypes``. Files already in the directory are encoded by a
+catch-up scan at startup; afterwards only the files reported by inotify are
+visited, so the tree is never scanned again.
+"""
+
+import csv
+import ctypes
+import ctypes.util
+import os
+import select
+import sqlite3
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
+
+from loguru import logger
+
+from deity import progress
+from deity.core import Encoder
+from deity.core import _encode_path
+from deity.core import create_table
+from deity.core import insert_rows
+from deity.core import sql_columns
+from deity.database.normalize import is_normalized
+from deity.database.utils import create_connection
+from deity.ontology.matcher import RegionMatcher
+from deity.profiling import count
+from deity.profiling import timer
+from deity.utils import rename_batch
+from deity.utils import scan_dir
+
+
+# event masks from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_ONLYDIR
+
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal binding of the inotify system calls of libc.
+
+    :raises OSError: If inotify is not available, e.g. on macOS or Windows.
+    """
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    @staticmethod
+    def _raise(filename: Optional[str] = None) -> None:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), filename)
+
+    def add_watch(self, path: Union[str, Path], mask: int = WATCH_MASK) -> int:
+        """Watch path for the events in mask and return its watch descriptor."""
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise(str(path))
+        return wd
+
+    def read(self, timeout: Optional[float] = None) -> List[Tuple[int, int, str]]:
+        """Wait up to timeout seconds for events and return (wd, mask, name) tuples."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 2**16)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self) -> None:
+        """Close the inotify file descriptor, removing all watches."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self) -> "Inotify":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class Watcher:
+    """Encode, record and rename files once they are closed after writing.
+
+    Paths are debounced: a file is processed once no event has been reported for it
+    for ``debounce`` seconds. Due files are processed in batches of ``batch_size``,
+    each inserted in one transaction before its files are renamed.
+
+    Files without an identifier are ignored, as are the encoded files: the fallback
+    patterns can match a hash, so the filepaths recorded in the database are kept
+    in memory and skipped.
+    """
+
+    def __init__(
+        self,
+        input_dir: Path,
+        database_file: Path,
+        table_name: str = "specimens",
+        extension: str = "txt,jpg,png",
+        pattern: Optional[str] = None,
+        output_dir: Optional[Path] = None,
+        region_matcher: Optional[RegionMatcher] = None,
+        debounce: float = 2.0,
+        batch_size: int = 1000,
+        dry_run: bool = False,
+    ) -> None:
+        self.input_dir = Path(input_dir)
+        self.database_file = Path(database_file)
+        self.table_name = table_name
+        self.extensions = tuple(
+            f".{ext.strip().lstrip('.')}" for ext in extension.split(",")
+        )
+        self.encoder = Encoder(pattern)
+        self.output_dir = output_dir
+        self.region_matcher = region_matcher
+        self.columns = sql_columns(table_name, regions=region_matcher is not None)
+        self.debounce = debounce
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.stats = {"events": 0, "encoded": 0, "renamed": 0, "errors": 0}
+
+        self.inotify: Optional[Inotify] = None
+        self.tracker: Optional[progress.Progress] = None
+        self.conn: Optional[sqlite3.Connection] = None
+        self.watches: Dict[int, str] = {}
+        # path -> time of its last event
+        self.pending: Dict[str, float] = {}
+        self.encoded: Set[str] = set()
+
+    def start(self) -> None:
+        """Watch the tree, open the database and queue the files already present."""
+        self.inotify = Inotify()
+        self.tracker = progress.track("watch")
+        if not self.dry_run:
+            self.conn = create_connection(self.database_file)
+            if not is_normalized(self.conn, self.table_name):
+                create_table(self.conn, self.table_name, self.columns)
+            self.conn.commit()
+            self.encoded.update(
+                row[0]
+                for row in self.conn.execute(
+                    f"SELECT filepath FROM {self.table_name}"  # noqa: S608
+                )
+            )
+        with timer("watch.scan"):
+            self.watch_tree(str(self.input_dir))
+        logger.info(
+            f"Watching {len(self.watches)} directories in {self.input_dir}, "
+            f"{len(self.pending)} file(s) queued"
+        )
+
+    def watch_tree(self, directory: str, seen: float = 0.0) -> None:
+        """Watch directory and its subdirectories, queueing their files.
+
+        Directories are watched before they are scanned, so a file written during
+        the scan is reported or found.
+
+        :param seen: Time the files found are queued with. The default makes them
+            due at once; new directories pass the current time, as their files may
+            still be written.
+        """
+        directories = [directory]
+        while directories:
+            directory = directories.pop()
+            try:
+                self.watches[self.inotify.add_watch(directory)] = directory
+                files, subdirs = scan_dir(directory, self.extensions)
+            except OSError as e:
+                logger.warning(f"Cannot watch {directory}: {e}")
+                continue
+            directories.extend(subdirs)
+            for path in files:
+                self.pending.setdefault(path, seen)
+
+    def handle(self, wd: int, mask: int, name: str) -> None:
+        """Queue the file or watch the directory named by an event."""
+        self.stats["events"] += 1
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify queue overflowed, rescanning")
+            self.watch_tree(str(self.input_dir))
+        elif mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+        elif wd in self.watches and not name.startswith("."):
+            path = os.path.join(self.watches[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_tree(path, seen=time.monotonic())
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and name.endswith(
+                self.extensions
+            ):
+                self.pending[path] = time.monotonic()
+
+    def due(self, force: bool = False) -> List[str]:
+        """Remove and return the pending paths without events for debounce seconds."""
+        cutoff = time.monotonic() - self.debounce
+        paths = [path for path, last in self.pending.items() if force or last <= cutoff]
+        for path in paths:
+            del self.pending[path]
+        return paths
+
+    def timeout(self, limit: float = 1.0) -> float:
+        """Seconds until the next pending path is due, at most limit."""
+        if not self.pending:
+            return limit
+        wait = min(self.pending.values()) + self.debounce - time.monotonic()
+        return min(max(wait, 0.0), limit)
+
+    def step(self, timeout: Optional[float] = None, force: bool = False) -> int:
+        """Handle the events of one read and process the due files.
+
+        :param force: Process all pending files without waiting for the debounce.
+        :return: The number of files encoded.
+        """
+        for event in self.inotify.read(self.timeout() if timeout is None else timeout):
+            self.handle(*event)
+
+        encoded = 0
+        paths = self.due(force)
+        for start in range(0, len(paths), self.batch_size):
+            encoded += self.process(paths[start : start + self.batch_size])
+        return encoded
+
+    def process(self, paths: List[str]) -> int:
+        """Encode a batch, insert it in one transaction, then rename its files.
+
+        :return: The number of files encoded.
+        """
+        with timer("watch.encode"):
+            rows = [
+                _encode_path(path, self.encoder, self.output_dir, self.region_matcher)
+                for path in paths
+                if path not in self.encoded and os.path.exists(path)
+            ]
+            rows = [row for row in rows if row[0] is not None]
+        if not rows:
+            return 0
+
+        pairs = [(row[3], row[4]) for row in rows]
+        self.encoded.update(new_filepath for _, new_filepath in pairs)
+        if self.dry_run:
+            for old_filepath, new_filepath in pairs:
+                logger.info(f"{old_filepath} -> {new_filepath}")
+        else:
+            with timer("watch.insert"):
+                self.record(rows)
+            with timer("watch.rename"):
+                errors = rename_batch(pairs)
+            self.stats["renamed"] += len(pairs) - errors
+            self.stats["errors"] += errors
+            self.tracker.update(len(pairs) - errors, errors=errors)
+
+        self.stats["encoded"] += len(rows)
+        return len(rows)
+
+    def record(self, rows: List[tuple]) -> None:
+        """Append rows to the table in one transaction and to the CSV export."""
+        with self.conn:
+            # lock the database before reading the ids other writers used
+            self.conn.execute("BEGIN IMMEDIATE")
+            start = self.conn.execute(
+                f"SELECT COALESCE(MAX(id) + 1, 0) FROM {self.table_name}"  # noqa: S608
+            ).fetchone()[0]
+            insert_rows(self.conn, self.table_name, self.columns, rows, start=start)
+
+        csv_filename = self.database_file.with_name(
+            f"{self.database_file.name}_{self.table_name}.csv"
+        )
+        header = not csv_filename.exists()
+        with open(csv_filename, "a", newline="") as f:
+            writer = csv.writer(f, lineterminator=os.linesep)
+            if header:
+                writer.writerow(self.columns)
+            # pandas writes missing values as empty fields
+            writer.writerows(
+                ["" if value is None else value for value in row] for row in rows
+            )
+
+    def close(self) -> None:
+        """Process the pending files, then stop watching and close the database."""
+        try:
+            if self.inotify is not None:
+                self.step(timeout=0, force=True)
+        finally:
+            if self.inotify is not None:
+                self.inotify.close()
+                self.tracker.close()
+            if self.conn is not None:
+                self.conn.close()
+            for name, value in self.stats.items():
+                count(f"watch.{name}", value)
+
+    def run(self, stop: Optional[threading.Event] = None) -> dict:
+        """Watch until stop is set or the process is interrupted.
+
+        :return: The number of events handled and files encoded, renamed or failed.
+        """
+        stop = stop or threading.Event()
+        self.start()
+        try:
+            while not stop.is_set():
+                self.step()
+        except KeyboardInterrupt:
+            logger.info("Stopping")
+        finally:
+            self.close()
+        return self.stats
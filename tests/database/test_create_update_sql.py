@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/database/create_update_sql.py."""
+
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from deity.database import create_update_sql
+
+
+@pytest.fixture()
+def df_sql() -> pd.DataFrame:
+    """Rows of a mapping table with region ids."""
+    return pd.DataFrame(
+        {
+            "accession": [f"SHS-00-{idx:05d}" for idx in range(5)],
+            "old_filepath": [f"/data/{idx}" for idx in range(5)],
+            "filepath": [f"/data/hash_{idx}" for idx in range(5)],
+            "region_id": pd.array([1, None, 3, 4, 5], dtype="Int64"),
+        }
+    )
+
+
+def read_schema(database_file: Path) -> list:
+    with sqlite3.connect(database_file) as conn:
+        return conn.execute("SELECT type, name, sql FROM sqlite_master").fetchall()
+
+
+def test_create_update_sql(df_sql, tmp_path) -> None:
+    """Chunks are written to the schema DataFrame.to_sql would create."""
+    expected_file = tmp_path.joinpath("expected.db")
+    with sqlite3.connect(expected_file) as conn:
+        df_sql.to_sql("specimens", conn, index_label="id")
+
+    database_file = tmp_path.joinpath("deity.db")
+    conn = sqlite3.connect(database_file)
+    create_update_sql(df_sql, "specimens", conn, database_file, chunk_size=2)
+
+    schema, expected = read_schema(database_file), read_schema(expected_file)
+    assert [row[:2] for row in schema[:2]] == [row[:2] for row in expected]
+    assert schema[0] == expected[0]
+    assert schema[2][1] == "ix_specimens_region_id"
+    with sqlite3.connect(database_file) as conn:
+        df = pd.read_sql("SELECT * FROM specimens", conn, index_col="id")
+    pd.testing.assert_frame_equal(
+        df.astype({"region_id": "Int64"}), df_sql.rename_axis("id")
+    )
+    assert len(pd.read_csv(tmp_path.joinpath("deity.db_specimens.csv"))) == 5
+
+
+def test_create_update_sql_atomic(df_sql, tmp_path) -> None:
+    """A chunk failing part-way leaves no table behind."""
+    df_sql["accession"] = [*df_sql["accession"][:4], {"not": "bindable"}]
+    database_file = tmp_path.joinpath("deity.db")
+    conn = sqlite3.connect(database_file)
+    with pytest.raises(sqlite3.Error):
+        create_update_sql(df_sql, "specimens", conn, database_file, chunk_size=2)
+
+    assert read_schema(database_file) == []
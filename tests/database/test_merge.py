@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/database/merge.py."""
+
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from deity.__main__ import cli
+from deity.database import merge_shards
+
+
+def write_shard(file_path: Path, names: list) -> Path:
+    """Write a shard database mapping names to hashed names."""
+    df = pd.DataFrame(
+        {
+            "accession": [f"SHS-00-{idx:05d}" for idx in range(len(names))],
+            "old_filepath": [f"/data/{name}" for name in names],
+            "filepath": [f"/data/hash_{name}" for name in names],
+        }
+    )
+    with sqlite3.connect(file_path) as conn:
+        df.to_sql("specimens", conn, index_label="id")
+    return file_path
+
+
+def read_table(database_file: Path) -> pd.DataFrame:
+    with sqlite3.connect(database_file) as conn:
+        return pd.read_sql("SELECT * FROM specimens ORDER BY id", conn)
+
+
+def test_merge_shards(tmp_path) -> None:
+    """Rows from all shards are inserted once with consecutive ids."""
+    shards = [
+        write_shard(tmp_path.joinpath("a.db"), ["a", "b"]),
+        write_shard(tmp_path.joinpath("b.db"), ["c", "d", "e"]),
+    ]
+    database_file = tmp_path.joinpath("deity.db")
+    assert merge_shards(database_file, shards) == 5
+    # merging again inserts nothing
+    assert merge_shards(database_file, shards) == 0
+
+    df = read_table(database_file)
+    assert df["id"].tolist() == list(range(5))
+    assert df["old_filepath"].tolist() == [f"/data/{x}" for x in "abcde"]
+
+
+def test_merge_indexes(tmp_path) -> None:
+    """Shard rows are looked up in main with an index, not a scan."""
+    database_file = tmp_path.joinpath("deity.db")
+    merge_shards(database_file, [write_shard(tmp_path.joinpath("a.db"), ["a"])])
+
+    conn = sqlite3.connect(database_file)
+    conn.execute("ATTACH DATABASE ? AS shard", (str(tmp_path.joinpath("a.db")),))
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT 1 FROM shard.specimens AS s WHERE EXISTS "
+        "(SELECT 1 FROM main.specimens AS m WHERE m.filepath = s.filepath) OR EXISTS "
+        "(SELECT 1 FROM main.specimens AS m WHERE m.old_filepath = s.old_filepath)"
+    ).fetchall()
+    conn.close()
+    details = [row[-1] for row in plan]
+    assert any("ix_specimens_filepath" in detail for detail in details)
+    assert any("ix_specimens_old_filepath" in detail for detail in details)
+
+
+def test_merge_conflict(tmp_path) -> None:
+    """A file mapped to different names is a conflict."""
+    database_file = tmp_path.joinpath("deity.db")
+    merge_shards(database_file, [write_shard(tmp_path.joinpath("a.db"), ["a", "b"])])
+
+    shard = write_shard(tmp_path.joinpath("b.db"), ["a", "c"])
+    with sqlite3.connect(shard) as conn:
+        conn.execute("UPDATE specimens SET filepath = '/data/other' WHERE id = 0")
+
+    with pytest.raises(ValueError, match="conflict"):
+        merge_shards(database_file, [shard])
+    assert len(read_table(database_file)) == 2
+
+    assert merge_shards(database_file, [shard], on_conflict="skip") == 1
+    assert read_table(database_file)["old_filepath"].tolist()[-1] == "/data/c"
+
+
+def test_cli_shard_merge(runner, temp_dir, tmp_path, suffix_list, test_files) -> None:
+    """Each shard writes its own database, and merge combines them."""
+    database_file = tmp_path.joinpath("deity.db")
+    # renamed files leave the input directory, so later shards do not see them
+    output_dir = tmp_path.joinpath("output")
+    output_dir.mkdir()
+    for idx in range(2):
+        result = runner.invoke(
+            cli,
+            [
+                temp_dir,
+                "--extension",
+                ",".join(suffix_list),
+                "--database-file",
+                str(database_file),
+                "--output-dir",
+                str(output_dir),
+                "--shard",
+                f"{idx}/2",
+                "--shard-by",
+                "path",
+            ],
+        )
+        assert result.exit_code == 0, f"Error: {result.exception}"
+
+    shards = sorted(tmp_path.glob("deity.shard-*-of-2.db"))
+    assert len(shards) == 2
+    result = runner.invoke(cli, ["merge", str(database_file), *map(str, shards)])
+    assert result.exit_code == 0, f"Error: {result.exception}"
+    assert len(read_table(database_file)) == len(test_files)
+
+
+def test_cli_shard_in_place(runner, tmp_path) -> None:
+    """Files renamed in place stay on their shard and are encoded once."""
+    input_dir = tmp_path.joinpath("input")
+    names = []
+    for idx in range(8):
+        input_dir.joinpath(f"scanner_{idx}").mkdir(parents=True)
+        name = f"scanner_{idx}/SHS-00-{idx:05d}_part-A.txt"
+        input_dir.joinpath(name).write_text("")
+        names.append(name)
+
+    database_file = tmp_path.joinpath("deity.db")
+    args = [str(input_dir), "--extension", "txt", "--database-file"]
+    for idx in range(2):
+        result = runner.invoke(cli, [*args, str(database_file), "--shard", f"{idx}/2"])
+        assert result.exit_code == 0, f"Error: {result.exception}"
+
+    shards = sorted(tmp_path.glob("deity.shard-*-of-2.db"))
+    result = runner.invoke(cli, ["merge", str(database_file), *map(str, shards)])
+    assert result.exit_code == 0, f"Error: {result.exception}"
+    df = read_table(database_file)
+    assert sorted(df["accession"]) == [f"SHS-00-{idx:05d}" for idx in range(8)]
+    assert not any(input_dir.joinpath(name).exists() for name in names)
+
+    result = runner.invoke(
+        cli, [*args, str(database_file), "--shard", "0/2", "--shard-by", "path"]
+    )
+    assert result.exit_code == 2
@@ -0,0 +1,130 @@
+"""Tests for src/deity/database/normalize.py."""
+
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from deity.__main__ import cli
+from deity.database import create_update_sql
+from deity.database import merge_shards
+from deity.database import migrate
+from deity.database.normalize import is_normalized
+
+
+def write_database(file_path: Path, names: list, prefix: str = "/data") -> Path:
+    """Write a mapping table with region ids, as deity --ontology does."""
+    df = pd.DataFrame(
+        {
+            "accession": [f"SHS-00-{idx:05d}" for idx in range(len(names))],
+            "old_filepath": [f"{prefix}/{name}" for name in names],
+            "filepath": [f"{prefix}/hash_{name}" for name in names],
+            "region_id": pd.array([1, None] * (len(names) // 2), dtype="Int64"),
+        }
+    )
+    with sqlite3.connect(file_path) as conn:
+        df.to_sql("specimens", conn, index_label="id")
+    return file_path
+
+
+def read_table(database_file: Path) -> pd.DataFrame:
+    with sqlite3.connect(database_file) as conn:
+        return pd.read_sql("SELECT * FROM specimens ORDER BY id", conn)
+
+
+def test_migrate(tmp_path) -> None:
+    """The view returns the same rows as the original table."""
+    database_file = write_database(tmp_path.joinpath("deity.db"), ["a", "b", "c/d", "e"])
+    with sqlite3.connect(database_file) as conn:
+        conn.execute(
+            "INSERT INTO specimens (id, old_filepath, filepath) "
+            "VALUES (4, 'relative.txt', '/root.txt')"
+        )
+    expected = read_table(database_file)
+
+    assert migrate(database_file) == 5
+    pd.testing.assert_frame_equal(read_table(database_file), expected)
+
+    with sqlite3.connect(database_file) as conn:
+        assert is_normalized(conn, "specimens")
+        directories = [row[0] for row in conn.execute("SELECT path FROM directories")]
+    assert sorted(directories) == ["", "/", "/data/", "/data/c/", "/data/hash_c/"]
+
+    # migrating again changes nothing
+    assert migrate(database_file) == 0
+    pd.testing.assert_frame_equal(read_table(database_file), expected)
+
+
+def test_migrate_smaller(tmp_path) -> None:
+    """Deep directories are stored once."""
+    prefix = "/" + "/".join(["archive"] * 20)
+    database_file = write_database(
+        tmp_path.joinpath("deity.db"), [f"{idx}.txt" for idx in range(2000)], prefix
+    )
+    size = database_file.stat().st_size
+    migrate(database_file)
+    assert database_file.stat().st_size < size / 2
+
+
+def test_append_after_migrate(tmp_path) -> None:
+    """Rows appended with create_update_sql and merge_shards go through the view."""
+    database_file = write_database(tmp_path.joinpath("deity.db"), ["a", "b"])
+    migrate(database_file)
+
+    df = pd.DataFrame(
+        {
+            "accession": ["x"],
+            "old_filepath": ["/new/x"],
+            "filepath": ["/new/hash_x"],
+            "region_id": pd.array([5], dtype="Int64"),
+        },
+        index=[2],
+    )
+    conn = sqlite3.connect(database_file)
+    create_update_sql(df, "specimens", conn, database_file, write_csv=False)
+
+    shard = write_database(tmp_path.joinpath("shard.db"), ["c", "d"], "/other")
+    assert merge_shards(database_file, [shard]) == 2
+
+    df = read_table(database_file)
+    assert df["id"].tolist() == list(range(5))
+    assert df["filepath"].tolist()[2:] == [
+        "/new/hash_x",
+        "/other/hash_c",
+        "/other/hash_d",
+    ]
+    assert df["region_id"].tolist()[2] == 5
+
+
+def test_migrate_missing_columns(tmp_path) -> None:
+    """Tables without paths are not migrated."""
+    database_file = tmp_path.joinpath("deity.db")
+    with sqlite3.connect(database_file) as conn:
+        conn.execute("CREATE TABLE specimens (id INTEGER, accession TEXT)")
+    with pytest.raises(ValueError, match="old_filepath"):
+        migrate(database_file)
+    with sqlite3.connect(database_file) as conn:
+        assert not is_normalized(conn, "specimens")
+
+
+def test_migrate_null_path(tmp_path) -> None:
+    """A row that cannot be copied rolls the migration back."""
+    database_file = write_database(tmp_path.joinpath("deity.db"), ["a", "b"])
+    with sqlite3.connect(database_file) as conn:
+        conn.execute("INSERT INTO specimens (id, old_filepath) VALUES (2, '/data/c')")
+    expected = read_table(database_file)
+
+    with pytest.raises(ValueError, match="Copied 2 of 3"):
+        migrate(database_file)
+    with sqlite3.connect(database_file) as conn:
+        assert not is_normalized(conn, "specimens")
+    pd.testing.assert_frame_equal(read_table(database_file), expected)
+
+
+def test_migrate_command(runner, tmp_path) -> None:
+    """deity migrate normalizes a database in place."""
+    database_file = write_database(tmp_path.joinpath("deity.db"), ["a", "b"])
+    result = runner.invoke(cli, ["migrate", str(database_file)])
+    assert result.exit_code == 0, f"Error: {result.exception}"
+    assert read_table(database_file)["old_filepath"].tolist() == ["/data/a", "/data/b"]
@@ -0,0 +1,2 @@
+#!/usr/bin/env python3
+"""__init__.py in tests/ontology."""
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Configure shared fixtures for tests/ontology."""
+
+import pytest
+
+
+@pytest.fixture()
+def nested_dict() -> dict:
+    """Returns a small nested ontology in the Allen Brain structure graph format."""
+    return {
+        "root": {
+            "id": 997,
+            "acronym": "root",
+            "name": "root",
+            "children": [
+                {
+                    "id": 8,
+                    "acronym": "grey",
+                    "name": "Basic cell groups and regions",
+                    "children": [
+                        {
+                            "id": 567,
+                            "acronym": "CH",
+                            "name": "Cerebrum",
+                            "children": [],
+                        },
+                        {
+                            "acronym": "BS",
+                            "name": "Brain stem",
+                            "children": {
+                                "id": 313,
+                                "acronym": "MB",
+                                "name": "Midbrain",
+                            },
+                            "id": 343,
+                        },
+                    ],
+                },
+                {"id": 1009, "acronym": "fiber tracts", "name": "fiber tracts"},
+            ],
+        }
+    }
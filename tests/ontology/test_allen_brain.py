@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/ontology/allen_brain.py."""
+
+import sys
+
+import pandas as pd
+import pytest
+import ujson as json
+
+from deity.ontology.allen_brain import flatten_ontology_tree
+from deity.ontology.allen_brain import ontology_file_to_dataframe
+from deity.ontology.allen_brain import ontology_to_dataframe
+
+
+def deep_tree(depth: int) -> dict:
+    """Returns a chain of nested nodes deeper than the recursion limit."""
+    node = {"id": depth, "name": f"node {depth}"}
+    for idx in reversed(range(depth)):
+        node = {"id": idx, "name": f"node {idx}", "children": [node]}
+    return {"root": node}
+
+
+class TestFlattenOntology:
+    """Class for testing the iterative ontology flattener."""
+
+    def test_matches_recursive(self, nested_dict) -> None:
+        """Iterative flattener returns the same rows as the recursive version."""
+        expected = pd.DataFrame(flatten_ontology_tree(nested_dict["root"]))
+        result = ontology_to_dataframe(nested_dict)
+        pd.testing.assert_frame_equal(result[expected.columns], expected)
+
+    def test_parent_id(self, nested_dict) -> None:
+        """Parent ids are resolved even if the id follows the children."""
+        df = ontology_to_dataframe(nested_dict).set_index("id")
+        assert pd.isnull(df.loc[997, "parent_id"])
+        assert df.loc[313, "parent_id"] == 343
+        assert df.loc[343, "parent_id"] == 8
+
+    def test_deep_tree(self) -> None:
+        """Trees deeper than the recursion limit can be flattened."""
+        depth = sys.getrecursionlimit() + 100
+        df = ontology_to_dataframe(deep_tree(depth))
+        assert len(df) == depth + 1
+        assert df["parent_id"].iloc[-1] == depth - 1
+
+    @pytest.mark.parametrize("streaming", [True, False])
+    def test_stream_file(self, nested_dict, tmp_path, monkeypatch, streaming) -> None:
+        """Streaming from a file gives the same DataFrame as the loaded dict."""
+        if streaming:
+            pytest.importorskip("ijson")
+        else:
+            # without the streaming extra the file is loaded whole
+            monkeypatch.setitem(sys.modules, "ijson", None)
+        json_file = tmp_path.joinpath("ontology.json")
+        json_file.write_text(json.dumps(nested_dict))
+        pd.testing.assert_frame_equal(
+            ontology_file_to_dataframe(json_file), ontology_to_dataframe(nested_dict)
+        )
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/ontology/index.py."""
+
+import pandas as pd
+import pytest
+
+from deity.ontology.allen_brain import ontology_to_dataframe
+from deity.ontology.index import OntologyIndex
+
+
+@pytest.fixture()
+def index(nested_dict) -> OntologyIndex:
+    """Returns an index of the small nested ontology."""
+    return OntologyIndex.from_dataframe(ontology_to_dataframe(nested_dict))
+
+
+class TestOntologyIndex:
+    """Class for testing ontology index queries."""
+
+    def test_lookup(self, index) -> None:
+        """Nodes can be found by id, acronym or name, ignoring case."""
+        assert len(index) == 6
+        assert index.id("MB") == 313
+        assert index.id("midbrain") == 313
+        assert index.id(313) == 313
+        assert "CH" in index
+        assert "XYZ" not in index
+        with pytest.raises(KeyError):
+            index.id("XYZ")
+
+    def test_ancestors(self, index) -> None:
+        """Ancestor checks use the nested set intervals."""
+        assert index.is_ancestor("root", "MB")
+        assert index.is_ancestor("BS", "MB")
+        assert index.is_ancestor("MB", "MB")
+        assert not index.is_ancestor("CH", "MB")
+        assert not index.is_ancestor("MB", "BS")
+        assert index.ancestors("MB") == [343, 8, 997]
+
+    def test_descendants(self, index) -> None:
+        """Descendants are a contiguous slice of the pre-order."""
+        assert list(index.descendants("grey")) == [567, 343, 313]
+        assert list(index.descendants("BS", include_self=True)) == [343, 313]
+        assert index.num_descendants("root") == 5
+        assert index.num_descendants("MB") == 0
+
+    def test_lca_and_path(self, index) -> None:
+        """Lowest common ancestor and the path through it."""
+        assert index.lca("MB", "CH") == 8
+        assert index.lca("MB", "fiber tracts") == 997
+        assert index.lca("BS", "MB") == 343
+        assert index.lca("MB", "MB") == 313
+        assert index.path("MB", "CH") == [313, 343, 8, 567]
+
+    def test_forest(self) -> None:
+        """Nodes in separate trees have no common ancestor."""
+        df = pd.DataFrame({"id": [1, 2, 3], "parent_id": [None, 1, None]})
+        index = OntologyIndex.from_dataframe(df)
+        assert index.lca(2, 3) is None
+        with pytest.raises(ValueError):
+            index.path(2, 3)
+
+    def test_invalid(self) -> None:
+        """Cycles and duplicate ids are rejected."""
+        df = pd.DataFrame({"id": [1, 2, 3], "parent_id": [None, 3, 2]})
+        with pytest.raises(ValueError, match="cycle"):
+            OntologyIndex.from_dataframe(df)
+
+        df = pd.DataFrame({"id": [1, 2, 2], "parent_id": [None, 1, 1]})
+        with pytest.raises(ValueError, match=r"duplicate ids \[2\]"):
+            OntologyIndex.from_dataframe(df)
+
+    @pytest.mark.parametrize("name", ["index", "index.npz", "allen.v3"])
+    def test_save_load(self, index, tmp_path, name) -> None:
+        """A saved index answers the same queries after loading."""
+        file_path = index.save(tmp_path.joinpath(name))
+        assert list(tmp_path.iterdir()) == [file_path]
+        loaded = OntologyIndex.load(file_path)
+        assert loaded.lca("MB", "CH") == index.lca("MB", "CH")
+        assert list(loaded.descendants("grey")) == list(index.descendants("grey"))
+        assert loaded.id("midbrain") == 313
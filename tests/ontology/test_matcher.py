@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/ontology/matcher.py."""
+
+import pytest
+
+import deity
+from deity.ontology.allen_brain import ontology_to_dataframe
+from deity.ontology.matcher import RegionMatcher
+
+
+@pytest.fixture()
+def matcher(nested_dict) -> RegionMatcher:
+    """Returns a region matcher for the small nested ontology."""
+    return RegionMatcher.from_dataframe(ontology_to_dataframe(nested_dict))
+
+
+class TestRegionMatcher:
+    """Class for testing region name and acronym matching."""
+
+    @pytest.mark.parametrize(
+        "text, expected",
+        [
+            pytest.param("SHA-00-54321_A_MB_HE_01.svs", [313], id="acronym"),
+            pytest.param("SHA-00-54321_brain-stem_HE.svs", [343], id="name"),
+            pytest.param("SHA-00-54321_Brain_Stem_mb_HE.svs", [343, 313], id="multi"),
+            pytest.param("SHA-00-54321_MBX_HE.svs", [], id="partial-token"),
+            pytest.param("SHA-00-54321_fiber_tracts.svs", [1009], id="longest"),
+        ],
+    )
+    def test_find(self, matcher, text, expected) -> None:
+        """Whole-token names and acronyms are found in filename order."""
+        assert matcher.find(text) == expected
+
+    def test_match(self, matcher) -> None:
+        """Return the first region or None."""
+        assert matcher.match("CH_and_BS.png") == 567
+        assert matcher.match("no_region.png") is None
+
+    def test_encode_all(self, matcher, temp_dir, test_files) -> None:
+        """encode_all adds region columns when given a matcher."""
+        filepaths = [
+            f"{temp_dir}/{fname.replace('_', '_MB_', 1)}" for fname in test_files
+        ]
+        df = deity.encode_all(filepaths, region_matcher=matcher)
+        assert (df["region_id"] == 313).all()
+        assert (df["region"] == "MB").all()
+        assert "region_id" not in deity.encode_all(filepaths).columns
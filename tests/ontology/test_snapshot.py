@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/ontology/snapshot.py."""
+
+import pandas as pd
+import pytest
+import ujson as json
+
+from deity.encode import hash_file
+from deity.ontology.allen_brain import ontology_to_dataframe
+from deity.ontology.snapshot import load_ontology
+
+
+@pytest.fixture()
+def ontology_csv(nested_dict, tmp_path) -> str:
+    """Returns the path to a flattened ontology CSV."""
+    csv_file = tmp_path.joinpath("ontology.csv")
+    ontology_to_dataframe(nested_dict).to_csv(csv_file, index=False)
+    return csv_file
+
+
+class TestLoadOntology:
+    """Class for testing cached ontology snapshots."""
+
+    def test_csv(self, ontology_csv, tmp_path) -> None:
+        """Snapshot round-trips the CSV table."""
+        cache_dir = tmp_path.joinpath("cache")
+        expected = pd.read_csv(ontology_csv)
+        result = load_ontology(ontology_csv, cache_dir=cache_dir)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+        # snapshot is keyed on the md5 of the source
+        snapshot_dir = cache_dir.joinpath(f"ontology-{hash_file(ontology_csv)}")
+        assert snapshot_dir.joinpath("columns.json").exists()
+
+        # second load reads the snapshot
+        pd.testing.assert_frame_equal(
+            load_ontology(ontology_csv, cache_dir=cache_dir), result
+        )
+
+    def test_changed_source(self, ontology_csv, tmp_path) -> None:
+        """A modified source file creates a new snapshot."""
+        cache_dir = tmp_path.joinpath("cache")
+        load_ontology(ontology_csv, cache_dir=cache_dir)
+        df = pd.read_csv(ontology_csv).iloc[:2]
+        df.to_csv(ontology_csv, index=False)
+        assert len(load_ontology(ontology_csv, cache_dir=cache_dir)) == 2
+        assert len(list(cache_dir.iterdir())) == 2
+
+    def test_json(self, nested_dict, tmp_path) -> None:
+        """Nested JSON sources are flattened before caching."""
+        json_file = tmp_path.joinpath("ontology.json")
+        json_file.write_text(json.dumps(nested_dict))
+        result = load_ontology(json_file, cache_dir=tmp_path, categorical=True)
+        assert len(result) == 6
+        assert isinstance(result["acronym"].dtype, pd.CategoricalDtype)
+
+    def test_missing(self, tmp_path) -> None:
+        """Raise exception if the source does not exist."""
+        with pytest.raises(FileNotFoundError):
+            load_ontology(tmp_path.joinpath("missing.csv"), cache_dir=tmp_path)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/accessor.py."""
+
+import pandas as pd
+import pytest
+
+import deity.accessor  # noqa: F401
+from deity.encode import encode_series
+
+
+@pytest.fixture()
+def df(test_files) -> pd.DataFrame:
+    """Table of accession numbers, with one value lacking an identifier."""
+    return pd.DataFrame(
+        {"accession": [*test_files, "unknown"], "stain": "HE"},
+        index=range(5, 5 + len(test_files) + 1),
+    )
+
+
+def test_dataframe_encode(df) -> None:
+    """Hash columns are added to a copy of the frame."""
+    result = df.deity.encode("accession")
+    expected = encode_series(df["accession"])
+    assert "accession_short_hash" not in df.columns
+    assert result.columns.tolist() == [
+        "accession",
+        "stain",
+        "accession_short_hash",
+        "accession_full_hash",
+    ]
+    pd.testing.assert_series_equal(
+        result["accession_full_hash"], expected["full_hash"], check_names=False
+    )
+    assert result["accession_short_hash"].iloc[-1] is None
+
+
+def test_dataframe_encode_drop(df) -> None:
+    """The identifier column is dropped on request."""
+    result = df.deity.encode("accession", num_chars=8, drop=True)
+    assert "accession" not in result.columns
+    assert result["accession_short_hash"].str.len().iloc[0] == 8
+
+
+def test_dataframe_encode_missing_column(df) -> None:
+    """Raise exception if the column does not exist."""
+    with pytest.raises(KeyError):
+        df.deity.encode("mrn")
+
+
+def test_series_encode(df) -> None:
+    """The Series accessor returns the encode_series frame."""
+    pd.testing.assert_frame_equal(
+        df["accession"].deity.encode(), encode_series(df["accession"])
+    )
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/core.py."""
+
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from deity import database
+from deity.core import Encoder
+from deity.core import decode_files
+from deity.core import encode_paths
+from deity.core import encode_to_database
+from deity.core import sql_columns
+from deity.encode import encode_all
+from deity.encode import encode_single
+from deity.utils import create_df_sql
+
+
+@pytest.fixture()
+def file_list(temp_dir, test_files) -> list:
+    """Absolute paths of the test files, plus one without an identifier."""
+    unmatched = Path(temp_dir).joinpath("no_identifier.txt")
+    unmatched.touch()
+    return [str(Path(temp_dir).joinpath(elem)) for elem in test_files] + [
+        str(unmatched)
+    ]
+
+
+def test_encoder(file_list) -> None:
+    """Filenames are encoded like encode_single."""
+    encoder = Encoder()
+    for filepath in file_list:
+        identifier, new_filepath, full_hash, short_hash = encode_single(filepath)
+        result = encoder(Path(filepath).name)
+        assert result[:3] == (identifier, full_hash, short_hash)
+        if identifier is not None:
+            assert result[3] == Path(new_filepath).name
+
+
+def test_encode_paths(file_list) -> None:
+    """Rows hold the values of the encode_all database rows."""
+    df_sql = create_df_sql(encode_all(file_list), "specimens")[1]
+    expected = list(df_sql.itertuples(index=False, name=None))
+    assert list(encode_paths(file_list)) == expected
+
+
+def test_encode_to_database(file_list, tmp_path) -> None:
+    """The table and CSV match those written by create_update_sql."""
+    df_sql = create_df_sql(encode_all(file_list), "specimens")[1]
+    expected_file = tmp_path.joinpath("expected.db")
+    conn = database.create_connection(expected_file)
+    database.create_update_sql(df_sql, "specimens", conn, output_file=expected_file)
+
+    database_file = tmp_path.joinpath("deity.db")
+    renames = encode_to_database(
+        encode_paths(file_list),
+        "specimens",
+        database_file,
+        sql_columns("specimens"),
+        chunk_size=2,
+    )
+    assert renames == list(zip(df_sql["old_filepath"], df_sql["filepath"]))
+
+    query = "SELECT * FROM specimens ORDER BY id"
+    with sqlite3.connect(database_file) as conn, sqlite3.connect(expected_file) as ref:
+        pd.testing.assert_frame_equal(pd.read_sql(query, conn), pd.read_sql(query, ref))
+    csv = tmp_path.joinpath("deity.db_specimens.csv").read_text()
+    assert csv == tmp_path.joinpath("expected.db_specimens.csv").read_text()
+
+
+def test_encode_to_database_unmatched(tmp_path) -> None:
+    """Nothing is written if no file has an identifier."""
+    filepath = tmp_path.joinpath("no_identifier.txt")
+    filepath.touch()
+    database_file = tmp_path.joinpath("deity.db")
+    with pytest.raises(ValueError, match="No files were encoded"):
+        encode_to_database(
+            encode_paths([str(filepath)]),
+            "specimens",
+            database_file,
+            sql_columns("specimens"),
+        )
+    assert not database_file.exists()
+    assert not tmp_path.joinpath("deity.db_specimens.csv").exists()
+
+
+def test_decode_files(file_list, tmp_path) -> None:
+    """Decoding restores the original names."""
+    database_file = tmp_path.joinpath("deity.db")
+    renames = encode_to_database(
+        encode_paths(file_list), "specimens", database_file, sql_columns("specimens")
+    )
+    for old_filepath, new_filepath in renames:
+        Path(old_filepath).rename(new_filepath)
+
+    # a dry run only checks that the files exist
+    decode_files(database_file, dry_run=True)
+    assert all(Path(new).exists() for _, new in renames)
+
+    decode_files(database_file)
+    assert all(Path(elem).exists() for elem in file_list)
+
+
+def test_cli_without_pandas() -> None:
+    """The command line does not import pandas until a DataFrame is needed."""
+    code = "import sys, deity.__main__; print('pandas' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_cli_pandas_blocked(temp_dir, tmp_path, test_files, suffix_list) -> None:
+    """Files are encoded and decoded in place when pandas cannot be imported."""
+    code = (
+        "import sys; sys.modules['pandas'] = None; from deity.__main__ import cli; "
+        "cli(sys.argv[1:])"
+    )
+    args = [temp_dir, "--extension", ",".join(suffix_list), "--log-mode", "plain"]
+    database_file = Path(temp_dir).joinpath("deity.db")
+    for options in ([], ["--decode", "--database-file", str(database_file)]):
+        subprocess.run(  # noqa: S603
+            [sys.executable, "-c", code, *args, *options], cwd=tmp_path, check=True
+        )
+        encoded = not options
+        assert all(
+            Path(temp_dir).joinpath(elem).exists() != encoded for elem in test_files
+        )
+
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", code, *args, "--plan", str(tmp_path.joinpath("p.db"))],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 2
+    assert "deity[dataframes]" in result.stderr
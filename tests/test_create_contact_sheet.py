@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/create_contact_sheet.py."""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from PIL import Image
+
+from deity import create_contact_sheet
+from deity.create_contact_sheet import config_hash
+from deity.create_contact_sheet import load_config
+from deity.create_contact_sheet import load_template
+from deity.create_contact_sheet import prepare_labels
+from deity.create_contact_sheet import setup_df
+
+
+@pytest.fixture()
+def config_dict() -> dict:
+    """Returns the default contact sheet configuration."""
+    conf_dir = Path(create_contact_sheet.__file__).parent.joinpath("conf")
+    return load_config(conf_dir.joinpath("contact_sheet.yaml"))
+
+
+@pytest.fixture()
+def draw_calls(monkeypatch) -> list:
+    """Replace draw_label with a stub that records its calls."""
+    calls = []
+
+    def fake_draw_label(image, xy_coord, text, **kwargs):
+        calls.append(text)
+        return image
+
+    monkeypatch.setattr(create_contact_sheet, "_TEMPLATE_CACHE", {})
+    monkeypatch.setattr(create_contact_sheet, "draw_label", fake_draw_label)
+    return calls
+
+
+class TestTemplateCache:
+    """Class for testing the blank template cache."""
+
+    def test_config_hash(self, config_dict) -> None:
+        """Hash is stable and changes with the configuration."""
+        assert config_hash(config_dict) == config_hash(dict(config_dict))
+        assert config_hash(config_dict) != config_hash({**config_dict, "rows": 1})
+
+    def test_render_once(self, config_dict, draw_calls, tmp_path) -> None:
+        """Headers are drawn once and later sheets are independent copies."""
+        first = load_template(config_dict, cache_dir=tmp_path)
+        num_calls = len(draw_calls)
+        assert num_calls == config_dict["columns"] + 2 * config_dict["rows"]
+
+        second = load_template(config_dict, cache_dir=tmp_path)
+        assert len(draw_calls) == num_calls
+        assert first is not second
+        assert first.size == config_dict["page_size"]
+
+    def test_disk_cache(self, config_dict, draw_calls, tmp_path, monkeypatch) -> None:
+        """A template saved to disk is reused by a new process."""
+        load_template(config_dict, cache_dir=tmp_path)
+        assert len(list(tmp_path.glob("contact_sheet_*.png"))) == 1
+
+        monkeypatch.setattr(create_contact_sheet, "_TEMPLATE_CACHE", {})
+        draw_calls.clear()
+        template = load_template(config_dict, cache_dir=tmp_path)
+        assert draw_calls == []
+        assert template.mode == "RGB"
+
+    def test_truncated_cache(
+        self, config_dict, draw_calls, tmp_path, monkeypatch
+    ) -> None:
+        """A truncated template is rendered again and replaced."""
+        load_template(config_dict, cache_dir=tmp_path)
+        (template_file,) = tmp_path.glob("contact_sheet_*.png")
+        template_file.write_bytes(template_file.read_bytes()[:100])
+
+        monkeypatch.setattr(create_contact_sheet, "_TEMPLATE_CACHE", {})
+        draw_calls.clear()
+        template = load_template(config_dict, cache_dir=tmp_path)
+        assert draw_calls
+        assert template.size == config_dict["page_size"]
+        assert [elem.name for elem in tmp_path.iterdir()] == [template_file.name]
+        with Image.open(template_file) as img:
+            img.load()
+
+
+class TestPrepareLabels:
+    """Class for testing label table preparation."""
+
+    @pytest.fixture()
+    def df(self, test_files) -> pd.DataFrame:
+        """Returns a label csv with a separator row before each accession."""
+        rows = [
+            {"filename": "", "accession": "SHA-00-54321", "part": "", "stain": "HE"}
+        ]
+        rows.extend(
+            {"filename": name, "accession": "", "part": part, "stain": "HE"}
+            for name, part in zip(test_files, ["A", ""] * 10, strict=True)
+        )
+        df = pd.DataFrame(rows)
+        df["abbrev"] = "Hippocampus"
+        return setup_df(df)
+
+    def test_setup_df(self, df) -> None:
+        """Only rows with a filename receive a uuid."""
+        assert df.columns[0] == "uuid"
+        assert df["uuid"].isnull().sum() == 1
+        assert df["uuid"].dropna().is_unique
+
+    def test_labels(self, df, config_dict) -> None:
+        """Separators are dropped and every label has a position and text."""
+        df_out, labels = prepare_labels(df, config_dict, start=3)
+        assert len(df_out) == len(df) - 1
+        assert len(labels) == len(df)
+        assert labels["separator"].sum() == 1
+        assert labels.loc[0, "caption"].startswith("Starting\nSHA-00-54321\nA, HE")
+
+        regular = labels[~labels["separator"]]
+        assert (regular["qr_data"] == df_out["new_filename"]).all()
+        assert (regular["caption"] == ["Hipp A HE", "Hipp HE"] * 10).all()
+        assert (df_out["new_filename"] != df_out["filename"]).all()
+
+        # start offset shifts the first label to the fourth column
+        assert labels.loc[0, "x"] > labels["x"].min()
+
+    def test_no_encode(self, df, config_dict) -> None:
+        """QR codes contain the original names if encoding is disabled."""
+        df_out, labels = prepare_labels(df, config_dict, no_encode=True)
+        assert (df_out["new_filename"] == df_out["filename"]).all()
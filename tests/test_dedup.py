@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/dedup.py."""
+
+import os
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from deity import dedup
+from deity.__main__ import cli
+
+
+@pytest.fixture()
+def files(tmp_path) -> list:
+    """Two identical files, a file differing only in the middle, and others."""
+    size = 4 * dedup.BLOCK_SIZE
+    middle = bytearray(b"a" * size)
+    middle[size // 2] = ord("b")
+    contents = [b"a" * size, b"a" * size, bytes(middle), b"c" * 10, b"d" * size]
+    file_list = []
+    for idx, content in enumerate(contents):
+        file_path = tmp_path.joinpath(f"{idx}.bin")
+        file_path.write_bytes(content)
+        file_list.append(str(file_path))
+    return file_list
+
+
+def test_fingerprint_files(files, tmp_path) -> None:
+    """Only byte-identical files are duplicates, and only collisions are hashed."""
+    df = dedup.fingerprint_files(files, tmp_path.joinpath("fp.db"))
+
+    assert df["duplicate_of"].tolist() == [None, files[0], None, None, None]
+    # unique sizes are never read
+    assert df.loc[3, ["quick_hash", "full_hash"]].isna().all()
+    # same size, different first and last blocks: no full hash
+    assert pd.isna(df.loc[4, "full_hash"])
+    # same first and last blocks, but different contents
+    assert df.loc[2, "full_hash"] != df.loc[0, "full_hash"]
+
+
+def test_fingerprint_cache(files, tmp_path, monkeypatch) -> None:
+    """Unchanged files reuse cached hashes; modified files are hashed again."""
+    fingerprint_file = tmp_path.joinpath("fp.db")
+    dedup.fingerprint_files(files, fingerprint_file)
+
+    def fail(filepath):
+        raise AssertionError(f"{filepath} was hashed again")
+
+    monkeypatch.setattr(dedup, "hash_file", fail)
+    monkeypatch.setattr(dedup, "quick_hash", fail)
+    df = dedup.fingerprint_files(files, fingerprint_file)
+    assert df["duplicate_of"].notna().sum() == 1
+
+    Path(files[1]).write_bytes(b"e" * 4 * dedup.BLOCK_SIZE)
+    with pytest.raises(AssertionError, match="hashed again"):
+        dedup.fingerprint_files(files, fingerprint_file)
+
+
+def test_split_duplicates(files, tmp_path) -> None:
+    """Duplicates link to the new path of their first copy."""
+    fingerprints = dedup.fingerprint_files(files, tmp_path.joinpath("fp.db"))
+    df = pd.DataFrame(
+        {"old_filepath": map(Path, files), "new_filepath": [f"{x}.new" for x in files]}
+    )
+    df_export, df_links = dedup.split_duplicates(df, fingerprints)
+
+    assert len(df_export) == len(files) - 1
+    assert df_links["link_to"].tolist() == [f"{files[0]}.new"]
+    assert df_links["source_index"].tolist() == [0]
+
+
+@pytest.mark.parametrize("chunk_size", ["1", "10000"])
+@pytest.mark.parametrize(
+    "mode, export_mode",
+    [("skip", "copy"), ("hardlink", "copy"), ("hardlink", "checksum")],
+)
+def test_cli_dedup(runner, tmp_path, mode, export_mode, chunk_size) -> None:
+    """Duplicates are skipped, or exported as hardlinks to the first copy.
+
+    With one file per chunk, duplicates are linked to a copy from an earlier chunk.
+    """
+    input_dir = tmp_path.joinpath("input")
+    input_dir.mkdir()
+    for name in ["SHS-00-00001_a.txt", "SHS-00-00002_b.txt"]:
+        input_dir.joinpath(name).write_text("same contents")
+    input_dir.joinpath("SHS-00-00003_c.txt").write_text("other contents")
+    output_dir = tmp_path.joinpath("output")
+
+    result = runner.invoke(
+        cli,
+        [
+            str(input_dir),
+            "--extension",
+            "txt",
+            "--database-file",
+            str(tmp_path.joinpath("deity.db")),
+            "--export-mode",
+            export_mode,
+            "--output-dir",
+            str(output_dir),
+            "--dedup",
+            mode,
+            "--fingerprints",
+            str(tmp_path.joinpath("fp.db")),
+            "--chunk-size",
+            chunk_size,
+        ],
+    )
+    assert result.exit_code == 0, f"Error: {result.exception}"
+
+    exported = list(output_dir.iterdir())
+    inodes = {os.stat(elem).st_ino for elem in exported}
+    assert len(exported) == (2 if mode == "skip" else 3)
+    assert len(inodes) == 2
+    if export_mode == "checksum":
+        df = pd.read_csv(tmp_path.joinpath("deity.db_specimens.csv"))
+        checksums = df.sort_values("accession")["content_md5"].tolist()
+        assert checksums[0] == checksums[1] != checksums[2]
+
+
+def test_cli_dedup_again(runner, tmp_path) -> None:
+    """Exporting again into the same directory keeps the earlier exports and links."""
+    input_dir = tmp_path.joinpath("input")
+    input_dir.mkdir()
+    for name in ["SHS-00-00001_a.txt", "SHS-00-00002_b.txt"]:
+        input_dir.joinpath(name).write_text("same contents")
+    input_dir.joinpath("SHS-00-00003_c.txt").write_text("other contents")
+    output_dir = tmp_path.joinpath("output")
+    args = [str(input_dir), "--extension", "txt", "--output-dir", str(output_dir)]
+    args += ["--export-mode", "auto", "--dedup", "hardlink"]
+    args += ["--fingerprints", str(tmp_path.joinpath("fp.db"))]
+
+    for idx in range(2):
+        database_file = str(tmp_path.joinpath(f"deity_{idx}.db"))
+        result = runner.invoke(cli, [*args, "--database-file", database_file])
+        assert result.exit_code == 0, f"Error: {result.exception}"
+    assert len(list(output_dir.iterdir())) == 3
+
+
+@pytest.mark.parametrize("mode", ["skip", "hardlink"])
+def test_cli_dedup_rename(runner, tmp_path, mode) -> None:
+    """Deduplicating requires exporting, as skipped files would not be renamed."""
+    input_dir = tmp_path.joinpath("input")
+    input_dir.mkdir()
+    input_dir.joinpath("SHS-00-00001_a.txt").write_text("same contents")
+
+    result = runner.invoke(cli, [str(input_dir), "--extension", "txt", "--dedup", mode])
+    assert result.exit_code == 2
+    assert "requires --export-mode" in result.output
+    assert input_dir.joinpath("SHS-00-00001_a.txt").exists()
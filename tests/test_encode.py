@@ -1,13 +1,16 @@
 """Tests for src/deity/encode.py."""
+
 # sourcery skip: no-loop-in-tests
 import hashlib
 import re
 from pathlib import Path
 
 import numpy as np
+import pandas as pd
 import pytest
 
 import deity
+from deity.encode import encode_series
 
 
 @pytest.fixture()
@@ -135,3 +138,51 @@ class TestEncodeAll:
         for filename, _result, _error in test_input:
             with pytest.raises(TypeError):
                 deity.encode_all(filename)
+
+
+class TestEncodeBatch:
+    """Class for testing encode_batch module functions."""
+
+    def test_matches_encode_single(self, test_files):
+        """Batch encoding gives the same result as encoding one file at a time."""
+        filenames = [*test_files, "no_identifier.png"]
+        df = deity.encode_batch(filenames)
+        for fname, row in zip(filenames, df.itertuples(), strict=True):
+            identifier, new_filepath, full_hash, short_hash = deity.encode_single(fname)
+            assert row.identifier == identifier
+            assert row.new_filename == new_filepath.name
+            assert row.full_hash == full_hash
+            assert row.short_hash == short_hash
+
+    def test_input_fail(self, test_input):
+        """Raise exception if input is not a list."""
+        for filename, _result, _error in test_input:
+            with pytest.raises(TypeError):
+                deity.encode_batch(filename)
+
+
+class TestEncodeSeries:
+    """Class for testing encode_series module functions."""
+
+    def test_matches_encode(self, test_files):
+        """Each value is hashed as by encode, keeping the index."""
+        values = pd.Series([*test_files, "no identifier", None])
+        values.index += 10
+        df = encode_series(values)
+        assert df.index.equals(values.index)
+        for value, row in zip(values, df.itertuples(), strict=True):
+            identifier, _, full_hash, short_hash = deity.encode_single(str(value))
+            assert row.identifier == identifier
+            assert row.full_hash == full_hash
+            assert row.short_hash == short_hash
+
+    def test_duplicates(self):
+        """Repeated identifiers get the same hash."""
+        df = encode_series(pd.Series(["SP-20-00463", "x SP-20-00463 y"] * 3))
+        assert df["full_hash"].nunique() == 1
+        assert df["full_hash"][0] == "ed826c4697dcd22f2e0229286dac3200"
+
+    def test_input_fail(self, test_files):
+        """Raise exception if input is not a Series."""
+        with pytest.raises(TypeError):
+            encode_series(test_files)
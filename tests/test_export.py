@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/export.py."""
+
+import errno
+import os
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from deity import export
+from deity.__main__ import cli
+from deity.encode import hash_file
+from deity.records import EncodedRecords
+
+
+@pytest.fixture()
+def source_tree(tmp_path) -> Path:
+    """Nested input directory with a few small files."""
+    input_dir = tmp_path.joinpath("input")
+    for subdir in ["a", "a/b", "c"]:
+        input_dir.joinpath(subdir).mkdir(parents=True)
+        input_dir.joinpath(subdir, "file.txt").write_text(subdir)
+    return input_dir
+
+
+@pytest.mark.parametrize("mode", ["hardlink", "copy"])
+def test_exporter(tmp_path, mode) -> None:
+    """Files are exported without removing the source."""
+    src = tmp_path.joinpath("src.txt")
+    src.write_text("data")
+    dst = tmp_path.joinpath("dst.txt")
+
+    method = export.Exporter(mode)(src, dst)
+    assert dst.read_text() == "data"
+    assert src.exists()
+    assert (os.stat(src).st_ino == os.stat(dst).st_ino) == (method == "hardlink")
+
+
+def test_exporter_fallback(tmp_path, monkeypatch) -> None:
+    """Unsupported methods are skipped for the rest of the run."""
+    calls = []
+
+    def no_link(src, dst):
+        calls.append(src)
+        raise OSError(errno.EXDEV, "cross-device link")
+
+    monkeypatch.setitem(export.METHODS, "hardlink", no_link)
+    exporter = export.Exporter("auto")
+    for idx in range(3):
+        src = tmp_path.joinpath(f"{idx}.txt")
+        src.write_text(str(idx))
+        assert exporter(src, tmp_path.joinpath(f"{idx}.out")) != "hardlink"
+    assert len(calls) == 1
+
+
+def test_exporter_error(tmp_path) -> None:
+    """Errors other than unsupported methods are raised."""
+    with pytest.raises(FileNotFoundError):
+        export.Exporter("copy")(tmp_path.joinpath("missing"), tmp_path.joinpath("x"))
+
+
+def test_export_files(source_tree, tmp_path) -> None:
+    """The encoded tree mirrors the input directories."""
+    old = sorted(source_tree.rglob("*.txt"))
+    df = pd.DataFrame(
+        {"old_filepath": old, "new_filepath": [f"{idx}.txt" for idx in range(3)]}
+    )
+    output_dir = tmp_path.joinpath("output")
+    df = export.mirror_paths(df, source_tree, output_dir)
+    methods = export.export_files(df, mode="auto", workers=2)
+
+    assert len(methods) == 3
+    for old_filepath, new_filepath in zip(df["old_filepath"], df["new_filepath"]):
+        new_filepath = Path(new_filepath)
+        assert new_filepath.parent == output_dir.joinpath(
+            old_filepath.parent.relative_to(source_tree)
+        )
+        assert new_filepath.read_text() == old_filepath.read_text()
+
+
+@pytest.mark.parametrize("mode", ["hardlink", "copy"])
+def test_export_files_existing(source_tree, tmp_path, mode) -> None:
+    """Exporting again keeps matching targets and counts other targets as errors."""
+    old = sorted(source_tree.rglob("*.txt"))
+    df = pd.DataFrame(
+        {"old_filepath": old, "new_filepath": [f"{idx}.txt" for idx in range(3)]}
+    )
+    df = export.mirror_paths(df, source_tree, tmp_path.joinpath("output"))
+    export.export_files(df, mode=mode, workers=2)
+    conflict = Path(df["new_filepath"].iloc[0])
+    conflict.unlink()
+    conflict.write_text("other")
+
+    methods = export.export_files(df, mode=mode, workers=2)
+    assert methods == [None, "existing", "existing"]
+    assert conflict.read_text() == "other"
+
+
+def test_cli_export(runner, temp_dir, tmp_path, suffix_list, test_files) -> None:
+    """Export mode leaves the input files in place."""
+    output_dir = tmp_path.joinpath("output")
+    args = [temp_dir, "--extension", ",".join(suffix_list), "--export-mode", "copy"]
+
+    result = runner.invoke(cli, args)
+    assert result.exit_code != 0
+
+    result = runner.invoke(cli, [*args, "--output-dir", str(output_dir)])
+    assert result.exit_code == 0, f"Error: {result.exception}"
+    assert all(Path(temp_dir).joinpath(elem).exists() for elem in test_files)
+    assert len(list(output_dir.iterdir())) == len(test_files)
+
+
+def test_cli_export_chunks(
+    runner, temp_dir, tmp_path, suffix_list, test_files, monkeypatch
+) -> None:
+    """Records are converted to DataFrames a chunk at a time."""
+    sizes = []
+    to_dataframe = EncodedRecords.to_dataframe
+
+    def record_size(self, start=0, stop=None):
+        df = to_dataframe(self, start, stop)
+        sizes.append(len(df))
+        return df
+
+    monkeypatch.setattr(EncodedRecords, "to_dataframe", record_size)
+    database_file = tmp_path.joinpath("deity.db")
+    args = [temp_dir, "--extension", ",".join(suffix_list), "--export-mode", "copy"]
+    args += ["--output-dir", str(tmp_path.joinpath("output"))]
+    args += ["--database-file", str(database_file), "--chunk-size", "3"]
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, f"Error: {result.exception}"
+
+    assert max(sizes) == 3
+    with sqlite3.connect(database_file) as conn:
+        ids = [row[0] for row in conn.execute("SELECT id FROM specimens ORDER BY id")]
+    assert ids == list(range(len(test_files)))
+    csv_file = tmp_path.joinpath("deity.db_specimens.csv")
+    assert len(pd.read_csv(csv_file)) == len(test_files)
+
+
+def test_checksum_copy(tmp_path) -> None:
+    """The checksum of the copy matches a separate read of the source."""
+    src = tmp_path.joinpath("src.bin")
+    src.write_bytes(os.urandom(10_000))
+    dst = tmp_path.joinpath("dst.bin")
+
+    checksum = export.checksum_copy(src, dst, chunk_size=4096)
+    assert dst.read_bytes() == src.read_bytes()
+    assert checksum == hash_file(src)
+
+    # the buffer of the thread is reused
+    buffer = export._BUFFERS.buffer
+    export.checksum_copy(src, tmp_path.joinpath("dst2.bin"), chunk_size=4096)
+    assert export._BUFFERS.buffer is buffer
+
+
+def test_cli_checksum(runner, temp_dir, tmp_path, suffix_list, test_files) -> None:
+    """Checksum exports store the content hash of each copy in the database."""
+    output_dir = tmp_path.joinpath("output")
+    database_file = tmp_path.joinpath("deity.db")
+    result = runner.invoke(
+        cli,
+        [
+            temp_dir,
+            "--extension",
+            ",".join(suffix_list),
+            "--export-mode",
+            "checksum",
+            "--output-dir",
+            str(output_dir),
+            "--database-file",
+            str(database_file),
+        ],
+    )
+    assert result.exit_code == 0, f"Error: {result.exception}"
+
+    with sqlite3.connect(database_file) as conn:
+        df = pd.read_sql("SELECT filepath, content_md5 FROM specimens", conn)
+    assert len(df) == len(test_files)
+    assert all(
+        hash_file(filepath) == checksum
+        for filepath, checksum in zip(df["filepath"], df["content_md5"])
+    )
@@ -17,6 +17,7 @@ def current_version():
 def test_import():
     """Test imports."""
     import deity  # noqa: F401
+    from deity import Deidentifier  # noqa: F401
     from deity import encode  # noqa: F401
     from deity import encode_all  # noqa: F401
     from deity import encode_single  # noqa: F401
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/log.py."""
+
+import io
+import time
+
+import pytest
+from loguru import logger
+
+from deity import log
+from deity.__main__ import main
+
+
+@pytest.fixture()
+def restore_logging():
+    """Restore the default handlers after a test."""
+    yield
+    log.configure_logging()
+
+
+def warn(num: int) -> None:
+    for idx in range(num):
+        logger.warning(f"File {idx} not found")
+
+
+def test_aggregator() -> None:
+    """Warnings after max_repeats from the same line are counted, not logged."""
+    aggregator = log.WarningAggregator(max_repeats=2)
+    messages = []
+    handler_id = logger.add(messages.append, filter=aggregator, format="{message}")
+    try:
+        warn(5)
+        logger.info("info")
+        aggregator.log_summary()
+    finally:
+        logger.remove(handler_id)
+
+    assert [str(elem).strip() for elem in messages[:3]] == [
+        "File 0 not found",
+        "File 1 not found",
+        "info",
+    ]
+    assert "3 similar warning(s)" in messages[-1]
+    assert aggregator.counts == {}
+
+
+def test_aggregator_shared() -> None:
+    """A record is counted once when several handlers share the filter."""
+    aggregator = log.WarningAggregator(max_repeats=1)
+    first, second = [], []
+    ids = [logger.add(elem.append, filter=aggregator) for elem in (first, second)]
+    try:
+        warn(1)
+    finally:
+        for handler_id in ids:
+            logger.remove(handler_id)
+
+    assert len(first) == len(second) == 1
+    assert sum(aggregator.counts.values()) == 1
+
+
+def test_batched_stream() -> None:
+    """Messages are written once the batch is full or the sink stops."""
+    stream = io.StringIO()
+    batched = log.BatchedStream(stream, batch_size=3, flush_interval=60)
+    for idx in range(2):
+        batched.write(f"{idx}\n")
+        batched.flush()
+    assert stream.getvalue() == ""
+
+    batched.write("2\n")
+    batched.flush()
+    assert stream.getvalue() == "0\n1\n2\n"
+
+    batched.write("3\n")
+    batched.stop()
+    assert stream.getvalue().endswith("3\n")
+
+
+def test_batched_stream_timer() -> None:
+    """Buffered messages are written by the timer while no others arrive."""
+    stream = io.StringIO()
+    batched = log.BatchedStream(stream, batch_size=3, flush_interval=0.05)
+    batched.write("0\n")
+    deadline = time.monotonic() + 5
+    while not stream.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stream.getvalue() == "0\n"
+    batched.stop()
+
+
+def test_batched_stream_warning(restore_logging) -> None:
+    """Warnings are written at once."""
+    stream = io.StringIO()
+    batched = log.BatchedStream(stream, batch_size=3, flush_interval=60)
+    handler_id = logger.add(batched, format="{message}")
+    logger.info("info")
+    assert stream.getvalue() == ""
+    logger.warning("warning")
+    assert stream.getvalue() == "info\nwarning\n"
+    logger.remove(handler_id)
+
+
+@pytest.mark.parametrize("mode", ["plain", "async"])
+def test_configure_logging(restore_logging, tmp_path, mode) -> None:
+    """Plain and async modes write all messages to the log file."""
+    log_file = tmp_path.joinpath("deity.log")
+    log.configure_logging(mode, log_file=log_file, max_repeats=2)
+    warn(4)
+    log.shutdown_logging()
+
+    text = log_file.read_text()
+    assert text.count("not found") == 2
+    assert "2 similar warning(s)" in text
+
+
+def test_configure_logging_mode() -> None:
+    """Unknown modes are rejected."""
+    with pytest.raises(ValueError):
+        log.configure_logging("fancy")
+
+
+def test_main_log_mode(runner, temp_dir) -> None:
+    """The CLI accepts a log mode and restores the default handlers."""
+    result = runner.invoke(main, [temp_dir, "--dry-run", "--log-mode", "async"])
+    assert result.exit_code == 0, f"Error: {result.exception}"
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/pipeline.py."""
+
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from deity.__main__ import cli
+from deity.encode import encode_all
+from deity.pipeline import encode_chunk
+from deity.pipeline import run_pipeline
+from deity.pipeline import scan_dir
+
+
+@pytest.fixture()
+def nested_dir(temp_dir, test_files) -> Path:
+    """Move half of the test files into nested subdirectories."""
+    input_dir = Path(temp_dir)
+    subdir = input_dir.joinpath("a", "b")
+    subdir.mkdir(parents=True)
+    input_dir.joinpath(".hidden").mkdir()
+    for elem in test_files[::2]:
+        input_dir.joinpath(elem).rename(subdir.joinpath(elem))
+    return input_dir
+
+
+def test_scan_dir(nested_dir, suffix_list) -> None:
+    """Files with the extensions and visible subdirectories are returned."""
+    files, subdirs = scan_dir(str(nested_dir), tuple(f".{x}" for x in suffix_list))
+    assert [Path(elem).name for elem in subdirs] == ["a"]
+    assert all(Path(elem).suffix[1:] in suffix_list for elem in files)
+
+
+def test_encode_chunk(temp_dir, test_files) -> None:
+    """Batches are encoded like encode_all."""
+    file_list = [str(Path(temp_dir).joinpath(elem)) for elem in test_files]
+    expected = encode_all(file_list)
+    pd.testing.assert_frame_equal(encode_chunk(file_list), expected)
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 1000])
+def test_run_pipeline(nested_dir, tmp_path, test_files, suffix_list, batch_size):
+    """All files are written to the database and renamed."""
+    database_file = tmp_path.joinpath("deity.db")
+    stats = run_pipeline(
+        nested_dir,
+        database_file,
+        extension=",".join(suffix_list),
+        batch_size=batch_size,
+        encode_workers=2,
+        rename_workers=2,
+    )
+    assert stats == {
+        "files": len(test_files),
+        "rows": len(test_files),
+        "renamed": len(test_files),
+        "errors": 0,
+    }
+
+    with sqlite3.connect(database_file) as conn:
+        df = pd.read_sql("SELECT * FROM specimens", conn)
+    assert sorted(df["id"]) == list(range(len(test_files)))
+    assert df["filepath"].map(lambda x: Path(x).exists()).all()
+    assert not df["old_filepath"].map(lambda x: Path(x).exists()).any()
+
+    csv_file = tmp_path.joinpath("deity.db_specimens.csv")
+    assert len(pd.read_csv(csv_file)) == len(test_files)
+
+
+def test_run_pipeline_dry_run(nested_dir, tmp_path, test_files, suffix_list):
+    """Dry runs neither write a database nor rename files."""
+    database_file = tmp_path.joinpath("deity.db")
+    stats = run_pipeline(
+        nested_dir, database_file, extension=",".join(suffix_list), dry_run=True
+    )
+    assert stats["files"] == len(test_files)
+    assert not database_file.exists()
+    assert len(list(nested_dir.rglob("*"))) == len(test_files) + 3
+
+
+def test_run_pipeline_output_dir(nested_dir, tmp_path, test_files, suffix_list):
+    """output_dir is not walked, so files renamed into it are not encoded again."""
+    output_dir = nested_dir.joinpath("a", "output")
+    output_dir.mkdir()
+    skipped = output_dir.joinpath(test_files[1])
+    nested_dir.joinpath(test_files[1]).rename(skipped)
+    stats = run_pipeline(
+        nested_dir,
+        tmp_path.joinpath("deity.db"),
+        extension=",".join(suffix_list),
+        output_dir=output_dir,
+        batch_size=1,
+    )
+    assert stats["rows"] == stats["renamed"] == len(test_files) - 1
+    assert len(list(output_dir.iterdir())) == len(test_files)
+    assert skipped.exists()
+
+
+def test_run_pipeline_unmatched(nested_dir, tmp_path, test_files, suffix_list):
+    """Files without an identifier are not moved into output_dir."""
+    output_dir = tmp_path.joinpath("output")
+    output_dir.mkdir()
+    unmatched = nested_dir.joinpath(f"readme.{suffix_list[0]}")
+    unmatched.write_text("")
+    database_file = tmp_path.joinpath("deity.db")
+    run_pipeline(
+        nested_dir, database_file, extension=",".join(suffix_list), output_dir=output_dir
+    )
+    assert unmatched.exists()
+    assert len(list(output_dir.iterdir())) == len(test_files)
+    with sqlite3.connect(database_file) as conn:
+        parents = {
+            Path(row[0]).parent
+            for row in conn.execute("SELECT filepath FROM specimens")
+            if row[0] != str(unmatched)
+        }
+    assert parents == {output_dir}
+
+
+def test_run_pipeline_resume(nested_dir, tmp_path, test_files, suffix_list) -> None:
+    """Running again completes a run interrupted before all files were renamed."""
+    database_file = tmp_path.joinpath("deity.db")
+    extension = ",".join(suffix_list)
+    run_pipeline(nested_dir, database_file, extension=extension)
+
+    # undo the renames of the last rows, and the inserts of the very last ones
+    with sqlite3.connect(database_file) as conn:
+        rows = conn.execute(
+            "SELECT id, old_filepath, filepath FROM specimens ORDER BY id"
+        ).fetchall()
+        for _, old_filepath, filepath in rows[-4:]:
+            Path(filepath).rename(old_filepath)
+        conn.execute("DELETE FROM specimens WHERE id >= ?", (rows[-2][0],))
+
+    stats = run_pipeline(nested_dir, database_file, extension=extension)
+    assert stats["rows"] == 2
+    assert stats["renamed"] == 4
+
+    with sqlite3.connect(database_file) as conn:
+        df = pd.read_sql("SELECT * FROM specimens", conn)
+    assert sorted(df["id"]) == list(range(len(test_files)))
+    assert sorted(df["old_filepath"]) == sorted(row[1] for row in rows)
+    assert df["filepath"].map(lambda x: Path(x).exists()).all()
+    assert not df["old_filepath"].map(lambda x: Path(x).exists()).any()
+
+
+def test_cli_pipeline(runner, temp_dir, tmp_path, suffix_list, test_files) -> None:
+    """The CLI runs the pipeline and rejects unsupported combinations."""
+    args = [temp_dir, "--extension", ",".join(suffix_list), "--pipeline"]
+    database_file = tmp_path.joinpath("deity.db")
+
+    result = runner.invoke(cli, [*args, "--dedup", "skip"])
+    assert result.exit_code != 0
+
+    result = runner.invoke(cli, [*args, "--database-file", str(database_file)])
+    assert result.exit_code == 0, f"Error: {result.exception}"
+    assert not any(Path(temp_dir).joinpath(elem).exists() for elem in test_files)
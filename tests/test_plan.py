@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/plan.py."""
+
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from deity import plan as plan_module
+from deity.__main__ import cli
+from deity.encode import encode_all
+from deity.plan import apply_plan
+from deity.plan import claim_chunk
+from deity.plan import read_plan_meta
+from deity.plan import write_plan
+from deity.utils import create_df_sql
+from deity.utils import get_file_list
+
+
+@pytest.fixture()
+def plan(tmp_path, temp_dir, suffix_list) -> Path:
+    """Plan for the test files in chunks of 4."""
+    df = encode_all(get_file_list(Path(temp_dir), ",".join(suffix_list)))
+    df_file_rename, df_sql = create_df_sql(df, "specimens")
+    return write_plan(
+        tmp_path.joinpath("plan.db"),
+        df_file_rename,
+        df_sql,
+        "specimens",
+        tmp_path.joinpath("deity.db"),
+        chunk_size=4,
+    )
+
+
+def test_write_plan(plan, test_files) -> None:
+    """The plan records every file without renaming anything."""
+    meta = read_plan_meta(plan)
+    assert meta["num_files"] == len(test_files)
+    assert meta["num_chunks"] == (len(test_files) + 3) // 4
+    assert meta["applied"] == []
+
+    with sqlite3.connect(plan) as conn:
+        renames = pd.read_sql("SELECT * FROM renames", conn)
+    assert renames["old_filepath"].map(lambda x: Path(x).exists()).all()
+
+
+def test_apply_plan(plan, tmp_path) -> None:
+    """Chunks are applied once, and the CSV is written after the last chunk."""
+    database_file = tmp_path.joinpath("deity.db")
+    csv_file = tmp_path.joinpath("deity.db_specimens.csv")
+    meta = read_plan_meta(plan)
+
+    assert apply_plan(plan, chunks=[0]) == [0]
+    assert not csv_file.exists()
+    assert apply_plan(plan, chunks=[0]) == []
+
+    assert apply_plan(plan) == list(range(1, meta["num_chunks"]))
+    assert read_plan_meta(plan)["applied"] == list(range(meta["num_chunks"]))
+    assert csv_file.exists()
+
+    with sqlite3.connect(database_file) as conn:
+        df = pd.read_sql("SELECT * FROM specimens", conn)
+    assert sorted(df["id"]) == list(range(meta["num_files"]))
+    assert df["filepath"].map(lambda x: Path(x).exists()).all()
+    assert not df["old_filepath"].map(lambda x: Path(x).exists()).any()
+
+
+def read_ids(database_file: Path) -> list:
+    """Ids of the mapping table in database_file, in order."""
+    with sqlite3.connect(database_file) as conn:
+        return [row[0] for row in conn.execute("SELECT id FROM specimens ORDER BY id")]
+
+
+def test_apply_plan_retry(plan, tmp_path, monkeypatch) -> None:
+    """Chunks that failed part-way are applied again without duplicating rows."""
+    database_file = tmp_path.joinpath("deity.db")
+    meta = read_plan_meta(plan)
+    rename = plan_module.os.rename
+    calls = []
+
+    def fail_last(old_filepath, new_filepath) -> None:
+        # the last file of the chunk fails, after the others were renamed
+        calls.append(old_filepath)
+        if len(calls) == 4:
+            raise PermissionError(13, "Permission denied", old_filepath)
+        rename(old_filepath, new_filepath)
+
+    monkeypatch.setattr(plan_module.os, "rename", fail_last)
+    with pytest.raises(OSError):
+        apply_plan(plan, chunks=[0])
+    assert read_plan_meta(plan)["applied"] == []
+    assert not database_file.exists() or read_ids(database_file) == []
+
+    def fail_record(*args) -> None:
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(plan_module.os, "rename", rename)
+    with monkeypatch.context() as m:
+        m.setattr(plan_module, "record_chunk", fail_record)
+        with pytest.raises(sqlite3.OperationalError):
+            apply_plan(plan, chunks=[0])
+
+    assert apply_plan(plan) == list(range(meta["num_chunks"]))
+    assert read_ids(database_file) == list(range(meta["num_files"]))
+
+
+def test_apply_plan_claimed(plan, tmp_path) -> None:
+    """Chunks claimed by another run are skipped until the claim expires."""
+    conn = sqlite3.connect(plan)
+    assert claim_chunk(conn, 0, lease=60)
+    assert not claim_chunk(conn, 0, lease=60)
+    conn.close()
+
+    num_chunks = read_plan_meta(plan)["num_chunks"]
+    assert apply_plan(plan) == list(range(1, num_chunks))
+    assert read_plan_meta(plan)["applied"] == list(range(1, num_chunks))
+    assert apply_plan(plan, lease=0) == [0]
+    assert read_ids(tmp_path.joinpath("deity.db")) == list(
+        range(read_plan_meta(plan)["num_files"])
+    )
+
+
+def test_apply_plan_existing_rows(plan, tmp_path, temp_dir) -> None:
+    """Plans are not applied to a table holding other rows, and no file is renamed."""
+    database_file = tmp_path.joinpath("deity.db")
+    with sqlite3.connect(database_file) as conn:
+        conn.execute("CREATE TABLE specimens (id INTEGER, old_filepath TEXT)")
+        conn.execute("INSERT INTO specimens VALUES (0, '/data/other.txt')")
+    files = sorted(Path(temp_dir).iterdir())
+
+    with pytest.raises(FileExistsError, match="1 row"):
+        apply_plan(plan)
+    assert sorted(Path(temp_dir).iterdir()) == files
+    assert read_plan_meta(plan)["applied"] == []
+
+    df_file_rename, df_sql = create_df_sql(encode_all([str(files[0])]), "specimens")
+    with pytest.raises(FileExistsError):
+        write_plan(plan, df_file_rename, df_sql, "specimens", database_file)
+
+
+def test_apply_plan_taken_ids(plan, tmp_path) -> None:
+    """A chunk whose ids were taken by other files is not marked applied."""
+    database_file = tmp_path.joinpath("deity.db")
+    assert apply_plan(plan, chunks=[0]) == [0]
+    with sqlite3.connect(database_file) as conn:
+        conn.execute("INSERT INTO specimens (id, old_filepath) VALUES (4, '/other')")
+
+    conn = sqlite3.connect(plan)
+    assert claim_chunk(conn, 1, lease=60)
+    conn.close()
+    with pytest.raises(ValueError, match="chunk 1"):
+        plan_module.record_chunk(plan, 1, "specimens", database_file)
+    assert read_ids(database_file) == [0, 1, 2, 3, 4]
+    assert read_plan_meta(plan)["applied"] == [0]
+
+
+def test_apply_plan_invalid_chunk(plan) -> None:
+    """Chunks outside the plan are rejected."""
+    with pytest.raises(ValueError):
+        apply_plan(plan, chunks=[100])
+
+
+def test_cli_plan_apply(runner, temp_dir, tmp_path, suffix_list, test_files) -> None:
+    """The default command writes a plan that the apply command executes."""
+    plan_file = tmp_path.joinpath("plan.db")
+    database_file = tmp_path.joinpath("deity.db")
+    result = runner.invoke(
+        cli,
+        [
+            temp_dir,
+            "--extension",
+            ",".join(suffix_list),
+            "--database-file",
+            str(database_file),
+            "--plan",
+            str(plan_file),
+            "--chunk-size",
+            "5",
+        ],
+    )
+    assert result.exit_code == 0, f"Error: {result.exception}"
+    assert not database_file.exists()
+    assert all(Path(temp_dir).joinpath(elem).exists() for elem in test_files)
+
+    result = runner.invoke(cli, ["apply", str(plan_file), "--workers", "2"])
+    assert result.exit_code == 0, f"Error: {result.exception}"
+    assert database_file.exists()
+    assert not any(Path(temp_dir).joinpath(elem).exists() for elem in test_files)
+
+
+def test_cli_plan_existing(runner, temp_dir, tmp_path, suffix_list) -> None:
+    """Plans are refused for a directory that was already encoded."""
+    args = [temp_dir, "--extension", ",".join(suffix_list)]
+    assert runner.invoke(cli, args).exit_code == 0
+    files = sorted(Path(temp_dir).iterdir())
+
+    plan_file = tmp_path.joinpath("plan.db")
+    result = runner.invoke(cli, [*args, "--plan", str(plan_file)])
+    assert isinstance(result.exception, FileExistsError)
+    assert not plan_file.exists()
+    assert sorted(Path(temp_dir).iterdir()) == files
+
+
+@pytest.mark.parametrize(
+    "options",
+    [["--export-mode", "copy"], ["--export-mode", "copy", "--dedup", "hardlink"]],
+)
+def test_cli_plan_export(runner, temp_dir, tmp_path, suffix_list, options) -> None:
+    """Plans are rejected with exports, which apply would turn into renames."""
+    plan_file = tmp_path.joinpath("plan.db")
+    result = runner.invoke(
+        cli,
+        [
+            temp_dir,
+            "--extension",
+            ",".join(suffix_list),
+            "--plan",
+            str(plan_file),
+            "--output-dir",
+            str(tmp_path),
+            *options,
+        ],
+    )
+    assert result.exit_code == 2
+    assert "--plan cannot be combined" in result.output
+    assert not plan_file.exists()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/profiling.py."""
+import pstats
+
+import pytest
+import ujson as json
+
+from deity import profiling
+from deity.__main__ import main
+
+
+@pytest.fixture()
+def enabled():
+    """Enable profiling for a test and reset it afterwards."""
+    profiling.reset()
+    profiling.enable()
+    yield
+    profiling.disable()
+    profiling.reset()
+
+
+def test_disabled() -> None:
+    """Timers and counters are no-ops when disabled."""
+    assert not profiling.is_enabled()
+    with profiling.timer("stage"):
+        profiling.count("files")
+    assert profiling.summary() == {"timers": {}, "counters": {}}
+
+
+def test_enabled(enabled) -> None:
+    """Timers accumulate time and calls, counters accumulate values."""
+    for _ in range(3):
+        with profiling.timer("stage"):
+            profiling.count("files", 2)
+
+    stats = profiling.summary()
+    assert stats["timers"]["stage"]["calls"] == 3
+    assert stats["timers"]["stage"]["seconds"] >= 0
+    assert stats["counters"]["files"] == 6
+
+
+def test_main_profile(runner, temp_dir, tmp_path, test_files) -> None:
+    """The --profile option saves the stage timings and cProfile stats."""
+    prefix = tmp_path.joinpath("profile", "run")
+    result = runner.invoke(main, [temp_dir, "--dry-run", "--profile", str(prefix)])
+    assert result.exit_code == 0, f"Error: {result.exception}"
+
+    stats = json.loads(prefix.with_suffix(".json").read_text())
+    assert {"walk", "encode", "encode.paths"} <= set(stats["timers"])
+    assert stats["counters"]["files.found"] > 0
+    assert pstats.Stats(str(prefix.with_suffix(".prof"))).total_calls > 0
+    assert not profiling.is_enabled()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/progress.py."""
+
+import pytest
+import ujson as json
+
+from deity import progress
+from deity.__main__ import main
+
+
+@pytest.fixture()
+def events_file(tmp_path):
+    """Send progress events to a JSON lines file for a test."""
+    events_file = tmp_path.joinpath("events.jsonl")
+    progress.configure(events_file, interval=0)
+    yield events_file
+    progress.disable()
+
+
+def read_events(events_file) -> list:
+    return [json.loads(line) for line in events_file.read_text().splitlines()]
+
+
+def test_disabled(tmp_path) -> None:
+    """No events are written unless configured."""
+    assert not progress.is_enabled()
+    with progress.track("stage", total=2) as tracker:
+        tracker.update(2)
+    assert tracker.done == 2
+
+
+def test_jsonl(events_file) -> None:
+    """Events include counts, throughput and ETA."""
+    with progress.track("encode", total=4) as tracker:
+        tracker.update(2, nbytes=10)
+        tracker.update(errors=1)
+
+    events = read_events(events_file)
+    assert [elem["event"] for elem in events] == [
+        "start",
+        "progress",
+        "progress",
+        "end",
+    ]
+    assert events[-1]["done"] == 3
+    assert events[-1]["bytes"] == 10
+    assert events[-1]["errors"] == 1
+    assert events[1]["eta_s"] is not None
+
+
+def test_rate_limit(tmp_path) -> None:
+    """Progress events are emitted at most once per interval."""
+    events_file = tmp_path.joinpath("events.jsonl")
+    progress.configure(events_file, interval=60)
+    try:
+        with progress.track("encode", total=1000) as tracker:
+            for _ in range(1000):
+                tracker.update()
+    finally:
+        progress.disable()
+
+    assert [elem["event"] for elem in read_events(events_file)] == ["start", "end"]
+
+
+def test_prometheus(tmp_path) -> None:
+    """Prometheus textfile holds the latest metrics of each stage."""
+    prom_file = tmp_path.joinpath("deity.prom")
+    progress.configure(prom_file, fmt="prometheus", interval=0)
+    try:
+        with progress.track("walk") as tracker:
+            tracker.update(5)
+        with progress.track("encode", total=5) as tracker:
+            tracker.update(3)
+    finally:
+        progress.disable()
+
+    text = prom_file.read_text()
+    assert 'deity_files_total{stage="walk"} 5' in text
+    assert 'deity_files_total{stage="encode"} 3' in text
+    assert "# TYPE deity_eta_seconds gauge" in text
+
+
+def test_main_progress(runner, temp_dir, tmp_path) -> None:
+    """The CLI reports the walk and encode stages."""
+    events_file = tmp_path.joinpath("events.jsonl")
+    result = runner.invoke(
+        main, [temp_dir, "--dry-run", "--progress-file", str(events_file)]
+    )
+    assert result.exit_code == 0, f"Error: {result.exception}"
+    stages = {elem["stage"] for elem in read_events(events_file)}
+    assert {"walk", "encode"} <= stages
+    assert not progress.is_enabled()
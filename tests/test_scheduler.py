@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/scheduler.py."""
+
+import time
+
+import pytest
+
+from deity import scheduler
+from deity.scheduler import AIMD
+from deity.scheduler import IOScheduler
+from deity.scheduler import RateLimiter
+from deity.scheduler import io_map
+
+
+@pytest.fixture()
+def budget():
+    """Restore the default budget after the test."""
+    yield scheduler
+    scheduler.disable()
+
+
+def test_rate_limiter() -> None:
+    """Units beyond the burst are paid for by sleeping."""
+    limiter = RateLimiter(100, burst=1)
+    assert limiter.acquire() == 0
+    assert limiter.acquire(5) == pytest.approx(0.05, abs=0.02)
+
+
+def test_rate_limiter_error() -> None:
+    """Raise exception if the rate is not positive."""
+    with pytest.raises(ValueError):
+        RateLimiter(0)
+
+
+def test_aimd() -> None:
+    """The limit grows while latency is steady and halves when it rises."""
+    controller = AIMD(max_limit=4)
+    for _ in range(20):
+        controller.update(0.01)
+    assert controller.limit == 4
+
+    while controller.limit == 4:
+        controller.update(1.0)
+    assert controller.limit == 2
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+def test_map(chunk_size) -> None:
+    """Results are yielded in order, as by the builtin map."""
+    items = list(range(50))
+    result = IOScheduler(4, chunk_size=chunk_size).map(pow, items, [2] * len(items))
+    assert list(result) == [elem**2 for elem in items]
+
+
+def test_map_error() -> None:
+    """No item starts after an exception, which is raised in order."""
+    started = []
+
+    def func(elem: int) -> int:
+        started.append(elem)
+        if elem == 3:
+            raise OSError("failed")
+        return elem
+
+    results = []
+    with pytest.raises(OSError):
+        for elem in io_map(func, range(10), max_workers=1):
+            results.append(elem)
+    assert results == [0, 1, 2]
+    assert started == [0, 1, 2, 3]
+
+
+def test_ops_budget(budget) -> None:
+    """Operations beyond the budget are delayed."""
+    budget.configure(ops_per_s=40)
+    start = time.monotonic()
+    assert len(list(io_map(abs, range(50)))) == 50
+    assert time.monotonic() - start >= 0.2
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/session.py."""
+
+import multiprocessing
+import os
+import pickle
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from deity import Deidentifier
+from deity.core import encode_paths
+
+
+@pytest.fixture()
+def file_list(temp_dir, test_files) -> list:
+    """Paths of the test files, plus one without an identifier."""
+    unmatched = Path(temp_dir).joinpath("no_identifier.txt")
+    unmatched.touch()
+    return [str(Path(temp_dir).joinpath(elem)) for elem in test_files] + [
+        str(unmatched)
+    ]
+
+
+def read_table(database_file: Path) -> list:
+    with sqlite3.connect(database_file) as conn:
+        return conn.execute("SELECT * FROM specimens ORDER BY id").fetchall()
+
+
+def test_encode(file_list) -> None:
+    """Rows match those of encode_paths."""
+    deidentifier = Deidentifier()
+    assert deidentifier.encode_batch(file_list) == list(encode_paths(file_list))
+    assert deidentifier.encode(file_list[0]) == next(encode_paths(file_list[:1]))
+    assert deidentifier.commit() == 0
+
+
+def test_commit_lookup(file_list, tmp_path) -> None:
+    """Matched rows are inserted on commit and their hashes can be looked up."""
+    database_file = tmp_path.joinpath("deity.db")
+    with Deidentifier(database_file) as deidentifier:
+        rows = deidentifier.encode_batch(file_list)
+        assert deidentifier.commit() == len(file_list) - 1
+        deidentifier.encode(file_list[0])
+
+    table = read_table(database_file)
+    assert [row[0] for row in table] == list(range(len(file_list)))
+    assert [row[1:] for row in table] == rows[:-1] + rows[:1]
+
+    identifier, short_hash, full_hash, *_ = rows[0]
+    deidentifier = Deidentifier(database_file)
+    assert deidentifier.lookup(short_hash) == identifier
+    assert deidentifier.lookup(full_hash) == identifier
+    assert deidentifier.lookup("0" * 16) is None
+    deidentifier.close()
+
+
+def test_threads(file_list, tmp_path) -> None:
+    """Rows encoded by several threads are committed once each."""
+    database_file = tmp_path.joinpath("deity.db")
+    deidentifier = Deidentifier(database_file)
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(deidentifier.encode, file_list * 10))
+        commits = list(executor.map(lambda _: deidentifier.commit(), range(4)))
+    deidentifier.close()
+
+    assert sum(commits) == 10 * (len(file_list) - 1)
+    assert [row[0] for row in read_table(database_file)] == list(range(sum(commits)))
+
+
+def test_pickle(file_list, tmp_path) -> None:
+    """Copies keep the cache but not the connection or uncommitted rows."""
+    database_file = tmp_path.joinpath("deity.db")
+    deidentifier = Deidentifier(database_file)
+    identifier, short_hash, *_ = deidentifier.encode(file_list[0])
+    deidentifier.lookup(short_hash)
+
+    copy = pickle.loads(pickle.dumps(deidentifier))
+    assert copy.conn is None
+    assert copy.lookup(short_hash) == identifier
+    assert copy.commit() == 0
+    copy.encode(file_list[1])
+    assert copy.commit() == 1
+    assert deidentifier.commit() == 1
+    deidentifier.close()
+    copy.close()
+    assert len(read_table(database_file)) == 2
+
+
+def commit_copy(deidentifier: Deidentifier, file_list: list) -> int:
+    """Encode and commit file_list in a worker process."""
+    total = 0
+    for _ in range(20):
+        deidentifier.encode_batch(file_list)
+        total += deidentifier.commit()
+    deidentifier.close()
+    return total
+
+
+def test_processes(file_list, tmp_path) -> None:
+    """Processes sharing a table insert distinct ids."""
+    database_file = tmp_path.joinpath("deity.db")
+    deidentifier = Deidentifier(database_file)
+    with ProcessPoolExecutor(4) as executor:
+        futures = [
+            executor.submit(commit_copy, deidentifier, file_list) for _ in range(4)
+        ]
+        total = sum(future.result() for future in futures)
+
+    assert total == 4 * 20 * (len(file_list) - 1)
+    assert [row[0] for row in read_table(database_file)] == list(range(total))
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_fork(file_list, tmp_path) -> None:
+    """A forked child does not commit the rows of its parent."""
+    database_file = tmp_path.joinpath("deity.db")
+    deidentifier = Deidentifier(database_file)
+    deidentifier.encode(file_list[0])
+
+    process = multiprocessing.get_context("fork").Process(
+        target=commit_copy, args=(deidentifier, file_list[1:2])
+    )
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+    assert deidentifier.commit() == 1
+    deidentifier.close()
+    assert len(read_table(database_file)) == 21
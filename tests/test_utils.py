@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 """test_utils.py in tests."""
+
 # sourcery skip: no-loop-in-tests
 import random
 from pathlib import Path
 from typing import List
 
 import pandas as pd
+import pytest
 
 from deity.utils import find_existing_file
 from deity.utils import get_file_list
 from deity.utils import rename_files
+from deity.utils import select_shard
 
 
 def test_get_file_list(
@@ -30,6 +33,21 @@ def test_get_file_list(
     assert sorted(result) == sorted(expected)
 
 
+def test_get_file_list_nested(tmp_path: Path):
+    """Files in subdirectories are found; hidden entries are skipped."""
+    tmp_path.joinpath("a", "b").mkdir(parents=True)
+    tmp_path.joinpath(".hidden").mkdir()
+    for name in ["x.txt", "a/y.txt", "a/b/z.txt", "a/b/z.png", ".hidden/h.txt"]:
+        tmp_path.joinpath(name).write_text("")
+
+    result = get_file_list(tmp_path, extension="txt,.jpg")
+    assert sorted(Path(elem).relative_to(tmp_path).as_posix() for elem in result) == [
+        "a/b/z.txt",
+        "a/y.txt",
+        "x.txt",
+    ]
+
+
 def test_rename_files(temp_dir: str, test_files: str):
     input_dir = Path(temp_dir)
 
@@ -92,3 +110,24 @@ def test_find_existing_file(
             find_existing_file(non_existent_file, ",".join(suffix_list))
             == non_existent_file
         )
+
+
+@pytest.mark.parametrize("by", ["dir", "subdir", "path"])
+def test_select_shard(tmp_path: Path, by: str):
+    file_list = [
+        tmp_path.joinpath(f"dir_{idx % 5}", f"file_{idx}.txt").as_posix()
+        for idx in range(50)
+    ]
+    shards = [select_shard(file_list, tmp_path, (idx, 3), by=by) for idx in range(3)]
+
+    # every file is in exactly one shard
+    assert sorted(sum(shards, [])) == sorted(file_list)
+    if by != "path":
+        for shard in shards:
+            dirs = {Path(elem).parent.name for elem in shard}
+            assert all(
+                Path(elem).parent.name not in dirs
+                for other in shards
+                if other is not shard
+                for elem in other
+            )
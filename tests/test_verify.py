@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/verify.py."""
+
+import csv
+from pathlib import Path
+
+import pytest
+
+from deity.__main__ import cli
+from deity.core import encode_paths
+from deity.core import encode_to_database
+from deity.core import sql_columns
+from deity.verify import merge_sorted
+from deity.verify import verify_tree
+
+
+@pytest.fixture()
+def encoded_dir(temp_dir) -> Path:
+    """Directory of encoded files, with the database stored next to them."""
+    input_dir = Path(temp_dir)
+    file_list = [str(elem) for elem in input_dir.iterdir()]
+    renames = encode_to_database(
+        encode_paths(file_list),
+        "specimens",
+        input_dir.joinpath("deity.db"),
+        sql_columns("specimens"),
+    )
+    for old_filepath, new_filepath in renames:
+        Path(old_filepath).rename(new_filepath)
+    return input_dir
+
+
+def test_merge_sorted() -> None:
+    """Each path is yielded once with the sides it is on."""
+    assert list(merge_sorted(["a", "c", "d"], ["b", "c", "e"])) == [
+        ("a", True, False),
+        ("b", False, True),
+        ("c", True, True),
+        ("d", True, False),
+        ("e", False, True),
+    ]
+
+
+def test_verify_tree(encoded_dir, suffix_list, tmp_path) -> None:
+    """Missing, identifiable and orphan files are counted and reported."""
+    database_file = encoded_dir.joinpath("deity.db")
+    extension = ",".join(suffix_list)
+    assert not any(
+        verify_tree(encoded_dir, database_file, extension=extension).values()
+    )
+
+    next(x for x in encoded_dir.iterdir() if x.suffix[1:] in suffix_list).unlink()
+    encoded_dir.joinpath("sub").mkdir()
+    encoded_dir.joinpath("sub", f"SP-20-00999.{suffix_list[0]}").write_text("")
+    encoded_dir.joinpath(f"notes.{suffix_list[0]}").write_text("")
+
+    report = tmp_path.joinpath("report.csv")
+    counts = verify_tree(encoded_dir, database_file, extension=extension, report=report)
+    assert counts == {"missing": 1, "identifiable": 1, "orphan": 1}
+    with open(report, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row["status"] for row in rows) == [
+        "identifiable",
+        "missing",
+        "orphan",
+    ]
+
+
+def test_verify_tree_extension(encoded_dir, suffix_list) -> None:
+    """Rows with other extensions than those verified are not missing."""
+    database_file = encoded_dir.joinpath("deity.db")
+    extension = suffix_list[0]
+    counts = verify_tree(encoded_dir, database_file, extension=extension)
+    assert not any(counts.values())
+
+
+def test_verify_tree_no_database(tmp_path) -> None:
+    """Raise exception if the database does not exist."""
+    with pytest.raises(FileNotFoundError):
+        verify_tree(tmp_path, tmp_path.joinpath("deity.db"))
+
+
+def test_cli(runner, encoded_dir, suffix_list) -> None:
+    """The exit status is 1 once a file is missing."""
+    args = ["verify", str(encoded_dir), "--extension", ",".join(suffix_list)]
+    assert runner.invoke(cli, args).exit_code == 0
+
+    next(x for x in encoded_dir.iterdir() if x.suffix[1:] in suffix_list).unlink()
+    assert runner.invoke(cli, args).exit_code == 1
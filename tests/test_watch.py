@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Tests for src/deity/watch.py."""
+
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+from deity.core import decode_files
+from deity.watch import IN_CLOSE_WRITE
+from deity.watch import Inotify
+from deity.watch import Watcher
+
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is Linux only"
+)
+
+
+@pytest.fixture()
+def input_dir(tmp_path) -> Path:
+    """Directory with one file to encode and one without an identifier."""
+    input_dir = tmp_path.joinpath("input")
+    input_dir.mkdir()
+    input_dir.joinpath("SP-20-00463_part-A.txt").write_text("")
+    input_dir.joinpath("notes.txt").write_text("")
+    return input_dir
+
+
+def read_table(database_file: Path) -> list:
+    with sqlite3.connect(database_file) as conn:
+        return conn.execute(
+            "SELECT id, accession, old_filepath, filepath FROM specimens ORDER BY id"
+        ).fetchall()
+
+
+def test_inotify(tmp_path) -> None:
+    """Closing a written file is reported with its name."""
+    with Inotify() as inotify:
+        inotify.add_watch(tmp_path)
+        tmp_path.joinpath("a.txt").write_text("a")
+        events = inotify.read(timeout=1.0)
+    assert any(mask & IN_CLOSE_WRITE and name == "a.txt" for _, mask, name in events)
+
+
+def test_inotify_missing_dir(tmp_path) -> None:
+    """Watching a missing directory raises OSError."""
+    with Inotify() as inotify, pytest.raises(OSError):
+        inotify.add_watch(tmp_path.joinpath("missing"))
+
+
+def test_catch_up(input_dir, tmp_path) -> None:
+    """Files present at startup are encoded when the watcher stops."""
+    database_file = tmp_path.joinpath("deity.db")
+    stop = threading.Event()
+    stop.set()
+    stats = Watcher(input_dir, database_file, extension="txt").run(stop)
+
+    assert stats["encoded"] == stats["renamed"] == 1
+    rows = read_table(database_file)
+    assert [row[:2] for row in rows] == [(0, "SP-20-00463")]
+    assert Path(rows[0][3]).exists()
+    assert input_dir.joinpath("notes.txt").exists()
+    assert tmp_path.joinpath("deity.db_specimens.csv").read_text().count("\n") == 2
+
+    # encoded files are not encoded again on restart
+    stats = Watcher(input_dir, database_file, extension="txt").run(stop)
+    assert stats["encoded"] == 0
+    assert len(read_table(database_file)) == 1
+
+
+def test_watch(input_dir, tmp_path) -> None:
+    """Files written after startup are encoded and appended in batches."""
+    database_file = tmp_path.joinpath("deity.db")
+    watcher = Watcher(input_dir, database_file, extension="txt", debounce=0)
+    watcher.start()
+    try:
+        assert watcher.step(timeout=0) == 1
+
+        # a new directory is watched and its files are found
+        subdir = input_dir.joinpath("scanner")
+        subdir.mkdir()
+        subdir.joinpath("SP-20-00464_part-A.txt").write_text("")
+        input_dir.joinpath("SP-20-00465_part-A.txt").write_text("")
+        input_dir.joinpath("SP-20-00466_part-A.jpg").write_text("")
+        encoded = sum(watcher.step(timeout=0.2) for _ in range(10))
+    finally:
+        watcher.close()
+
+    assert encoded == 2
+    rows = read_table(database_file)
+    assert [row[0] for row in rows] == [0, 1, 2]
+    assert {row[1] for row in rows} == {"SP-20-00463", "SP-20-00464", "SP-20-00465"}
+    assert all(Path(row[3]).exists() for row in rows)
+    assert input_dir.joinpath("SP-20-00466_part-A.jpg").exists()
+
+    # the renamed files are ignored and can be decoded
+    decode_files(database_file, dry_run=True)
+
+
+def test_dry_run(input_dir, tmp_path) -> None:
+    """Nothing is written or renamed in a dry run."""
+    database_file = tmp_path.joinpath("deity.db")
+    stop = threading.Event()
+    stop.set()
+    stats = Watcher(input_dir, database_file, extension="txt", dry_run=True).run(stop)
+    assert stats["encoded"] == 1
+    assert stats["renamed"] == 0
+    assert not database_file.exists()
+    assert input_dir.joinpath("SP-20-00463_part-A.txt").exists()